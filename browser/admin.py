@@ -4,7 +4,9 @@ from django.contrib import admin
 from django.db import models
 from django.forms.widgets import Textarea
 
-from browser.models import Gene, MeshTerm, Upload, SearchCriteria, SearchResult, Message
+from browser.matching import cancel_search
+from browser.models import Gene, MeshTerm, Upload, SearchCriteria, SearchResult, SearchStageTiming, Message
+from browser.queues import dispatch_searches
 
 @admin.register(Upload)
 class UploadAdmin(admin.ModelAdmin):
@@ -31,9 +33,28 @@ class MeshTermAdmin(admin.ModelAdmin):
     search_fields = ('term', 'year', )
     readonly_fields = ('term', 'parent', 'tree_number', 'year', )
 
+class SearchStageTimingInline(admin.TabularInline):
+    model = SearchStageTiming
+    readonly_fields = ('stage', 'outcome', 'wall_time', 'cpu_time', 'citation_count', 'citations_per_second', 'peak_rss', )
+    exclude = ('position', )
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.action(description="Cancel selected searches")
+def cancel_searches(modeladmin, request, queryset):
+    cancelled_count = len([search_result for search_result in queryset if cancel_search(search_result)])
+    if cancelled_count:
+        dispatch_searches()
+    modeladmin.message_user(request, "%d searches cancelled" % cancelled_count)
+
 @admin.register(SearchResult)
 class SearchResultAdmin(admin.ModelAdmin):
     exclude = ('results', )
+    inlines = (SearchStageTimingInline, )
+    actions = (cancel_searches, )
     search_fields = ('criteria__upload__user__email', 'criteria__upload__user__username', 'filename_stub')
     readonly_fields = ('mesh_filter', 'has_completed', 'filename_stub', 'started_processing', 'ended_processing', 'mediator_match_counts', 'mediator_match_counts_v3', 'mediator_match_counts_v4', 'has_edge_file_changed')
     raw_id_fields = ('criteria', )
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""Compact columnar store of the citations parsed from an Upload's abstracts file.
+
+The store is built once, the first time an upload is searched, and holds only what matching needs:
+
+    <upload>.citations.npz          NumPy arrays of citation ids, abstract offsets and lengths, MeSH heading token ids
+                                    and an inverted index of the citation ordinals with each MeSH heading token
+    <upload>.citations.abstracts    Abstract field contents, concatenated as parsed and zlib compressed in blocks
+    <upload>.citations.genes.npz    Optional gene mention index, i.e. which gene symbols and synonyms occur in each abstract
+
+Later searches of the same upload stream citations from the store instead of re-parsing and re-tokenising the text,
+or when there are no genes to search for, or the gene mention index has been built, use the indexes without reading
+each citation.
+
+NB: Abstracts are copied, as the fields of citations are parsed from continuation lines and compressed uploads can
+    not be read from an offset, but compressed so that the copy takes a fraction of the space of the upload.
+    The store files are deleted along with the upload, see browser.models.Upload.delete.
+"""
+from array import array
+import logging
+import os
+import zlib
+
+import numpy as np
+
+from browser.matchers import GeneMatcher
+
+logger = logging.getLogger(__name__)
+
+# Increment when the contents of the store change so that stores built by earlier versions are rebuilt
+CITATION_STORE_VERSION = 3
+CITATION_STORE_SUFFIX = ".citations.npz"
+CITATION_STORE_ABSTRACTS_SUFFIX = ".citations.abstracts"
+GENE_MENTION_INDEX_SUFFIX = ".citations.genes.npz"
+# Minimum size of the uncompressed abstracts in each compressed block of the abstracts file
+ABSTRACT_BLOCK_SIZE = 256 * 1024
+
+
+def citation_store_paths(file_path):
+    """Return the paths of the store files for an abstracts file, the gene mention index may not have been created."""
+    return (file_path + CITATION_STORE_SUFFIX, file_path + CITATION_STORE_ABSTRACTS_SUFFIX, file_path + GENE_MENTION_INDEX_SUFFIX)
+
+
+def _pack(values):
+    """Concatenate a list of byte strings into a uint8 array and an array of offsets, with one more entry than values."""
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in values], dtype=np.int64)
+    return np.frombuffer(b"".join(values), dtype=np.uint8), offsets
+
+
+def _unpack(data, offsets):
+    """Reverse of _pack."""
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[index]:offsets[index + 1]] for index in range(len(offsets) - 1)]
+
+
+def _source_mtime(file_path):
+    """Modification time of an abstracts file in nanoseconds, recorded so that a replaced file of the same size is noticed."""
+    return os.stat(file_path).st_mtime_ns
+
+
+class AbstractBlocksReader:
+    """Read abstracts by their offsets in the uncompressed concatenation of abstracts from a file of zlib compressed blocks.
+
+    Abstracts do not span blocks, and the last block read is kept, as abstracts are read in citation order.
+    """
+
+    def __init__(self, abstracts_path, block_starts, block_offsets):
+        self.abstractfile = open(abstracts_path, 'rb')
+        self.block_starts = block_starts
+        self.block_offsets = block_offsets
+        self.block_start = None
+        self.block = b""
+
+    def read(self, offset, length):
+        """Return length bytes of the abstracts starting at the uncompressed offset."""
+        if self.block_start is None or not self.block_start <= offset < self.block_start + len(self.block):
+            block_id = int(np.searchsorted(self.block_starts, offset, side="right")) - 1
+            self.abstractfile.seek(int(self.block_offsets[block_id]))
+            self.block = zlib.decompress(self.abstractfile.read(int(self.block_offsets[block_id + 1] - self.block_offsets[block_id])))
+            self.block_start = int(self.block_starts[block_id])
+        return self.block[offset - self.block_start:offset - self.block_start + length]
+
+    def close(self):
+        self.abstractfile.close()
+
+
+class StoredCitation:
+    """Citation streamed from a CitationStore, only the identifier and abstract fields are available.
+
+    Provides the same interface as browser.matching.Citation as used by the matching code.
+    """
+
+    def __init__(self, id, fields, mesh_tokens, offset=None):
+        self.id = id
+        self.fields = fields
+        self._mesh_tokens = mesh_tokens
+        self.offset = offset
+
+    def get_mesh_tokens(self, fieldname):
+        """Return the set of MeSH heading tokens, or None when the citation had no MeSH headings field."""
+        return self._mesh_tokens
+
+
+class CitationStore:
+    """Read access to a citation store created by CitationStore.create.
+
+    Arrays are only loaded from the store file when first used, e.g. a mediator only search uses the
+    inverted MeSH heading index without loading each citation's tokens or abstract offsets.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.store_path, self.abstracts_path, self.gene_mention_index_path = citation_store_paths(file_path)
+        self._arrays = dict()
+        self.version = int(self._load("version"))
+        self.source_size = int(self._load("source_size"))
+        self.source_mtime = int(self._load("source_mtime"))
+        self.unique_id_field, self.mesh_field, self.abstract_field = self._load("field_names").tolist()
+        self._tokens = None
+        self._token_ids = None
+
+    def _load(self, name):
+        """Return an array from the store file, loading it on first use."""
+        if name not in self._arrays:
+            with np.load(self.store_path) as store:
+                self._arrays[name] = store[name]
+        return self._arrays[name]
+
+    def __len__(self):
+        return len(self._load("source_offsets"))
+
+    @property
+    def has_id(self):
+        """Boolean array of whether each citation has a unique identifier."""
+        return self._load("has_id")
+
+    @property
+    def has_mesh(self):
+        """Boolean array of whether each citation has a MeSH headings field."""
+        return self._load("has_mesh")
+
+    @property
+    def tokens(self):
+        """List of the lower cased MeSH heading tokens found in the file, indexed by token id."""
+        if self._tokens is None:
+            self._tokens = _unpack(self._load("token_data"), self._load("token_offsets"))
+        return self._tokens
+
+    def is_current(self):
+        """Whether the store was built by this version of the code from the abstracts file as it is now."""
+        return (self.version == CITATION_STORE_VERSION and self.source_size == os.path.getsize(self.file_path) and
+                self.source_mtime == _source_mtime(self.file_path))
+
+    def ordinals(self, start=0, end=None):
+        """Return the range of citation ordinals that started within the byte range start to end of the abstracts file."""
+        source_offsets = self._load("source_offsets")
+        first = int(np.searchsorted(source_offsets, start, side="left"))
+        last = len(source_offsets) if end is None else int(np.searchsorted(source_offsets, end, side="left"))
+        return range(first, last)
+
+    def find_citation_boundaries(self, shard_count=1):
+        """Split the abstracts file into at most shard_count byte ranges with similar numbers of citations.
+
+        Returns a list of (start, end) offsets, as per browser.matching.find_citation_boundaries.
+        NB: The last range ends at None, i.e. the end of the file, as offsets in compressed files are after decompression."""
+        source_offsets = self._load("source_offsets")
+        boundaries = [0, ]
+        for ordinals in np.array_split(np.arange(len(source_offsets)), max(min(shard_count, len(source_offsets)), 1))[1:]:
+            boundaries.append(int(source_offsets[ordinals[0]]))
+        boundaries.append(None)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def get_ids(self, ordinals):
+        """Return the unique identifiers of the citations with the given ordinals."""
+        id_data = self._load("id_data").tobytes()
+        id_offsets = self._load("id_offsets")
+        return [id_data[id_offsets[ordinal]:id_offsets[ordinal + 1]] for ordinal in ordinals]
+
+    def postings(self, token):
+        """Return the sorted ordinals of the citations with a MeSH heading token, from the inverted index."""
+        if self._token_ids is None:
+            self._token_ids = dict((value, token_id) for token_id, value in enumerate(self.tokens))
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            return np.zeros(0, dtype=np.int32)
+        postings_offsets = self._load("postings_offsets")
+        return self._load("postings")[postings_offsets[token_id]:postings_offsets[token_id + 1]]
+
+    def _open_abstracts(self):
+        """Return an AbstractBlocksReader for the store's abstracts file."""
+        return AbstractBlocksReader(self.abstracts_path, self._load("abstract_block_starts"), self._load("abstract_block_offsets"))
+
+    def abstracts(self):
+        """Yield the ordinal and abstract of each citation with an abstract."""
+        abstract_offsets = self._load("abstract_offsets")
+        abstract_lengths = self._load("abstract_lengths")
+        abstractfile = self._open_abstracts()
+        for ordinal in np.flatnonzero(abstract_lengths >= 0).tolist():
+            yield ordinal, abstractfile.read(int(abstract_offsets[ordinal]), int(abstract_lengths[ordinal]))
+        abstractfile.close()
+
+    def citations(self, start=0, end=None):
+        """Yield a StoredCitation for each citation that started within the byte range start to end of the abstracts file."""
+        tokens = self.tokens
+        citation_numbers = self._load("citation_numbers")
+        has_id = self.has_id
+        id_data = self._load("id_data").tobytes()
+        id_offsets = self._load("id_offsets")
+        abstract_offsets = self._load("abstract_offsets")
+        abstract_lengths = self._load("abstract_lengths")
+        has_mesh = self.has_mesh
+        mesh_token_offsets = self._load("mesh_token_offsets")
+        mesh_token_ids = self._load("mesh_token_ids")
+        source_offsets = self._load("source_offsets")
+
+        abstractfile = self._open_abstracts()
+        for ordinal in self.ordinals(start, end):
+            fields = dict()
+            if has_id[ordinal]:
+                fields[self.unique_id_field] = id_data[id_offsets[ordinal]:id_offsets[ordinal + 1]]
+            abstract_length = int(abstract_lengths[ordinal])
+            if abstract_length >= 0:
+                fields[self.abstract_field] = abstractfile.read(int(abstract_offsets[ordinal]), abstract_length)
+            mesh_tokens = None
+            if has_mesh[ordinal]:
+                token_ids = mesh_token_ids[mesh_token_offsets[ordinal]:mesh_token_offsets[ordinal + 1]]
+                mesh_tokens = set(tokens[token_id] for token_id in token_ids.tolist())
+            yield StoredCitation(int(citation_numbers[ordinal]), fields, mesh_tokens, int(source_offsets[ordinal]))
+        abstractfile.close()
+
+    @classmethod
+    def create(cls, file_path, citations, unique_id_field, mesh_field, abstract_field):
+        """Write a store for the abstracts file at file_path from the Citations parsed from it, and return it.
+
+        Files are written under temporary names and then renamed, so a partially written store is never read.
+        Abstracts are compressed in blocks of at least ABSTRACT_BLOCK_SIZE bytes, see AbstractBlocksReader.
+        """
+        store_path, abstracts_path, gene_mention_index_path = citation_store_paths(file_path)
+        temporary_suffix = ".%d.tmp" % os.getpid()
+
+        citation_numbers = array('q')
+        source_offsets = array('q')
+        has_id = array('b')
+        ids = list()
+        abstract_offsets = array('q')
+        abstract_lengths = array('q')
+        has_mesh = array('b')
+        mesh_token_offsets = array('q', [0, ])
+        mesh_token_ids = array('i')
+        token_ids = dict()
+        abstract_block_starts = array('q', [0, ])
+        abstract_block_offsets = array('q', [0, ])
+        # Modification time before parsing, so that the store is not current if the file changes while it is read
+        source_mtime = _source_mtime(file_path)
+
+        temporary_paths = (abstracts_path + temporary_suffix, store_path + temporary_suffix)
+        try:
+            abstract_offset = 0
+            block = list()
+            block_size = 0
+
+            def write_block(abstractfile):
+                compressed_block = zlib.compress(b"".join(block))
+                abstractfile.write(compressed_block)
+                abstract_block_starts.append(abstract_offset)
+                abstract_block_offsets.append(abstract_block_offsets[-1] + len(compressed_block))
+                block.clear()
+
+            with open(abstracts_path + temporary_suffix, 'wb') as abstractfile:
+                for citation in citations:
+                    citation_numbers.append(citation.id)
+                    source_offsets.append(citation.offset)
+
+                    citation_id = citation.fields.get(unique_id_field)
+                    has_id.append(citation_id is not None)
+                    ids.append(citation_id or b"")
+
+                    abstract = citation.fields.get(abstract_field)
+                    abstract_offsets.append(abstract_offset)
+                    if abstract is None:
+                        abstract_lengths.append(-1)
+                    else:
+                        abstract_lengths.append(len(abstract))
+                        block.append(abstract)
+                        block_size += len(abstract)
+                        abstract_offset += len(abstract)
+                        if block_size >= ABSTRACT_BLOCK_SIZE:
+                            write_block(abstractfile)
+                            block_size = 0
+
+                    mesh_tokens = citation.get_mesh_tokens(mesh_field)
+                    has_mesh.append(mesh_tokens is not None)
+                    for token in mesh_tokens or ():
+                        mesh_token_ids.append(token_ids.setdefault(token, len(token_ids)))
+                    mesh_token_offsets.append(len(mesh_token_ids))
+                if block:
+                    write_block(abstractfile)
+
+            id_data, id_offsets = _pack(ids)
+            token_data, token_offsets = _pack(list(token_ids))
+            mesh_token_offsets = np.frombuffer(mesh_token_offsets, dtype=np.int64)
+            mesh_token_ids = np.frombuffer(mesh_token_ids, dtype=np.int32)
+
+            # Inverted index of the sorted ordinals of the citations with each token
+            token_ordinals = np.repeat(np.arange(len(citation_numbers), dtype=np.int32), np.diff(mesh_token_offsets))
+            postings = token_ordinals[np.argsort(mesh_token_ids, kind="stable")]
+            postings_offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+            postings_offsets[1:] = np.cumsum(np.bincount(mesh_token_ids, minlength=len(token_ids)))
+            with open(store_path + temporary_suffix, 'wb') as storefile:
+                np.savez(storefile,
+                         version=np.int64(CITATION_STORE_VERSION),
+                         source_size=np.int64(os.path.getsize(file_path)),
+                         source_mtime=np.int64(source_mtime),
+                         field_names=np.array([unique_id_field, mesh_field, abstract_field]),
+                         citation_numbers=np.frombuffer(citation_numbers, dtype=np.int64),
+                         source_offsets=np.frombuffer(source_offsets, dtype=np.int64),
+                         has_id=np.frombuffer(has_id, dtype=np.int8).astype(bool),
+                         id_data=id_data,
+                         id_offsets=id_offsets,
+                         abstract_offsets=np.frombuffer(abstract_offsets, dtype=np.int64),
+                         abstract_lengths=np.frombuffer(abstract_lengths, dtype=np.int64),
+                         abstract_block_starts=np.frombuffer(abstract_block_starts, dtype=np.int64),
+                         abstract_block_offsets=np.frombuffer(abstract_block_offsets, dtype=np.int64),
+                         has_mesh=np.frombuffer(has_mesh, dtype=np.int8).astype(bool),
+                         mesh_token_offsets=mesh_token_offsets,
+                         mesh_token_ids=mesh_token_ids,
+                         token_data=token_data,
+                         token_offsets=token_offsets,
+                         postings=postings,
+                         postings_offsets=postings_offsets)
+
+            os.replace(abstracts_path + temporary_suffix, abstracts_path)
+            os.replace(store_path + temporary_suffix, store_path)
+        except BaseException:
+            # e.g. SearchStopped raised while the citations are being parsed
+            for temporary_path in temporary_paths:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+            raise
+        logger.debug("Created citation store for %s with %d citations and %d MeSH heading tokens", file_path, len(citation_numbers), len(token_ids))
+        return cls(file_path)
+
+
+class GeneMentionIndex:
+    """Sparse matrix of which gene symbols and synonyms occur in each abstract of a CitationStore.
+
+    Held as CSR arrays, citation ordinal => sorted synonym ids, and for look ups by synonym the transposed CSC arrays,
+    synonym id => sorted citation ordinals.  Synonyms are found using the same rules as browser.matchers.GeneMatcher,
+    so a gene is mentioned in a citation when any of its synonyms is.
+    """
+
+    def __init__(self, citation_store):
+        self.citation_store = citation_store
+        self._arrays = dict()
+        with np.load(citation_store.gene_mention_index_path) as index:
+            for name in ("version", "source_size", "source_mtime", "citation_count", "synonym_data", "synonym_offsets",
+                         "indptr", "indices", "postings_offsets", "postings", ):
+                self._arrays[name] = index[name]
+        self.version = int(self._arrays["version"])
+        self.synonym_ids = dict((synonym, synonym_id) for synonym_id, synonym in
+                                enumerate(_unpack(self._arrays["synonym_data"], self._arrays["synonym_offsets"])))
+
+    def is_current(self):
+        """Whether the index was built by this version of the code from the citation store as it is now."""
+        return (self.version == CITATION_STORE_VERSION and int(self._arrays["source_size"]) == self.citation_store.source_size and
+                int(self._arrays["source_mtime"]) == self.citation_store.source_mtime and
+                int(self._arrays["citation_count"]) == len(self.citation_store))
+
+    def covers(self, synonyms):
+        """Whether every one of the synonyms was indexed, i.e. is in the gene file used to build the index."""
+        return all(synonym.encode().lower() in self.synonym_ids for synonym in synonyms if synonym)
+
+    def postings(self, synonyms):
+        """Return the sorted ordinals of the citations with an abstract mentioning any of the synonyms."""
+        postings_offsets = self._arrays["postings_offsets"]
+        postings = self._arrays["postings"]
+        found = [np.zeros(0, dtype=np.int32), ]
+        for synonym in synonyms:
+            synonym_id = self.synonym_ids.get(synonym.encode().lower())
+            if synonym_id is not None:
+                found.append(postings[postings_offsets[synonym_id]:postings_offsets[synonym_id + 1]])
+        return np.unique(np.concatenate(found))
+
+    @classmethod
+    def create(cls, citation_store, synonyms):
+        """Search every abstract in the store for all of the synonyms and write the index, then return it."""
+        # As per GeneMatcher synonyms are matched case insensitively, so index each lower cased synonym once
+        synonym_ids = dict()
+        for synonym in synonyms:
+            if synonym:
+                synonym_ids.setdefault(synonym.encode().lower(), len(synonym_ids))
+        gene_matcher = GeneMatcher([synonym.decode() for synonym in synonym_ids], dict())
+        logger.debug("Searching for %d synonyms in %s", len(synonym_ids), citation_store.file_path)
+
+        citation_count = len(citation_store)
+        indptr = np.zeros(citation_count + 1, dtype=np.int64)
+        indices = array('i')
+        for ordinal, abstract in citation_store.abstracts():
+            indices.extend(sorted(gene_matcher.search(abstract)))
+            indptr[ordinal + 1] = len(indices)
+        # Fill in the offsets for citations without an abstract
+        indptr = np.maximum.accumulate(indptr)
+        indices = np.frombuffer(indices, dtype=np.int32)
+
+        citation_ordinals = np.repeat(np.arange(citation_count, dtype=np.int32), np.diff(indptr))
+        postings = citation_ordinals[np.argsort(indices, kind="stable")]
+        postings_offsets = np.zeros(len(synonym_ids) + 1, dtype=np.int64)
+        postings_offsets[1:] = np.cumsum(np.bincount(indices, minlength=len(synonym_ids)))
+
+        synonym_data, synonym_offsets = _pack(list(synonym_ids))
+        temporary_path = citation_store.gene_mention_index_path + ".%d.tmp" % os.getpid()
+        with open(temporary_path, 'wb') as indexfile:
+            np.savez(indexfile,
+                     version=np.int64(CITATION_STORE_VERSION),
+                     source_size=np.int64(citation_store.source_size),
+                     source_mtime=np.int64(citation_store.source_mtime),
+                     citation_count=np.int64(citation_count),
+                     synonym_data=synonym_data,
+                     synonym_offsets=synonym_offsets,
+                     indptr=indptr,
+                     indices=indices,
+                     postings_offsets=postings_offsets,
+                     postings=postings)
+        os.replace(temporary_path, citation_store.gene_mention_index_path)
+        logger.debug("Created gene mention index for %s with %d mentions", citation_store.file_path, len(indices))
+        return cls(citation_store)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Read user uploaded abstracts files, which are stored as uploaded, i.e. may be gzip or bzip2 compressed.
+
+Compressed files are decompressed as they are read rather than being extracted to disk.
+Results files are also written out with gzip compressed copies, for serving to browsers that accept them.
+"""
+import bz2
+import gzip
+import hashlib
+import os
+import shutil
+
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
+BZIP2_MAGIC_NUMBER = b"BZh"
+COMPRESSED_MIME_TYPES = ('application/gzip', 'application/x-gzip', 'application/bzip', 'application/bzip2', 'application/x-bzip', 'application/x-bzip2')
+DECOMPRESSION_CHUNK_SIZE = 1024 * 1024
+GZIP_SUFFIX = ".gz"
+GZIP_COMPRESSION_LEVEL = 6
+
+
+def get_decompressor(header):
+    """Return the module to decompress a file starting with the bytes header with, or None if it is not compressed."""
+    if header.startswith(GZIP_MAGIC_NUMBER):
+        return gzip
+    if header.startswith(BZIP2_MAGIC_NUMBER):
+        return bz2
+    return None
+
+
+def is_compressed(file_path):
+    """Whether the file at file_path is gzip or bzip2 compressed."""
+    with open(file_path, 'rb') as infile:
+        return get_decompressor(infile.read(len(BZIP2_MAGIC_NUMBER))) is not None
+
+
+def open_abstracts_file(file_path):
+    """Open an abstracts file for reading bytes, decompressing it as it is read if it is compressed."""
+    with open(file_path, 'rb') as infile:
+        decompressor = get_decompressor(infile.read(len(BZIP2_MAGIC_NUMBER)))
+    if decompressor is not None:
+        return decompressor.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+def decompressed_file(file_obj):
+    """Return a file object reading the decompressed bytes of an open, possibly compressed, binary file object.
+
+    NB: The file object is rewound and not closed when the returned file object is closed."""
+    file_obj.seek(0)
+    decompressor = get_decompressor(file_obj.read(len(BZIP2_MAGIC_NUMBER)))
+    file_obj.seek(0)
+    if decompressor is not None:
+        return decompressor.open(file_obj, 'rb')
+    return file_obj
+
+
+class DecompressedFileTooLarge(ValueError):
+    """Raised when a compressed file decompresses to more than the maximum size allowed."""
+
+
+def check_decompresses(file_obj, max_size=None):
+    """Read through the whole of a compressed file object, raising OSError or EOFError if it is corrupt or truncated,
+    or DecompressedFileTooLarge as soon as more than max_size bytes have been decompressed, returns the decompressed size."""
+    decompressed = decompressed_file(file_obj)
+    size = 0
+    for chunk in iter(lambda: decompressed.read(DECOMPRESSION_CHUNK_SIZE), b""):
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            file_obj.seek(0)
+            raise DecompressedFileTooLarge("Decompressed file is larger than %d bytes" % max_size)
+    file_obj.seek(0)
+    return size
+
+
+def hash_file(file_path):
+    """Return the SHA-256 hex digest of the file at file_path as stored, i.e. without decompressing it."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(DECOMPRESSION_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_gzip_copy(file_path):
+    """Write a gzip compressed copy of the file at file_path alongside it, i.e. to file_path.gz
+
+    NB: No file name or modification time is recorded in the gzip header, so the same content is always compressed to the same bytes."""
+    temporary_path = file_path + GZIP_SUFFIX + ".tmp"
+    with open(file_path, 'rb') as infile, open(temporary_path, 'wb') as outfile:
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=GZIP_COMPRESSION_LEVEL, fileobj=outfile, mtime=0) as compressed:
+            shutil.copyfileobj(infile, compressed, DECOMPRESSION_CHUNK_SIZE)
+    os.replace(temporary_path, file_path + GZIP_SUFFIX)
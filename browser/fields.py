@@ -1,27 +1,23 @@
 import logging
-import os
 
 import magic
-from xtract import xtract
 
 from django import forms
-from django.core.files.uploadedfile import TemporaryUploadedFile
+
+from browser.compression import COMPRESSED_MIME_TYPES, DecompressedFileTooLarge, check_decompresses
 
 logger = logging.getLogger(__name__)
 
 
 class ExtractorFileField(forms.FileField):
-    """Custom extractor field - extracts using third party module 
-    - https://docs.rolln.de/knoppo/xtract/master/index.html"""
-
-    def _create_upload_file_from_path(self, file_path):
-        size = os.path.getsize(file_path)
-        encoding = "utf-8"
-        # Intentionally leave file open for continued processing
-        file_obj = open(file_path, 'rb')
-        upload_file = TemporaryUploadedFile(name=file_path, content_type="text/plain", size=size, charset=encoding, content_type_extra=None)
-        upload_file.file = file_obj
-        return upload_file 
+    """Custom extractor field - checks gzip and bzip2 archives can be extracted.
+
+    Archives are stored as uploaded and decompressed as they are read, see browser.compression,
+    so their decompressed size is limited to max_decompressed_size MB, when given."""
+
+    def __init__(self, *args, max_decompressed_size=None, **kwargs):
+        self.max_decompressed_size = max_decompressed_size
+        super(ExtractorFileField, self).__init__(*args, **kwargs)
 
     def to_python(self, value):
         value = super(ExtractorFileField, self).to_python(value)
@@ -30,10 +26,12 @@ class ExtractorFileField(forms.FileField):
         logger.debug("DEBUG: temp file path %s" % value.temporary_file_path())
         logger.debug("DEBUG: mime %s" % mime_type)
 
-        if mime_type in ('application/gzip', 'application/x-gzip', 'application/bzip', 'application/bzip2', 'application/x-bzip', 'application/x-bzip2'):
+        if mime_type in COMPRESSED_MIME_TYPES:
+            max_size = self.max_decompressed_size * 1024 * 1024 if self.max_decompressed_size else None
             try:
-                extracted_file_path = xtract(value.temporary_file_path())
-                return self._create_upload_file_from_path(extracted_file_path)
+                check_decompresses(value, max_size)
+            except DecompressedFileTooLarge:
+                raise forms.ValidationError("%s is too large once extracted. Please try to upload a file smaller than %sMB when extracted instead." % (value, self.max_decompressed_size))
             except Exception as e:
                 logger.warning("Cannot extract file %s" % e)
                 logger.warning("mime type %s" % mime_type)
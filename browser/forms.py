@@ -19,6 +19,9 @@ from registration.forms import RegistrationFormUniqueEmail
 
 logger = logging.getLogger(__name__)
 
+# Maximum size in MB of uploaded abstracts files, and of compressed abstracts files once extracted
+MAX_UPLOAD_SIZE = 2000
+
 
 class RegistrationCaptchaForm(RegistrationFormUniqueEmail):
     """ TMMA-417: Reduce creation of spam users accounts."""
@@ -30,11 +33,12 @@ class OvidMedLineFileUploadForm(forms.ModelForm):
     abstracts_upload = ExtractorFileField(
         validators=[validate_file_infection,
                     MimetypeValidator(mimetypes=('text/plain', )),
-                    SizeValidator(max_size=2000),
+                    SizeValidator(max_size=MAX_UPLOAD_SIZE),
                     OvidMedLineFormatValidator(), ],
+        max_decompressed_size=MAX_UPLOAD_SIZE,
         help_text="<br />Ovid MEDLINE® formatted plain text or archive file (*.txt, *.bz, *.gz) which includes MeSH Subject Headings. \
                    Example format <a href=\"" + settings.STATIC_URL + "text/example-file-upload.txt\">with MeSH Subject \
-                   Headings</a>. Maximum upload file size: 2000 MB.")
+                   Headings</a>. Maximum upload file size: 2000 MB, including once extracted.")
 
     class Meta:
         model = Upload
@@ -46,11 +50,12 @@ class PubMedFileUploadForm(forms.ModelForm):
     abstracts_upload = ExtractorFileField(
         validators=[validate_file_infection,
                     MimetypeValidator(mimetypes=('text/plain', )),
-                    SizeValidator(max_size=2000),
+                    SizeValidator(max_size=MAX_UPLOAD_SIZE),
                     PubMedFormatValidator(), ],
+        max_decompressed_size=MAX_UPLOAD_SIZE,
         help_text="<br />PubMed® formatted plain text or archive file (*.txt, *.bz, *.gz) which includes MH (Mesh Headers). \
                    Example format <a href=\"" + settings.STATIC_URL + "text/example-file-upload-b.txt\">with MH (Mesh Headers)</a>. \
-                   Maximum upload file size: 2000 MB.")
+                   Maximum upload file size: 2000 MB, including once extracted.")
 
     class Meta:
         model = Upload
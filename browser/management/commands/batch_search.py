@@ -0,0 +1,46 @@
+"""Management command that runs several searches of the same upload as one batch, reading the upload once."""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from browser.models import SearchResult
+from browser.queues import claim_batch_search, enqueue_batch_search, run_batch_search, scheduler_lock
+
+
+class Command(BaseCommand):
+    """Django management command wrapper class."""
+
+    help = 'Runs searches of the same upload that have not started as one batch, matching each citation '\
+           'against every search\'s criteria as the upload is read. '\
+           'Submitted searches are held until their user has fewer than MAX_RUNNING_SEARCHES_PER_USER searches '\
+           'queued or running, then queued. Pass the IDs of held searches, or of queued searches that a worker '\
+           'has not yet started, e.g. as listed on the results page or in the admin, and their queued jobs are '\
+           'removed and replaced by one batch job.'
+
+    def add_arguments(self, parser):
+        """Define command line arguments for management command."""
+        parser.add_argument('search_result_ids', nargs='+', type=int, help='Search results to run')
+        parser.add_argument('--now', action='store_true', help='Run the searches in this process rather than queueing them')
+
+    def handle(self, *args, **options):
+        """Check the searches can be run as a batch, then queue or run them."""
+        search_results = list(SearchResult.objects.filter(id__in=options['search_result_ids']).select_related('criteria__upload').order_by('id'))
+        missing_ids = set(options['search_result_ids']) - set(search_result.id for search_result in search_results)
+        if missing_ids:
+            raise CommandError("Search results not found: %s" % sorted(missing_ids))
+        if len(set(search_result.criteria.upload_id for search_result in search_results)) > 1:
+            raise CommandError("The searches in a batch must all be of the same upload")
+
+        try:
+            if options['now']:
+                with scheduler_lock():
+                    claim_batch_search(search_results)
+            else:
+                enqueue_batch_search(search_results)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['now']:
+            run_batch_search([search_result.id for search_result in search_results])
+            self.stdout.write("Ran %d searches" % len(search_results))
+        else:
+            self.stdout.write("Queued %d searches" % len(search_results))
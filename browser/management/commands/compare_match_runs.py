@@ -0,0 +1,51 @@
+"""Management command that compares the version 1, 3 and 4 edge files of many search results in parallel."""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from browser.matching import find_edge_file_differences
+from browser.models import SearchResult
+
+
+class Command(BaseCommand):
+    """Django management command wrapper class."""
+
+    help = 'Compares the version 1, 3 and 4 edge files of all, or the selected, completed search results '\
+           'and records which have changed.'
+
+    def add_arguments(self, parser):
+        """Define optional command line arguments for management command."""
+        parser.add_argument('search_result_ids', nargs='*', type=int, help='Only compare these search results')
+        parser.add_argument('--user', help='Only compare search results for this username')
+        parser.add_argument('--workers', type=int, default=None, help='Number of processes, defaults to settings.COMPARE_MATCH_RUNS_WORKERS or the number of CPUs')
+        parser.add_argument('--dry-run', action='store_true', help='Report differences without updating search results')
+
+    def handle(self, *args, **options):
+        """Compare the edge files of search results with previous match counts and bulk update those that have changed."""
+        search_results = SearchResult.objects.filter(has_completed=True, filename_stub__isnull=False)
+        search_results = search_results.filter(Q(mediator_match_counts__isnull=False) | Q(mediator_match_counts_v3__isnull=False))
+        if options['search_result_ids']:
+            search_results = search_results.filter(id__in=options['search_result_ids'])
+        if options['user']:
+            search_results = search_results.filter(criteria__upload__user__username=options['user'])
+        values = search_results.order_by('id').values_list('id', 'filename_stub', 'mediator_match_counts', 'mediator_match_counts_v3')
+
+        differences = find_edge_file_differences(values, options['workers'])
+
+        changed_ids = [search_result_id for search_result_id, has_edge_file_changed, error in differences if has_edge_file_changed]
+        errors = [(search_result_id, error) for search_result_id, has_edge_file_changed, error in differences if error]
+        unchanged_count = len([search_result_id for search_result_id, has_edge_file_changed, error in differences if not (has_edge_file_changed or error)])
+        if changed_ids and not options['dry_run']:
+            changed = list(SearchResult.objects.filter(id__in=changed_ids, has_edge_file_changed=False))
+            for search_result in changed:
+                search_result.has_edge_file_changed = True
+            SearchResult.objects.bulk_update(changed, ['has_edge_file_changed'], batch_size=500)
+
+        self.stdout.write("Compared edge files for %d search results" % len(differences))
+        self.stdout.write("Unchanged: %d" % unchanged_count)
+        self.stdout.write("Changed: %d %s" % (len(changed_ids), changed_ids))
+        self.stdout.write("Errors: %d" % len(errors))
+        for search_result_id, error in errors:
+            self.stdout.write("Search result %d: %s" % (search_result_id, error))
+        if options['dry_run']:
+            self.stdout.write("Dry run, no search results were updated")
@@ -0,0 +1,16 @@
+"""Management command that queues held searches, run periodically in case a search's RQ work-horse is killed."""
+
+from django.core.management.base import BaseCommand
+
+from browser.queues import dispatch_searches
+
+
+class Command(BaseCommand):
+    """Django management command wrapper class."""
+
+    help = 'Queues searches held by the scheduler for users with fewer than MAX_RUNNING_SEARCHES_PER_USER searches '\
+           'queued or running, not counting searches whose jobs have failed.'
+
+    def handle(self, *args, **options):
+        """Dispatch held searches."""
+        dispatch_searches()
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Precompiled matchers used by the abstract matching code in browser.matching.
+
+The matchers are built once per search and then applied to every citation, rather than
+compiling regular expressions per gene, synonym and citation.
+"""
+from collections import deque
+import hashlib
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Gene symbols guidance ref https://www.genenames.org/about/guidelines/#!/#tocAnchor-1-8
+GENE_WORD_CHARACTERS = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789#@_")
+
+
+class GeneMatcher:
+    """Aho-Corasick automaton built from every synonym of the selected genes.
+
+    Each abstract is scanned once, case insensitively, and a hit is only accepted when it is surrounded by
+    characters outside of [A-Za-z0-9#@_], mirroring the rules used by browser.matching.searchgene.
+
+    Each gene is searched for by its synonyms in gene_synonyms, as per expand_gene_synonyms, or by its own name
+    when it has none.
+    """
+
+    def __init__(self, genelist, gene_synonyms):
+        self.genelist = tuple(genelist)
+        # Trie held as parallel lists indexed by node number, node 0 is the root
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self._pattern_lengths = []
+        self._pattern_rows = []
+
+        pattern_ids = {}
+        for row_id, gene in enumerate(self.genelist):
+            for synonym in gene_synonyms.get(gene, (gene, )):
+                pattern = synonym.encode().lower()
+                if not pattern:
+                    continue
+                if pattern not in pattern_ids:
+                    pattern_ids[pattern] = self._add_pattern(pattern)
+                self._pattern_rows[pattern_ids[pattern]].add(row_id)
+
+        self._pattern_rows = [frozenset(rows) for rows in self._pattern_rows]
+        self._build_failure_links()
+        logger.debug("Built gene matcher for %d genes from %d synonyms with %d nodes", len(self.genelist), len(pattern_ids), len(self._goto))
+
+    def _add_pattern(self, pattern):
+        """Add a lower cased byte string to the trie and return its pattern id."""
+        node = 0
+        for character in pattern:
+            next_node = self._goto[node].get(character)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[node][character] = next_node
+            node = next_node
+
+        pattern_id = len(self._pattern_lengths)
+        self._pattern_lengths.append(len(pattern))
+        self._pattern_rows.append(set())
+        self._output[node] = self._output[node] + (pattern_id, )
+        return pattern_id
+
+    def _build_failure_links(self):
+        """Breadth first pass to link each node to its longest proper suffix in the trie."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for character, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and character not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(character, 0)
+                # Inherit any patterns that end at the suffix node
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def __len__(self):
+        return len(self._pattern_lengths)
+
+    def search(self, texttosearch):
+        """Return the set of genelist row indices with a synonym found in the bytes texttosearch."""
+        rows = set()
+        if not self._pattern_lengths:
+            return rows
+
+        text = texttosearch.lower()
+        text_length = len(text)
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        pattern_lengths = self._pattern_lengths
+        pattern_rows = self._pattern_rows
+        word_characters = GENE_WORD_CHARACTERS
+        remaining = len(self.genelist)
+
+        node = 0
+        for position, character in enumerate(text):
+            while node and character not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(character, 0)
+            if output[node]:
+                end = position + 1
+                # A boundary character is required after the match
+                if end >= text_length or text[end] in word_characters:
+                    continue
+                for pattern_id in output[node]:
+                    start = end - pattern_lengths[pattern_id]
+                    # ... and before the match
+                    if start > 0 and text[start - 1] not in word_characters:
+                        new_rows = pattern_rows[pattern_id] - rows
+                        if new_rows:
+                            rows |= new_rows
+                            remaining -= len(new_rows)
+                            if not remaining:
+                                return rows
+        return rows
+
+    def matching_genes(self, texttosearch):
+        """Return the set of gene names with a synonym found in the bytes texttosearch."""
+        return set(self.genelist[row_id] for row_id in self.search(texttosearch))
+
+
+MESH_TERM_DELIMITER = b";"
+MESH_HEADING_START_CHARACTERS = b"*/["
+MESH_HEADING_END_CHARACTERS = b"/]"
+MESH_HEADING_PUNCTUATION = re.compile(rb"[*/\[\]]")
+
+
+def mesh_term_key(mesh_term):
+    """Normalise a MeSH term for look ups in the token sets created by mesh_heading_tokens."""
+    return mesh_term.encode().lower()
+
+
+def mesh_heading_tokens(mesh_subject_headings):
+    """Parse a citation's delimited MeSH Subject Headings/MH field into a set of lower cased heading tokens.
+
+    Each heading is recorded between semicolons, e.g. ;*Adenosine/ad [Administration & Dosage]; and as per
+    ovid_prepare_mesh_term_search_text_function a term matches any part of a heading that is preceded by
+    ; * / or [ and followed by ; / or ], so all such parts are included, e.g. adenosine, ad [administration & dosage
+    and administration & dosage.
+
+    NB: MeSH terms do not contain the semicolon delimiter added by the citation readers.
+    """
+    tokens = set()
+    segments = mesh_subject_headings.lower().split(MESH_TERM_DELIMITER)
+    last_segment = len(segments) - 1
+    for index, segment in enumerate(segments):
+        if not segment:
+            continue
+        # Positions where a token may start or end, allowing for the semicolons either side of the heading
+        starts = [0] if index > 0 else []
+        ends = [len(segment)] if index < last_segment else []
+        for punctuation in MESH_HEADING_PUNCTUATION.finditer(segment):
+            if punctuation.group() in MESH_HEADING_START_CHARACTERS:
+                starts.append(punctuation.end())
+            if punctuation.group() in MESH_HEADING_END_CHARACTERS:
+                ends.append(punctuation.start())
+        for start in starts:
+            for end in ends:
+                if end > start:
+                    tokens.add(segment[start:end])
+    return tokens
+
+
+class MeshTermIndex:
+    """Look up the positions of selected MeSH terms in a set of heading tokens.
+
+    Cost scales with the number of headings per citation, rather than the number of selected terms.
+    """
+
+    def __init__(self, mesh_terms):
+        self.mesh_terms = tuple(mesh_terms)
+        self._positions = {}
+        for position, mesh_term in enumerate(self.mesh_terms):
+            self._positions.setdefault(mesh_term_key(mesh_term), []).append(position)
+
+    def __len__(self):
+        return len(self.mesh_terms)
+
+    def matches(self, tokens):
+        """Return a sorted list of the positions of terms found in tokens."""
+        positions = []
+        if len(tokens) < len(self._positions):
+            for token in tokens:
+                if token in self._positions:
+                    positions.extend(self._positions[token])
+        else:
+            for key, key_positions in self._positions.items():
+                if key in tokens:
+                    positions.extend(key_positions)
+        positions.sort()
+        return positions
+
+
+def expand_gene_synonyms(genelist, synonymlookup, synonymlisting):
+    """Return a dictionary of gene name => tuple of the synonyms to search for, as per browser.matching.searchgene.
+
+    NB: As per the original matching code a gene row is matched when any synonym of any gene the
+        gene name is an alias for is found, i.e. synonymlisting[g] for g in synonymlookup[gene]
+    """
+    return dict((gene, tuple(synonym
+                             for matched_gene in synonymlookup.get(gene, (gene, ))
+                             for synonym in synonymlisting.get(matched_gene, (matched_gene, ))))
+                for gene in genelist)
+
+
+# Increment when the contents of MatchPlan change so that plans cached by earlier versions are not reused
+MATCH_PLAN_VERSION = 1
+
+
+def match_plan_key(genelist, exposuremesh, outcomemesh, mediatormesh, mesh_filter):
+    """Hash of the search criteria a MatchPlan is built from, for use in cache keys."""
+    criteria = [MATCH_PLAN_VERSION, list(genelist), list(exposuremesh), list(outcomemesh), list(mediatormesh), mesh_filter or ""]
+    return hashlib.sha256(json.dumps(criteria).encode()).hexdigest()
+
+
+class MatchPlan:
+    """Everything needed to match citations against one set of search criteria, built once per search.
+
+    Rows of the edge matrix are genes then mediators, columns are exposures then outcomes, and gene_synonyms holds the
+    synonyms searched for for each gene, see expand_gene_synonyms.
+    """
+
+    def __init__(self, genelist, gene_synonyms, exposuremesh, outcomemesh, mediatormesh, mesh_filter):
+        self.genelist = tuple(genelist)
+        self.exposuremesh = tuple(exposuremesh)
+        self.outcomemesh = tuple(outcomemesh)
+        self.mediatormesh = tuple(mediatormesh)
+        self.mesh_filter = mesh_filter or ""
+        self.key = match_plan_key(self.genelist, self.exposuremesh, self.outcomemesh, self.mediatormesh, self.mesh_filter)
+
+        self.row_labels = self.genelist + self.mediatormesh
+        self.column_labels = self.exposuremesh + self.outcomemesh
+        self.row_ids = dict((label, row_id) for row_id, label in enumerate(self.row_labels))
+        self.column_ids = dict((label, column_id) for column_id, label in enumerate(self.column_labels))
+        self.first_mediator_row_id = len(self.genelist)
+
+        # Synonyms of each gene, compiled into a single automaton
+        self.gene_synonyms = dict((gene, tuple(gene_synonyms.get(gene, (gene, )))) for gene in self.genelist)
+        self.gene_matcher = GeneMatcher(self.genelist, self.gene_synonyms)
+        self.column_index = MeshTermIndex(self.column_labels)
+        self.mediator_index = MeshTermIndex(self.mediatormesh)
+        self.mesh_filter_key = mesh_term_key(self.mesh_filter) if self.mesh_filter else None
+
+    @property
+    def shape(self):
+        """Shape of the edge matrix for this plan."""
+        return (len(self.row_labels), len(self.column_labels))
+
+    def matches_filter(self, mesh_tokens):
+        """Whether a citation's heading tokens include the MeSH filter term, if any."""
+        return not self.mesh_filter_key or self.mesh_filter_key in mesh_tokens
+
+    def match_rows(self, abstract, mesh_tokens):
+        """Return the gene row ids found in the abstract, if any, followed by the mediator row ids found in mesh_tokens."""
+        edge_row_ids = list(self.gene_matcher.search(abstract)) if abstract is not None else list()
+        first_mediator_row_id = self.first_mediator_row_id
+        edge_row_ids.extend(first_mediator_row_id + mediator_position for mediator_position in self.mediator_index.matches(mesh_tokens))
+        return edge_row_ids
+
+    def match_columns(self, mesh_tokens):
+        """Return the exposure then outcome column ids found in mesh_tokens."""
+        return self.column_index.matches(mesh_tokens)
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
+from collections.abc import Mapping
+from contextlib import ExitStack
 import csv
+import glob
+import hashlib
+import json
 import logging
 import math
+import mmap
+import multiprocessing
 from more_itertools import unique_everseen
 import numpy as np
 import os
 import pandas as pd
 import re
+import shutil
 import string
 import sys
 
@@ -16,19 +24,44 @@ from django.db import connection
 # from django.core.mail import send_mail
 from django.utils import timezone
 
-from browser.models import SearchResult, Gene, OVID, PUBMED
+from browser.citation_store import CitationStore, GeneMentionIndex, citation_store_paths
+from browser.compression import is_compressed, open_abstracts_file, write_gzip_copy
+from browser.matchers import MatchPlan, expand_gene_synonyms, match_plan_key, mesh_heading_tokens, mesh_term_key
+from browser.models import SearchResult, Gene, Upload, OVID, PUBMED, CANCELLED
+from browser.pipeline import AGGREGATE, LOAD_CRITERIA, LOAD_SYNONYMS, MATCH, PARSE, WRITE_CSV, WRITE_JSON, StageTimer
+from browser.progress import PROGRESS_CHECK_CITATIONS, ProgressReporter, SearchStopped, clear_cancellation, request_cancellation
+from browser.provenance import PROVENANCE_SUFFIX, EdgeProvenance, EdgeProvenanceBuilder, save_edge_provenance
 
 ERROR_TEXT = b"Error occurred"
 logger = logging.getLogger(__name__)
 TERM_DELIMITER = b";"
+# Non empty lines that do not start with a space, i.e. field names, citation numbers and PubMed field lines.
+# NB: Matching the preceding line feed, rather than using ^ with re.MULTILINE, lets the scan skip between line feeds
+HEADER_LINE_RE = re.compile(rb"\n[\r]*([^ \r\n][^\n]*)")
+FIRST_HEADER_LINE_RE = re.compile(rb"[\r]*([^ \r\n][^\n]*)")
+MATCH_PLAN_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+EDGE_MATRIX_SUFFIX = "_edges.npz"
+# Increment when a change to the matching would change the edge matrices of existing search results,
+# so that their saved edge matrices are no longer reused by edited searches
+MATCHING_VERSION = 1
+# Abstract IDs, edge and JSON results files, which are also written gzip compressed
+RESULTS_FILE_SUFFIXES = ("_abstracts.csv", "_edge.csv", ".json")
+# Unique identifier, MeSH Subject Headings and Abstract field names per file format
+CITATION_FIELD_NAMES = {
+    OVID: (b"Unique Identifier", b"MeSH Subject Headings", b"Abstract"),
+    PUBMED: (b"PMID", b"MH", b"AB"),
+}
 
 
 class Citation:
     """Store data as bytes read from user uploaded files"""
 
-    def __init__(self, id):
+    __slots__ = ("fields", "id", "offset", "currentfield")
+
+    def __init__(self, id, offset=None):
         self.fields = {}
         self.id = id
+        self.offset = offset
 
     def addfield(self, fieldname):
         self.currentfield = fieldname
@@ -37,6 +70,98 @@ class Citation:
     def addfieldcontent(self, fieldcontent):
         self.fields[self.currentfield] += fieldcontent
 
+    def get_mesh_tokens(self, fieldname):
+        """Return the set of MeSH heading tokens, or None when the citation has no MeSH headings field."""
+        if fieldname in self.fields:
+            return mesh_heading_tokens(self.fields[fieldname])
+
+
+class MappedFields(Mapping):
+    """Fields of a citation read from a memory mapped file, held as the (start, end) offsets of each field's content
+    and only copied out, with continuation lines joined, when looked up."""
+
+    __slots__ = ("_data", "_offsets", "_values")
+
+    def __init__(self, data):
+        self._data = data
+        self._offsets = {}
+        self._values = {}
+
+    def addfield(self, fieldname, start, end, materialise):
+        """Record the offsets of a field's content, replacing any earlier content as per Citation.addfield.
+        materialise converts those bytes into the content as read by the eager readers"""
+        self._offsets[fieldname] = (start, end, materialise)
+
+    def __getitem__(self, fieldname):
+        if fieldname not in self._values:
+            start, end, materialise = self._offsets[fieldname]
+            self._values[fieldname] = materialise(self._data[start:end])
+        return self._values[fieldname]
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+class MappedCitation(Citation):
+    """Citation whose fields are materialised from a memory mapped file on demand"""
+
+    __slots__ = ()
+
+    def __init__(self, id, offset, data):
+        self.fields = MappedFields(data)
+        self.id = id
+        self.offset = offset
+
+
+class EdgeAccumulator:
+    """Accumulate edge counts for batches of matched citations.
+
+    Each citation records a row of a boolean gene and mediator indicator matrix and a row of an exposure and
+    outcome indicator matrix, when the batch is full the edge matrix is incremented by rows.T @ cols.
+
+    NB: Counts within a batch are exact as float32, as they can not exceed the batch size.
+    When a provenance builder is given each batch's citations are recorded against the cells they add to,
+    numbered in the order they were added.
+    """
+
+    def __init__(self, edges, batch_size, provenance=None):
+        self.edges = edges
+        self.batch_size = max(int(batch_size), 1)
+        self.provenance = provenance
+        self.rows = np.zeros(shape=(self.batch_size, edges.shape[0]), dtype=np.float32)
+        self.cols = np.zeros(shape=(self.batch_size, edges.shape[1]), dtype=np.float32)
+        self.citation_numbers = np.zeros(self.batch_size, dtype=np.int64)
+        self.papercounter = 0
+        self.citation_count = 0
+        self._size = 0
+
+    def add(self, edge_row_ids, edge_column_ids, citation_number=0):
+        """Record the matched rows and columns for one citation."""
+        self.rows[self._size, edge_row_ids] = 1
+        self.cols[self._size, edge_column_ids] = 1
+        self.citation_numbers[self._size] = citation_number
+        self._size += 1
+        if self._size == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Add the counts for the current batch into the edge matrix."""
+        if not self._size:
+            return
+        rows = self.rows[:self._size]
+        cols = self.cols[:self._size]
+        self.edges += (rows.T @ cols).astype(self.edges.dtype)
+        self.papercounter += int(np.count_nonzero(rows.sum(axis=1)))
+        if self.provenance is not None:
+            self.provenance.add_batch(rows, cols, self.citation_count, self.citation_numbers[:self._size])
+        self.citation_count += self._size
+        rows[:] = 0
+        cols[:] = 0
+        self._size = 0
+
 
 def perform_search(search_result_stub_id):
     """
@@ -51,90 +176,351 @@ def perform_search(search_result_stub_id):
     printedges()
     createjson()
 
+    Now run as the stages in browser.pipeline, each of which is timed:
+    load criteria           get_wcrf_input_variables()
+    load synonyms           get_match_plan()
+    parse                   get_citation_store()
+    match                   countedges_incrementally() or _count_edges_for_plan()
+    aggregate               _write_edge_provenance(), _write_abstract_ids() and save_edge_matrix()
+    write CSV               printedges()
+    write JSON              createjson()
+
     """
     logger.info("BEGIN: perform_search on search result: %d" % search_result_stub_id)
 
     # Get search result
     search_result_stub = SearchResult.objects.get(pk=int(search_result_stub_id))
-    search_result_stub.started_processing = timezone.now()
-    search_result_stub.has_completed = False
-    search_result_stub.save()
+    if not _start_search(search_result_stub):
+        return
+    search_run = SearchRun(search_result_stub)
+    try:
+        _perform_search_run(search_run)
+    except Exception:
+        # Record the stages run, including the one that failed, before the job fails
+        search_run.timer.save(search_result_stub)
+        raise
+    logger.info("END: perform_search")
 
-    # Get main data
-    genelist = search_result_stub.criteria.get_wcrf_input_variables('gene')
-    exposuremesh = search_result_stub.criteria.get_wcrf_input_variables('exposure')
-    outcomemesh = search_result_stub.criteria.get_wcrf_input_variables('outcome')
-    mediatormesh = search_result_stub.criteria.get_wcrf_input_variables('mediator')
-    mesh_filter = search_result_stub.mesh_filter or ""  # Previously hard coded to Human then Humans
-
-    # Constants
-    WEIGHTFILTER = 2
-    GRAPHVIZEDGEMULTIPLIER = 3
-    resultfilename = 'results_' + str(search_result_stub.id) + '_' + mesh_filter.replace(" ", "_").lower() + "_topresults"
-    results_path = settings.RESULTS_PATH
 
-    logger.debug("Set constants")
-    # Get synonyms, edges, identifiers (NOT CURRENTLY IN USE), and citations
-    synonymlookup, synonymlisting = cache.get_or_set("temmpo:generate_synonyms", generate_synonyms, timeout=None)
-    logger.debug("Done synonyms")
-
-    logger.debug(genelist)
-    logger.debug("Exposures")
-    logger.debug(exposuremesh)
-    logger.debug("Mediators")
-    logger.debug(mediatormesh)
-    logger.debug("Outcomes")
-    logger.debug(outcomemesh)
-    edges, identifiers = create_edge_matrix(len(genelist), len(mediatormesh), len(exposuremesh), len(outcomemesh))
-    logger.debug("Done edges and TODO: identifiers")
-
-    abstract_file_path = search_result_stub.criteria.upload.abstracts_upload.path
-    abstract_file_format = search_result_stub.criteria.upload.file_format
-    logger.debug("Read citations START")
-    citations = read_citations(file_path=abstract_file_path, file_format=abstract_file_format)
-    logger.debug("Read citations END")
-
-    # Count edges
+def _perform_search_run(search_run):
+    """Run the parse, match and later stages of a search for perform_search."""
+    timer, progress = search_run.timer, search_run.progress
+
+    # NB: Reading citations stops when the search is cancelled or exceeds its time or memory budget
+    try:
+        progress.check()
+
+        # Parsed citations are stored alongside the upload the first time it is searched
+        logger.debug("Parse citations START")
+        with timer.stage(PARSE) as timing:
+            citation_store = get_citation_store(search_run.abstract_file_path, search_run.abstract_file_format, progress)
+            timing["citation_count"] = len(citation_store)
+        logger.debug("Parse citations END")
+
+        # Count edges, when the search was edited from a previous search of the same upload only the new rows or columns are counted
+        logger.debug("Count edges START")
+        with timer.stage(MATCH) as timing:
+            search_run.start_matching(citation_store)
+            counts = None
+            previous_search_result = get_reusable_search_result(search_run.search_result_stub)
+            if previous_search_result is not None:
+                counts = countedges_incrementally(previous_search_result, search_run.match_plan, search_run.edges,
+                                                  search_run.abstract_file_path, search_run.abstract_file_format, citation_store, progress)
+            if counts is None:
+                counts = _count_edges_for_plan(search_run.match_plan, search_run.edges, search_run.abstract_file_path,
+                                               search_run.abstract_file_format, citation_store, progress)
+            # NB: No citations are read when counting from the upload's indexes
+            papercounter, citation_ids_list, provenance, timing["citation_count"] = counts
+        logger.debug("Count edges END")
+    except SearchStopped as e:
+        search_run.stop(e.reason)
+        return
+
+    search_run.save_results(papercounter, citation_ids_list, provenance)
+
+
+def perform_batch_search(search_result_stub_ids):
+    """Run several searches of the same upload, as per perform_search, reading its citations once.
+
+    Searches whose edges can be counted from the upload's indexes are counted individually, every other search's
+    criteria are matched against each citation as it is read, see _count_edges_for_plans_in_file.
+    NB: Edited searches are counted in full rather than reusing the previous search's edge matrix, as that would
+        need the citations to be read again for their new rows or columns.
+    """
+    logger.info("BEGIN: perform_batch_search on search results: %s" % list(search_result_stub_ids))
+
+    search_result_stubs = list(SearchResult.objects.filter(pk__in=search_result_stub_ids).select_related('criteria__upload').order_by('id'))
+    if len(set(search_result_stub.criteria.upload_id for search_result_stub in search_result_stubs)) > 1:
+        raise ValueError("The searches in a batch must all be of the same upload")
+    search_runs = [SearchRun(search_result_stub) for search_result_stub in search_result_stubs if _start_search(search_result_stub)]
+    try:
+        _perform_batch_search_runs(search_runs)
+    except Exception:
+        # Record the stages run, including the one that failed, before the job fails
+        for search_run in search_runs:
+            search_run.timer.save(search_run.search_result_stub)
+        raise
+    logger.info("END: perform_batch_search")
+
+
+def _perform_batch_search_runs(search_runs):
+    """Run the parse, match and later stages of a batch of searches for perform_batch_search."""
+    if not search_runs:
+        return
+
+    # Searches that are already cancelled or over their time budget are stopped before the citations are read
+    for search_run in list(search_runs):
+        try:
+            search_run.progress.check()
+        except SearchStopped as e:
+            search_run.stop(e.reason)
+            search_runs.remove(search_run)
+    if not search_runs:
+        return
+
+    # Parsed citations are stored alongside the upload the first time it is searched, the time taken is recorded for every search
+    logger.debug("Parse citations START")
+    with ExitStack() as stack:
+        timings = [stack.enter_context(search_run.timer.stage(PARSE)) for search_run in search_runs]
+        citation_store = get_citation_store(search_runs[0].abstract_file_path, search_runs[0].abstract_file_format)
+        for timing in timings:
+            timing["citation_count"] = len(citation_store)
+    logger.debug("Parse citations END")
+
     logger.debug("Count edges START")
-    papercounter, edges, identifiers = countedges(citations, genelist,
-                                                  synonymlookup, synonymlisting,
-                                                  exposuremesh, identifiers,
-                                                  edges, outcomemesh,
-                                                  mediatormesh, mesh_filter,
-                                                  results_path, resultfilename, abstract_file_format)
+    counted_search_runs = list()
+    read_search_runs = list()
+    for search_run in search_runs:
+        use_index, gene_mention_index = _get_covering_gene_mention_index(search_run.match_plan, citation_store)
+        if not use_index:
+            read_search_runs.append(search_run)
+            continue
+        # NB: No citations are read, so these searches are not checked for cancellation again
+        with search_run.timer.stage(MATCH) as timing:
+            search_run.start_matching(citation_store)
+            papercounter, citation_ids_list, provenance = _count_edges_from_index(citation_store, search_run.match_plan, search_run.edges, gene_mention_index)
+        counted_search_runs.append((search_run, (papercounter, citation_ids_list, provenance, None)))
+
+    if read_search_runs:
+        with ExitStack() as stack:
+            timings = [stack.enter_context(search_run.timer.stage(MATCH)) for search_run in read_search_runs]
+            for search_run in read_search_runs:
+                search_run.start_matching(citation_store)
+            counts, citation_count = _count_edges_for_plans_in_file([search_run.match_plan for search_run in read_search_runs],
+                                                                    [search_run.edges for search_run in read_search_runs],
+                                                                    read_search_runs[0].abstract_file_path, read_search_runs[0].abstract_file_format,
+                                                                    citation_store, [search_run.progress for search_run in read_search_runs])
+            for timing, (papercounter, citation_ids_list, provenance, stopped_reason) in zip(timings, counts):
+                timing["citation_count"] = citation_count
+                if stopped_reason is not None:
+                    timing["outcome"] = stopped_reason
+        counted_search_runs.extend(zip(read_search_runs, counts))
     logger.debug("Count edges END")
 
-    # Print edges
-    logger.debug("Print edges START")
-    mediator_match_counts = printedges(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename)
-    logger.debug("Printed %s edges", mediator_match_counts)
-    logger.debug("Print edges END")
+    for search_run, (papercounter, citation_ids_list, provenance, stopped_reason) in counted_search_runs:
+        if stopped_reason is not None:
+            search_run.stop(stopped_reason)
+        else:
+            search_run.save_results(papercounter, citation_ids_list, provenance)
 
-    logger.debug("Create JSON START")
-    createjson(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename)
-    logger.debug("Create JSON  END")
-
-    # Housekeeping
-    # 1 - Mark results done
-    search_result_stub.has_completed = True
-    search_result_stub.filename_stub = resultfilename
-    # 2 - Give end time
-    search_result_stub.ended_processing = timezone.now()
-    # 3 - Record number of mediator matches
-    search_result_stub.mediator_match_counts_v4 = mediator_match_counts
-    # X - Email user
-    # user_email = search_result_stub.criteria.upload.user.email
-    # send_mail('TeMMPo job complete', 'Your TeMMPo search is now complete and the results can be viewed on the TeMMPo web site.', 'webmaster@ilrt.bristol.ac.uk',
-    # [user_email,])
-    # 4 - Save completed search result
-    # NB: Actively refreshing DB connection to handle long processes where the DB connection goes away, only when not in a test.
-    if not connection.in_atomic_block:
-        logger.debug("Refreshing the connection to the database.")
-        connection.close()
+
+def _start_search(search_result_stub):
+    """Record that a search has started, returns False if it does not need to be run,
+       i.e. it was cancelled before it started or the results of an identical search were reused."""
+    if search_result_stub.has_stopped:
+        logger.info("END: search result %d was cancelled before it started" % search_result_stub.id)
+        clear_cancellation(search_result_stub.id)
+        return False
+    search_result_stub.started_processing = timezone.now()
+    search_result_stub.has_completed = False
     search_result_stub.save()
-    # tr.print_diff()
-    logger.debug("Done housekeeping")
-    logger.info("END: perform_search")
+
+    # Link to the results files of an identical completed search rather than running the search again
+    if reuse_identical_search_result(search_result_stub):
+        logger.info("END: search result %d reused the results of an identical search" % search_result_stub.id)
+        return False
+    return True
+
+
+class SearchRun:
+    """The search criteria, match plan, edge matrix, stage timings and progress of a search being run."""
+
+    def __init__(self, search_result_stub):
+        self.search_result_stub = search_result_stub
+        self.timer = StageTimer()
+        self.progress = ProgressReporter(search_result_stub.id)
+
+        # Get main data
+        with self.timer.stage(LOAD_CRITERIA):
+            self.genelist = search_result_stub.criteria.get_wcrf_input_variables('gene')
+            self.exposuremesh = search_result_stub.criteria.get_wcrf_input_variables('exposure')
+            self.outcomemesh = search_result_stub.criteria.get_wcrf_input_variables('outcome')
+            self.mediatormesh = search_result_stub.criteria.get_wcrf_input_variables('mediator')
+            mesh_filter = search_result_stub.mesh_filter or ""  # Previously hard coded to Human then Humans
+            self.abstract_file_path = search_result_stub.criteria.upload.abstracts_upload.path
+            self.abstract_file_format = search_result_stub.criteria.upload.file_format
+
+        # Constants
+        self.resultfilename = get_results_file_name(search_result_stub)
+        self.results_path = settings.RESULTS_PATH
+
+        logger.debug("Set constants")
+        # Get match plan, synonyms, edges, identifiers (NOT CURRENTLY IN USE, see *_provenance.npz), and citations
+        # NB: Synonyms are only loaded when a plan for these search criteria is not already cached,
+        #     the plan's synonyms are already expanded per gene so no further look ups are needed.
+        with self.timer.stage(LOAD_SYNONYMS):
+            self.match_plan = get_match_plan(self.genelist, self.exposuremesh, self.outcomemesh, self.mediatormesh, mesh_filter)
+        logger.debug("Done match plan and synonyms")
+
+        logger.debug(self.genelist)
+        logger.debug("Exposures")
+        logger.debug(self.exposuremesh)
+        logger.debug("Mediators")
+        logger.debug(self.mediatormesh)
+        logger.debug("Outcomes")
+        logger.debug(self.outcomemesh)
+        self.edges, self.identifiers = create_edge_matrix(len(self.genelist), len(self.mediatormesh), len(self.exposuremesh), len(self.outcomemesh))
+        logger.debug("Done edges and TODO: identifiers")
+
+    def start_matching(self, citation_store):
+        """Publish that the search has started matching the upload's citations."""
+        file_size = None if is_compressed(self.abstract_file_path) else os.path.getsize(self.abstract_file_path)
+        self.progress.start_stage(MATCH, file_size, len(citation_store))
+
+    def stop(self, reason):
+        """Record why the search stopped, and free the worker for other searches."""
+        logger.info("Search result %d stopped: %s" % (self.search_result_stub.id, reason))
+        self.search_result_stub.stopped_reason = reason
+        self.search_result_stub.ended_processing = timezone.now()
+        if not connection.in_atomic_block:
+            connection.close()
+        self.search_result_stub.save()
+        self.timer.save(self.search_result_stub)
+        self.progress.finish()
+        clear_cancellation(self.search_result_stub.id)
+
+    def save_results(self, papercounter, citation_ids_list, provenance):
+        """Write the results files for the counted edges and mark the search as completed."""
+        # Constants
+        WEIGHTFILTER = 2
+        GRAPHVIZEDGEMULTIPLIER = 3
+        timer, edges, results_path, resultfilename = self.timer, self.edges, self.results_path, self.resultfilename
+        genelist, mediatormesh, exposuremesh, outcomemesh = self.genelist, self.mediatormesh, self.exposuremesh, self.outcomemesh
+
+        with timer.stage(AGGREGATE):
+            _write_edge_provenance(provenance, citation_ids_list, results_path, resultfilename)
+            _write_abstract_ids(citation_ids_list, results_path, resultfilename)
+            save_edge_matrix(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename, self.match_plan.gene_synonyms)
+        logger.debug("Saved abstract IDs, provenance and edge matrix")
+
+        # Print edges
+        logger.debug("Print edges START")
+        with timer.stage(WRITE_CSV):
+            mediator_match_counts = printedges(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename)
+        logger.debug("Printed %s edges", mediator_match_counts)
+        logger.debug("Print edges END")
+
+        logger.debug("Create JSON START")
+        with timer.stage(WRITE_JSON):
+            createjson(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename)
+            compress_results_files(results_path, resultfilename)
+        logger.debug("Create JSON and compressed results files END")
+
+        # Housekeeping
+        search_result_stub = self.search_result_stub
+        # 1 - Mark results done
+        search_result_stub.has_completed = True
+        search_result_stub.filename_stub = resultfilename
+        # 2 - Give end time
+        search_result_stub.ended_processing = timezone.now()
+        # 3 - Record number of mediator matches and the version of the matching used
+        search_result_stub.mediator_match_counts_v4 = mediator_match_counts
+        search_result_stub.matching_version = MATCHING_VERSION
+        # X - Email user
+        # user_email = search_result_stub.criteria.upload.user.email
+        # send_mail('TeMMPo job complete', 'Your TeMMPo search is now complete and the results can be viewed on the TeMMPo web site.', 'webmaster@ilrt.bristol.ac.uk',
+        # [user_email,])
+        # 4 - Save completed search result
+        # NB: Actively refreshing DB connection to handle long processes where the DB connection goes away, only when not in a test.
+        if not connection.in_atomic_block:
+            logger.debug("Refreshing the connection to the database.")
+            connection.close()
+        search_result_stub.save()
+        # 5 - Record the timing of each stage and remove its progress
+        timer.save(search_result_stub)
+        self.progress.finish()
+        # tr.print_diff()
+        logger.debug("Done housekeeping")
+
+
+def cancel_search(search_result):
+    """Stop a search that has not completed, returns whether it was cancelled.
+
+    A running search stops the next time it checks for cancellation, one that has not started is marked as cancelled."""
+    if not search_result.is_cancellable:
+        return False
+    request_cancellation(search_result.id)
+    if not search_result.has_started:
+        search_result.stopped_reason = CANCELLED
+        search_result.ended_processing = timezone.now()
+        search_result.save()
+    return True
+
+def get_results_file_name(search_result):
+    """Unique part of the results file names for a search result, as recorded in SearchResult.filename_stub"""
+    mesh_filter = search_result.mesh_filter or ""
+    return 'results_' + str(search_result.id) + '_' + mesh_filter.replace(" ", "_").lower() + "_topresults"
+
+def get_search_fingerprint(search_result, content_hash):
+    """Hash of everything that determines a search's results, the upload's content hash and file format, the sorted
+       search criteria, the synonyms matched for each gene, MeSH filter, MeSH terms release year and the matching version."""
+    criteria = search_result.criteria
+    genelist, exposuremesh, outcomemesh, mediatormesh = [criteria.get_wcrf_input_variables(codename) for codename in ('gene', 'exposure', 'outcome', 'mediator')]
+    # NB: Synonyms are read from the gene file, which can change between searches with the same criteria
+    match_plan = get_match_plan(genelist, exposuremesh, outcomemesh, mediatormesh, search_result.mesh_filter or "")
+    fingerprint = [content_hash, criteria.upload.file_format,
+                   [list(exposuremesh), list(mediatormesh), list(outcomemesh), list(genelist)],
+                   [[gene, list(match_plan.gene_synonyms[gene])] for gene in genelist],
+                   search_result.mesh_filter or "", criteria.mesh_terms_year_of_release, MATCHING_VERSION]
+    return hashlib.sha256(json.dumps(fingerprint).encode()).hexdigest()
+
+def reuse_identical_search_result(search_result, calculate_content_hash=True):
+    """Complete a search result using the results files of a completed search result with the same fingerprint, if any.
+
+       Returns whether the search result was completed. The fingerprint is set but not saved otherwise.
+       When calculate_content_hash is False nothing is reused unless the upload's content hash is already known,
+       i.e. the upload is not read, so that this can be called while handling a request."""
+    upload = search_result.criteria.upload
+    if not (calculate_content_hash or upload.content_hash):
+        return False
+    search_result.fingerprint = get_search_fingerprint(search_result, upload.get_content_hash())
+    identical_search_results = SearchResult.objects.filter(fingerprint=search_result.fingerprint, has_completed=True, matching_version=MATCHING_VERSION,
+                                                           filename_stub__isnull=False).exclude(id=search_result.id).order_by('-ended_processing')
+    for identical_search_result in identical_search_results:
+        if os.path.exists('%s%s%s' % (settings.RESULTS_PATH, identical_search_result.filename_stub, EDGE_MATRIX_SUFFIX)):
+            break
+    else:
+        return False
+
+    logger.debug("Reusing results files of identical search result %d" % identical_search_result.id)
+    resultfilename = get_results_file_name(search_result)
+    copy_results_files(settings.RESULTS_PATH, identical_search_result.filename_stub, resultfilename)
+    search_result.started_processing = search_result.started_processing or timezone.now()
+    search_result.ended_processing = timezone.now()
+    search_result.has_completed = True
+    search_result.filename_stub = resultfilename
+    search_result.mediator_match_counts_v4 = identical_search_result.mediator_match_counts_v4
+    search_result.matching_version = MATCHING_VERSION
+    search_result.save()
+    return True
+
+def copy_results_files(results_path, source_file_name, results_file_name):
+    """Copy every results file for one filename stub to the same files for another.
+
+       NB: Files are copied rather than hard linked, as recreate_results_files rewrites a search's results files in place."""
+    source_file_path = results_path + source_file_name
+    for source_path in glob.glob(glob.escape(source_file_path) + '*'):
+        shutil.copyfile(source_path, results_path + results_file_name + source_path[len(source_file_path):])
 
 def generate_synonyms():
     """Create dictionaries of synonyms, genes and look ups.
@@ -164,6 +550,61 @@ def generate_synonyms():
     genefile.close()
     return synonymlookup, synonymlisting
 
+def get_match_plan(genelist, exposuremesh, outcomemesh, mediatormesh, mesh_filter):
+    """Retrieve the MatchPlan for a set of search criteria, memoised in the cache keyed by a hash of the criteria."""
+    def create_match_plan():
+        synonymlookup, synonymlisting = cache.get_or_set("temmpo:generate_synonyms", generate_synonyms, timeout=None)
+        return MatchPlan(genelist, expand_gene_synonyms(genelist, synonymlookup, synonymlisting), exposuremesh, outcomemesh, mediatormesh, mesh_filter)
+
+    key = "temmpo:match_plan:%s" % match_plan_key(genelist, exposuremesh, outcomemesh, mediatormesh, mesh_filter)
+    return cache.get_or_set(key, create_match_plan, timeout=MATCH_PLAN_CACHE_TIMEOUT)
+
+def get_citation_store(file_path, file_format=OVID, progress=None):
+    """Retrieve the CitationStore for an abstracts file, parsing the file to create the store the first time it is used.
+
+    When a ProgressReporter is given the progress of parsing the file is published."""
+    if os.path.exists(citation_store_paths(file_path)[0]):
+        try:
+            citation_store = CitationStore(file_path)
+            if citation_store.is_current():
+                return citation_store
+        except Exception as e:
+            logger.warning("Unable to read citation store for %s: %s" % (file_path, e))
+
+    logger.debug("Create citation store START")
+    citations = read_citations(file_path, file_format)
+    if progress is not None:
+        # NB: Offsets in compressed files are after decompression, so progress is not measured against their size
+        progress.start_stage(PARSE, None if is_compressed(file_path) else os.path.getsize(file_path))
+        citations = progress.track(citations)
+    citation_store = CitationStore.create(file_path, citations, *CITATION_FIELD_NAMES[file_format])
+    logger.debug("Create citation store END")
+    return citation_store
+
+def get_gene_mention_index(citation_store):
+    """Retrieve the GeneMentionIndex for a citation store, or None if it has not been built for the current store."""
+    if os.path.exists(citation_store.gene_mention_index_path):
+        try:
+            gene_mention_index = GeneMentionIndex(citation_store)
+            if gene_mention_index.is_current():
+                return gene_mention_index
+        except Exception as e:
+            logger.warning("Unable to read gene mention index for %s: %s" % (citation_store.file_path, e))
+    return None
+
+def build_gene_mention_index(upload_id):
+    """Background job run after an upload to build its citation store and gene mention index for all known gene synonyms."""
+    logger.info("BEGIN: build_gene_mention_index on upload: %d" % upload_id)
+    upload = Upload.objects.get(pk=int(upload_id))
+    # Also hash the upload, so identical searches of it can be found without reading it, see reuse_identical_search_result
+    upload.get_content_hash()
+    citation_store = get_citation_store(upload.abstracts_upload.path, upload.file_format)
+    if get_gene_mention_index(citation_store) is None:
+        synonymlookup, synonymlisting = cache.get_or_set("temmpo:generate_synonyms", generate_synonyms, timeout=None)
+        synonyms = set(synonym for gene_synonyms in synonymlisting.values() for synonym in gene_synonyms)
+        GeneMentionIndex.create(citation_store, synonyms)
+    logger.info("END: build_gene_mention_index")
+
 def _get_genes_and_mediators(genelist, mediatormesh):
     """Retrieve y axis of matching matrix, genes then mediators"""
     for gene in genelist:
@@ -180,32 +621,99 @@ def create_edge_matrix(gene_count, mediator_count, exposure_count, outcome_count
 
     return edges, identifiers
 
-def read_citations(file_path, file_format=OVID):
-    """ Read the data from either OVID or PUBMED MEDLINE format files """
+def read_citations(file_path, file_format=OVID, start=0, end=None, citation_store=None):
+    """ Read the data from either OVID or PUBMED MEDLINE format files
+
+        Optionally only read the citations starting within the byte range start to end,
+        where start is 0 or an offset found by find_citation_boundaries
+
+        Fields are read from a memory mapped copy of the file and only materialised when looked up,
+        unless the file is compressed, when it is decompressed as it is read line by line,
+        NB: start and end are then offsets in the decompressed file
+        When a CitationStore for the file is supplied citations are streamed from it instead,
+        NB: these only include the fields used for matching """
 
-    if file_format == PUBMED:
-        citations = _pubmed_read_citations(file_path)
+    if citation_store is not None:
+        citations = citation_store.citations(start, end)
+
+    elif file_format == PUBMED:
+        if _can_map_file(file_path):
+            citations = _mapped_pubmed_read_citations(file_path, start, end)
+        else:
+            citations = _pubmed_read_citations(file_path, start, end)
 
     elif file_format == OVID:
-        citations = _ovid_medline_read_citations(file_path)
+        if _can_map_file(file_path):
+            citations = _mapped_ovid_medline_read_citations(file_path, start, end)
+        else:
+            citations = _ovid_medline_read_citations(file_path, start, end)
 
     return citations
 
-def _ovid_medline_read_citations(abstract_file_path):
+def _can_map_file(file_path):
+    """Empty files cannot be memory mapped, and compressed files have to be decompressed as they are read"""
+    return os.path.getsize(file_path) > 0 and not is_compressed(file_path)
+
+def _is_ovid_citation_start(line):
+    """Citations in OVID Medline files start with a numbered line, e.g. <1>"""
+    return line[0:1] == b"<" and line[-1:] == b">" and (line.strip(b"<").strip(b">")).decode("utf-8").isdecimal()
+
+def _is_pubmed_citation_start(line):
+    """Citations in PubMed MEDLINE files start with a PMID line"""
+    return line[0:4] == b"PMID" and ERROR_TEXT not in line
+
+def find_citation_boundaries(file_path, file_format=OVID, shard_count=1):
+    """Split a file into at most shard_count byte ranges of similar size, each starting at the beginning of a citation.
+
+       Returns a list of (start, end) offsets suitable for read_citations.
+       NB: Compressed files cannot be read from an offset without decompressing all of the file before it, so are not split."""
+    if is_compressed(file_path):
+        return [(0, None), ]
+    is_citation_start = _is_pubmed_citation_start if file_format == PUBMED else _is_ovid_citation_start
+    file_size = os.path.getsize(file_path)
+    boundaries = [0, ]
+    with open(file_path, 'rb') as infile:
+        for shard in range(1, shard_count):
+            target = max(file_size * shard // shard_count, boundaries[-1] + 1)
+            infile.seek(target - 1)
+            # Skip to the start of the next line
+            position = target - 1 + len(infile.readline())
+            for line in infile:
+                if is_citation_start(line.strip(b"\r\n")):
+                    boundaries.append(position)
+                    break
+                position += len(line)
+            else:
+                break
+
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _read_lines(infile, start, end):
+    """Yield the byte offset and line for lines from a binary file starting at the byte offset start and before the byte offset end."""
+    infile.seek(start)
+    position = start
+    for line in infile:
+        if end is not None and position >= end:
+            break
+        yield position, line
+        position += len(line)
+
+def _ovid_medline_read_citations(abstract_file_path, start=0, end=None):
     """ Read the Abstract data from an OVID Medline formatted text file.
         Create a generator and yield an instance of the Citation class per item """
-    infile = open(abstract_file_path, 'rb')
+    infile = open_abstracts_file(abstract_file_path)
     citation = None
-    for line in infile:
+    for position, line in _read_lines(infile, start, end):
         line = line.strip(b"\r\n")
         if len(line) == 0:
             pass
-        elif line[0:1] == b"<" and line[-1:] == b">" and (line.strip(b"<").strip(b">")).decode("utf-8").isdecimal():
+        elif _is_ovid_citation_start(line):
             # Starting a new citation, yield if one has already been set up
             if citation:
                 yield citation
             citation_id = int(line.strip(b"<").strip(b">"))
-            citation = Citation(citation_id)
+            citation = Citation(citation_id, position)
         elif line[0:1] != b" ":
             citation.addfield(line)
         else:
@@ -222,7 +730,7 @@ def _ovid_medline_read_citations(abstract_file_path):
 
     infile.close()
 
-def _pubmed_read_citations(abstract_file_path):
+def _pubmed_read_citations(abstract_file_path, start=0, end=None):
     """ Process PubMed MEDLINE formatted abstracts text file
         - code to parse file originally supplied by Benjamin Elsworth
 
@@ -231,9 +739,9 @@ def _pubmed_read_citations(abstract_file_path):
 
     citation = None
     counter = -1
-    infile = open(abstract_file_path, 'rb')
+    infile = open_abstracts_file(abstract_file_path)
 
-    for line in infile:
+    for position, line in _read_lines(infile, start, end):
         line = line.strip(b"\r\n")
         if len(line) == 0 or ERROR_TEXT in line:
             nothing = 0
@@ -244,7 +752,7 @@ def _pubmed_read_citations(abstract_file_path):
 
             in_mesh = False
             citation_id = counter + 1
-            citation = Citation(citation_id)
+            citation = Citation(citation_id, position)
             counter += 1
             citation.addfield(line.split(b"-", 1)[0].strip())
             citation.addfieldcontent(line.split(b"-", 1)[1].strip())
@@ -269,10 +777,142 @@ def _pubmed_read_citations(abstract_file_path):
 
     infile.close()
 
-# TODO: TMM-394 Optimise use of compile for gene matching
+def _map_file(abstract_file_path):
+    """Memory map a file read only, the mapping stays open while any citation read from it is referenced"""
+    with open(abstract_file_path, 'rb') as infile:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _mapped_limit(data, end):
+    """Offset after the line containing the byte before end, i.e. lines starting before end are read as per _read_lines"""
+    if end is None or end >= len(data):
+        return len(data)
+    line_feed = data.find(b"\n", max(end - 1, 0))
+    return len(data) if line_feed == -1 else line_feed + 1
+
+def _header_lines(data, start, limit):
+    """Yield the byte offset, content without surrounding carriage returns, and end offset of each line matching
+    HEADER_LINE_RE starting at or after start and before limit"""
+    first = FIRST_HEADER_LINE_RE.match(data, start) if start < limit else None
+    if first:
+        yield start, first.group(1).rstrip(b"\r"), first.end()
+    for header in HEADER_LINE_RE.finditer(data, start, limit):
+        yield header.start() + 1, header.group(1).rstrip(b"\r"), header.end()
+
+def _content_lines(content):
+    """Lines of a field's content without surrounding carriage returns or line feeds, skipping empty lines as per the eager readers"""
+    return [line for line in [line.strip(b"\r\n") for line in content.split(b"\n")] if line]
+
+def _ovid_mesh_content(content):
+    # Mesh Terms need clear delimiters not found in Mesh Terms to perform clean matching
+    lines = _content_lines(content)
+    if not lines:
+        return b""
+    return TERM_DELIMITER + (TERM_DELIMITER + TERM_DELIMITER).join([line.lstrip() for line in lines]) + TERM_DELIMITER
+
+def _ovid_abstract_content(content):
+    lines = _content_lines(content)
+    if not lines:
+        return b""
+    return b" ".join(lines) + b" "
+
+def _ovid_field_content(content):
+    return b"".join([line.lstrip() for line in _content_lines(content)])
+
+def _mapped_ovid_medline_read_citations(abstract_file_path, start=0, end=None):
+    """ Read the Abstract data from an OVID Medline formatted text file as per _ovid_medline_read_citations, but
+        only scan for field names in a memory mapped copy of the file, recording where each field's content lines are.
+        Create a generator and yield an instance of the MappedCitation class per item """
+    data = _map_file(abstract_file_path)
+    limit = _mapped_limit(data, end)
+    citation = None
+    field = None
+    for position, line, line_end in _header_lines(data, start, limit):
+        if field:
+            citation.fields.addfield(field[0], field[1], position, field[2])
+            field = None
+        if line[0:1] == b"<" and _is_ovid_citation_start(line):
+            # Starting a new citation, yield if one has already been set up
+            if citation:
+                yield citation
+            citation_id = int(line.strip(b"<").strip(b">"))
+            citation = MappedCitation(citation_id, position, data)
+        elif citation:
+            if line == b"MeSH Subject Headings":
+                field = (line, line_end, _ovid_mesh_content)
+            elif line == b"Abstract":
+                field = (line, line_end, _ovid_abstract_content)
+            else:
+                field = (line, line_end, _ovid_field_content)
+
+    # Yield last citation
+    if citation:
+        if field:
+            citation.fields.addfield(field[0], field[1], limit, field[2])
+        yield citation
+
+def _pubmed_field_content(content):
+    """Content of a PubMed field, starting with the line naming the field, plus any following MH or continuation lines"""
+    lines = [line for line in _content_lines(content) if ERROR_TEXT not in line]
+    header = lines[0]
+    if header[0:4] == b"PMID":
+        fieldcontent = [header.split(b"-", 1)[1].strip()]
+    elif header[0:2] == b"MH":
+        fieldcontent = [TERM_DELIMITER + header.split(b"-", 1)[1].strip() + TERM_DELIMITER]
+    elif header.split(b"-", 1)[0].strip() == b"AB":
+        fieldcontent = [header.split(b"-", 1)[1] + b" "]
+    else:
+        fieldcontent = [header.split(b"-", 1)[1].strip() + b" "]
+    for line in lines[1:]:
+        if line[0:2] == b"MH":
+            # Mesh Terms need clear delimiters not found in Mesh Terms to perform clean matching
+            fieldcontent.append(TERM_DELIMITER + line.split(b"-", 1)[1].strip() + TERM_DELIMITER)
+        else:
+            fieldcontent.append(line.strip() + b" ")
+    return b"".join(fieldcontent)
+
+def _mapped_pubmed_read_citations(abstract_file_path, start=0, end=None):
+    """ Process PubMed MEDLINE formatted abstracts text file as per _pubmed_read_citations, but
+        only scan for field names in a memory mapped copy of the file, recording where each field's lines are.
+        Create a generator and yield an instance of the MappedCitation class per item """
+    data = _map_file(abstract_file_path)
+    limit = _mapped_limit(data, end)
+    citation = None
+    counter = -1
+    field = None
+    in_mesh = False
+    for position, line, line_end in _header_lines(data, start, limit):
+        if ERROR_TEXT in line:
+            continue
+        if line[0:2] == b"MH" and in_mesh:
+            # Further MeSH headings are added to the current field
+            continue
+        if field:
+            citation.fields.addfield(field[0], field[1], position, _pubmed_field_content)
+            field = None
+        if line[0:4] == b"PMID":
+            # Starting a new citation, yield if one has already been set up
+            if citation:
+                yield citation
+
+            in_mesh = False
+            counter += 1
+            citation = MappedCitation(counter, position, data)
+        elif not citation:
+            continue
+        elif line[0:2] == b"MH":
+            in_mesh = True
+        field = (line.split(b"-", 1)[0].strip(), position)
+
+    # Yield last citation
+    if citation:
+        if field:
+            citation.fields.addfield(field[0], field[1], limit, _pubmed_field_content)
+        yield citation
+
 def searchgene(texttosearch, searchstring):
     """Return None for no matches >= 0 for match found.
-    Gene symbols guidance ref https://www.genenames.org/about/guidelines/#!/#tocAnchor-1-8"""
+    Gene symbols guidance ref https://www.genenames.org/about/guidelines/#!/#tocAnchor-1-8
+    NB: countedges uses browser.matchers.GeneMatcher which applies the same rules to all synonyms at once."""
     searchstringre = re.compile(b'[^A-Za-z0-9#@_]' + re.escape(searchstring).encode() + b'[^A-Za-z0-9#@_]', re.IGNORECASE)
     return searchstringre.search(texttosearch)
 
@@ -295,116 +935,463 @@ def search_for_mesh_term(mesh_term_search_text, compiled_mesh_term_re):
 
 def countedges(citations, genelist, synonymlookup, synonymlisting, exposuremesh,
                identifiers, edges, outcomemesh, mediatormesh, mesh_filter,
-               results_file_path, results_file_name, file_format=OVID):
+               results_file_path, results_file_name, file_format=OVID, batch_size=None, match_plan=None):
 
-    # Go through and count edges
-    papercounter = 0
-    citation_ids_list = list()
+    if match_plan is None:
+        match_plan = MatchPlan(genelist, expand_gene_synonyms(genelist, synonymlookup, synonymlisting), exposuremesh, outcomemesh, mediatormesh, mesh_filter)
+    papercounter, citation_ids_list, provenance, citation_count = _count_edges_in_citations(citations, match_plan, edges, file_format, batch_size)
+    _write_edge_provenance(provenance, citation_ids_list, results_file_path, results_file_name)
+    _write_abstract_ids(citation_ids_list, results_file_path, results_file_name)
 
-    if file_format == OVID:
-        unique_id = b"Unique Identifier"
-        mesh_subject_headings = b"MeSH Subject Headings"
-        abstract = b"Abstract"
-        prepare_mesh_term_match_text = ovid_prepare_mesh_term_search_text_function
+    return papercounter, edges, identifiers
 
-    elif file_format == PUBMED:
-        unique_id = b"PMID"
-        mesh_subject_headings = b"MH"
-        abstract = b"AB"
-        prepare_mesh_term_match_text = pubmed_prepare_mesh_term_search_text_function
-
-    # Prepare dictionary of compiled regular expressions for reuse in mesh term matching
-    compiled_mesh_term_reg_exp_hash = {}
-    for mesh_term in exposuremesh:
-        compiled_mesh_term_reg_exp_hash[mesh_term] = prepare_mesh_term_match_text(mesh_term)
-    for mesh_term in mediatormesh:
-        compiled_mesh_term_reg_exp_hash[mesh_term] = prepare_mesh_term_match_text(mesh_term)
-    for mesh_term in outcomemesh:
-        compiled_mesh_term_reg_exp_hash[mesh_term] = prepare_mesh_term_match_text(mesh_term)
-    if mesh_filter:
-        compiled_mesh_term_reg_exp_hash[mesh_filter] = prepare_mesh_term_match_text(mesh_filter)
-
-    for citation in citations:
-        countthis = 0
-        edge_row_id = -1
+
+def countedges_in_shards(file_path, genelist, synonymlookup, synonymlisting, exposuremesh,
+                         identifiers, edges, outcomemesh, mediatormesh, mesh_filter,
+                         results_file_path, results_file_name, file_format=OVID, workers=None, batch_size=None,
+                         match_plan=None, citation_store=None):
+    """Parallel version of read_citations followed by countedges.
+
+       The file is split at citation boundaries into one shard per worker process, the shards' edge matrices
+       are summed and their abstract IDs concatenated in file order, giving the same results as countedges.
+
+       When a CitationStore is supplied each worker streams its shard's citations from the store."""
+    if workers is None:
+        workers = settings.MATCHING_WORKERS
+    if batch_size is None:
+        batch_size = settings.MATCHING_BATCH_SIZE
+    if match_plan is None:
+        match_plan = MatchPlan(genelist, expand_gene_synonyms(genelist, synonymlookup, synonymlisting), exposuremesh, outcomemesh, mediatormesh, mesh_filter)
+
+    papercounter, citation_ids_list, provenance = _count_edges_in_shards(file_path, match_plan, edges, file_format, workers, batch_size, citation_store)
+    _write_edge_provenance(provenance, citation_ids_list, results_file_path, results_file_name)
+    _write_abstract_ids(citation_ids_list, results_file_path, results_file_name)
+
+    return papercounter, edges, identifiers
+
+
+def _count_edges_in_shards(file_path, match_plan, edges, file_format, workers, batch_size, citation_store=None, progress=None):
+    """Add the edges found in shards of the file to the edges matrix, as per _count_edges_in_citations."""
+    counts, citation_count = _count_edges_for_plans_in_shards(file_path, [match_plan], [edges], file_format, workers, batch_size, citation_store, [progress])
+    papercounter, citation_ids_list, provenance, stopped_reason = counts[0]
+    if stopped_reason is not None:
+        raise SearchStopped(stopped_reason)
+    return papercounter, citation_ids_list, provenance
+
+
+def _count_edges_for_plans_in_shards(file_path, match_plans, edges_list, file_format, workers, batch_size, citation_store=None, progresses=None):
+    """Add the edges found in shards of the file to each match plan's edges matrix, returns the counts for each plan
+       and the number of citations read, as per _count_edges_for_plans_in_citations."""
+    if citation_store is not None:
+        shards = citation_store.find_citation_boundaries(workers)
+    else:
+        shards = find_citation_boundaries(file_path, file_format, workers)
+    logger.debug("Counting edges in %d shards", len(shards))
+    if progresses is None:
+        progresses = [None] * len(match_plans)
+
+    papercounters = [0] * len(match_plans)
+    citation_count = 0
+    citation_ids_lists = [list() for match_plan in match_plans]
+    provenances = [EdgeProvenanceBuilder(edges.shape) for edges in edges_list]
+    stopped_reasons = [None] * len(match_plans)
+    # NB: Worker processes are forked so they share the already configured Django environment
+    with multiprocessing.get_context("fork").Pool(processes=len(shards)) as pool:
+        citation_store_file_path = citation_store.file_path if citation_store is not None else None
+        # Each worker publishes the progress of its own shard
+        progress_arguments = [(progress.search_result_id, progress.started) if progress is not None else None for progress in progresses]
+        search_arguments = [(file_path, citation_store_file_path, match_plans, edges_list[0].dtype, file_format, batch_size, start, end, progress_arguments)
+                            for start, end in shards]
+        for shard_counts, shard_citation_count in pool.imap(_count_edges_in_shard, search_arguments):
+            for plan_number, (shard_papercounter, shard_edges, shard_citation_ids_list, shard_provenance, shard_stopped_reason) in enumerate(shard_counts):
+                papercounters[plan_number] += shard_papercounter
+                edges_list[plan_number] += shard_edges
+                # Shard ordinals and citation numbers are numbered from the shard's first matched citation and first citation
+                provenances[plan_number].extend(shard_provenance, len(citation_ids_lists[plan_number]), citation_count)
+                citation_ids_lists[plan_number].extend(shard_citation_ids_list)
+                stopped_reasons[plan_number] = stopped_reasons[plan_number] or shard_stopped_reason
+            citation_count += shard_citation_count
+
+    return list(zip(papercounters, citation_ids_lists, provenances, stopped_reasons)), citation_count
+
+
+def countedges_from_index(citation_store, match_plan, edges, results_file_path, results_file_name, gene_mention_index=None):
+    """Count edges using the citation store's inverted MeSH heading index, and for genes its gene mention index.
+
+       Each gene, mediator and exposure/outcome term is looked up as a sorted array of citation ordinals, so edge
+       counts become intersections of those arrays and no citations are read, giving the same results as countedges."""
+    papercounter, citation_ids_list, provenance = _count_edges_from_index(citation_store, match_plan, edges, gene_mention_index)
+    _write_edge_provenance(provenance, citation_ids_list, results_file_path, results_file_name)
+    _write_abstract_ids(citation_ids_list, results_file_path, results_file_name)
+
+    return papercounter, edges
+
+
+def _count_edges_from_index(citation_store, match_plan, edges, gene_mention_index=None):
+    """Add the edges found using the citation store's indexes to the edges matrix, as per _count_edges_in_citations."""
+    if match_plan.genelist and gene_mention_index is None:
+        raise ValueError("A gene mention index is required to count edges for genes from the index")
+
+    citation_count = len(citation_store)
+    has_id = citation_store.has_id
+
+    # Citations considered, i.e. with MeSH headings including the filter term, if any
+    if match_plan.mesh_filter_key:
+        searched = np.zeros(citation_count, dtype=bool)
+        searched[citation_store.postings(match_plan.mesh_filter_key)] = True
+    else:
+        searched = citation_store.has_mesh
+
+    def searched_postings(mesh_term):
+        postings = citation_store.postings(mesh_term_key(mesh_term))
+        return postings[searched[postings]]
+
+    # NB: As per countedges genes are only searched for, and edges only recorded, for citations with an identifier
+    row_postings = list()
+    for gene in match_plan.genelist:
+        postings = gene_mention_index.postings(match_plan.gene_synonyms[gene])
+        row_postings.append(postings[searched[postings] & has_id[postings]])
+    row_postings.extend(searched_postings(mediator) for mediator in match_plan.mediatormesh)
+    column_postings = [postings[has_id[postings]] for postings in (searched_postings(label) for label in match_plan.column_labels)]
+    pair_row_ids, pair_column_ids, pair_postings = _intersection_pairs(row_postings, column_postings, citation_count)
+    pair_cells = pair_row_ids * edges.shape[1] + pair_column_ids
+    edges += np.bincount(pair_cells, minlength=edges.size).reshape(edges.shape).astype(edges.dtype)
+
+    # NB: As previously, a citation without an identifier is counted when a mediator matches but its ID is not recorded.
+    matched = np.zeros(citation_count, dtype=bool)
+    for postings in row_postings:
+        matched[postings] = True
+    papercounter = int(np.count_nonzero(matched))
+    matched_ordinals = np.flatnonzero(matched & has_id)
+    citation_ids_list = [citation_id.strip() for citation_id in citation_store.get_ids(matched_ordinals)]
+
+    # Citations supporting each edge are numbered as per citation_ids_list, i.e. by position in matched_ordinals,
+    # and the store's ordinals are their citation numbers
+    provenance = EdgeProvenanceBuilder(edges.shape)
+    provenance.add_pairs(pair_cells, np.searchsorted(matched_ordinals, pair_postings))
+    for row_id, postings in enumerate(row_postings):
+        postings = postings[has_id[postings]]
+        provenance.add_rows(np.full(len(postings), row_id), np.searchsorted(matched_ordinals, postings))
+    provenance.add_citation_numbers(matched_ordinals)
+
+    return papercounter, citation_ids_list, provenance
+
+
+def _get_covering_gene_mention_index(match_plan, citation_store):
+    """Return whether the edges for a match plan can be counted from the store's indexes, and the gene mention index to use,
+       i.e. whether the plan has no genes or the upload's gene mention index covers all of their synonyms."""
+    if not match_plan.genelist:
+        return True, None
+    gene_mention_index = get_gene_mention_index(citation_store)
+    if gene_mention_index is not None and gene_mention_index.covers(synonym for synonyms in match_plan.gene_synonyms.values() for synonym in synonyms):
+        return True, gene_mention_index
+    return False, None
+
+
+def _count_edges_for_plan(match_plan, edges, file_path, file_format, citation_store, progress=None):
+    """Add the edges for a match plan to the edges matrix, from the store's indexes when they cover the plan's genes,
+       otherwise by reading the citations, in parallel shards when there is more than one matching worker.
+       When a ProgressReporter is given the citations processed and matched are published as they are read.
+
+       Returns the number of citations matched, the list of their IDs, an EdgeProvenanceBuilder and the number of citations read,
+       which is None when counted from the indexes, as per _count_edges_in_citations."""
+    # Genes can be found without searching the abstracts when the upload's gene mention index covers all of their synonyms
+    use_index, gene_mention_index = _get_covering_gene_mention_index(match_plan, citation_store)
+    if use_index:
+        # Use the store's inverted MeSH heading and gene mention indexes
+        logger.debug("Count edges from index")
+        papercounter, citation_ids_list, provenance = _count_edges_from_index(citation_store, match_plan, edges, gene_mention_index)
+        if progress is not None:
+            progress.update(len(citation_store), len(citation_ids_list), force=True)
+        return papercounter, citation_ids_list, provenance, None
+    counts, citation_count = _count_edges_for_plans_in_file([match_plan], [edges], file_path, file_format, citation_store, [progress])
+    papercounter, citation_ids_list, provenance, stopped_reason = counts[0]
+    if stopped_reason is not None:
+        raise SearchStopped(stopped_reason)
+    return papercounter, citation_ids_list, provenance, citation_count
+
+
+def _count_edges_for_plans_in_file(match_plans, edges_list, file_path, file_format, citation_store, progresses=None):
+    """Add the edges for each match plan to its edges matrix by reading the citations once, in parallel shards when
+       there is more than one matching worker.
+
+       Returns the number of citations matched, the list of their IDs, an EdgeProvenanceBuilder and the reason counting
+       stopped, if it did, for each plan, and the number of citations read, as per _count_edges_for_plans_in_citations."""
+    if settings.MATCHING_WORKERS > 1:
+        # Read citations and count edges for shards of the file in parallel
+        logger.debug("Count edges in shards")
+        return _count_edges_for_plans_in_shards(file_path, match_plans, edges_list, file_format, settings.MATCHING_WORKERS, settings.MATCHING_BATCH_SIZE, citation_store, progresses)
+    logger.debug("Count edges in citations")
+    citations = read_citations(file_path=file_path, file_format=file_format, citation_store=citation_store)
+    return _count_edges_for_plans_in_citations(citations, match_plans, edges_list, file_format, progresses=progresses)
+
+
+def get_reusable_search_result(search_result):
+    """Return the most recently completed result of a search whose criteria this search's criteria were copied from,
+       directly or via other copies, with the same upload, MeSH filter and matching version and a saved edge matrix, or None."""
+    mesh_filter = search_result.mesh_filter or ""
+    upload_id = search_result.criteria.upload_id
+    seen_criteria_ids = set([search_result.criteria_id, ])
+    criteria = search_result.criteria.parent
+    while criteria is not None and criteria.id not in seen_criteria_ids:
+        seen_criteria_ids.add(criteria.id)
+        if criteria.upload_id == upload_id:
+            previous_search_results = criteria.search_results.filter(has_completed=True, matching_version=MATCHING_VERSION,
+                                                                     filename_stub__isnull=False).order_by('-ended_processing')
+            for previous_search_result in previous_search_results:
+                if ((previous_search_result.mesh_filter or "") == mesh_filter and
+                        os.path.exists('%s%s%s' % (settings.RESULTS_PATH, previous_search_result.filename_stub, EDGE_MATRIX_SUFFIX))):
+                    return previous_search_result
+        criteria = criteria.parent
+    return None
+
+
+def countedges_incrementally(previous_search_result, match_plan, edges, file_path, file_format, citation_store, progress=None):
+    """Add the edges for a match plan to the edges matrix, reusing the saved edge matrix and provenance of a previous
+       search of the same upload for the rows and columns it has in common, see get_reusable_search_result.
+
+       New rows are counted against every column and new columns against every row, so only one of those can be new.
+       Gene rows are new when the gene's synonyms have changed. Returns None when everything would be counted,
+       otherwise the number of citations with a gene or mediator matched, the list of their IDs, an EdgeProvenanceBuilder
+       and the number of citations read to count the new rows or columns, as per _count_edges_for_plan.
+
+       NB: Unlike _count_edges_in_citations the number of citations matched does not include those without an ID."""
+    results_path = settings.RESULTS_PATH
+    previous_stub = previous_search_result.filename_stub
+    previous_edges, genelist, mediatormesh, exposuremesh, outcomemesh = load_edge_matrix(results_path, previous_stub)
+    previous_gene_synonyms = load_gene_synonyms(results_path, previous_stub) or dict()
+
+    # Rows and columns are identified by type and label, as the same MeSH term could be both a mediator and an exposure or outcome
+    previous_row_ids = dict((("gene", gene), row_id) for row_id, gene in enumerate(genelist)
+                            if previous_gene_synonyms.get(gene) == match_plan.gene_synonyms.get(gene))
+    previous_row_ids.update((("mediator", mediator), len(genelist) + position) for position, mediator in enumerate(mediatormesh))
+    previous_column_ids = dict((("exposure", exposure), column_id) for column_id, exposure in enumerate(exposuremesh))
+    previous_column_ids.update((("outcome", outcome), len(exposuremesh) + position) for position, outcome in enumerate(outcomemesh))
+    row_keys = [("gene", gene) for gene in match_plan.genelist] + [("mediator", mediator) for mediator in match_plan.mediatormesh]
+    column_keys = [("exposure", exposure) for exposure in match_plan.exposuremesh] + [("outcome", outcome) for outcome in match_plan.outcomemesh]
+    # Position of each row and column in the previous edge matrix, or -1 when new
+    row_previous_ids = np.array([previous_row_ids.get(key, -1) for key in row_keys], dtype=np.int64)
+    column_previous_ids = np.array([previous_column_ids.get(key, -1) for key in column_keys], dtype=np.int64)
+
+    row_count, column_count = match_plan.shape
+    new_row_ids = np.flatnonzero(row_previous_ids < 0)
+    new_column_ids = np.flatnonzero(column_previous_ids < 0)
+    if len(new_row_ids) and len(new_column_ids):
+        return None
+    if len(new_column_ids):
+        counted_row_ids, counted_column_ids = np.arange(row_count), new_column_ids
+    elif len(new_row_ids):
+        counted_row_ids, counted_column_ids = new_row_ids, np.arange(column_count)
+    else:
+        counted_row_ids, counted_column_ids = new_row_ids, new_column_ids
+    if len(counted_row_ids) == row_count and len(counted_column_ids) == column_count:
+        return None
+    logger.debug("Reusing edges from search result %d, counting %d rows by %d columns", previous_search_result.id, len(counted_row_ids), len(counted_column_ids))
+
+    # No provenance file is written when there were no matches
+    previous_provenance_path = '%s%s%s' % (results_path, previous_stub, PROVENANCE_SUFFIX)
+    if os.path.exists(previous_provenance_path):
+        previous_provenance = EdgeProvenance.load(previous_provenance_path)
+    else:
+        previous_provenance = EdgeProvenance.empty(previous_edges.shape)
+
+    # Rows and columns of the previous matrix the unchanged rows and columns come from
+    reused_row_ids = np.flatnonzero(row_previous_ids >= 0)
+    reused_column_ids = np.flatnonzero(column_previous_ids >= 0)
+    edges[np.ix_(reused_row_ids, reused_column_ids)] += previous_edges[np.ix_(row_previous_ids[reused_row_ids], column_previous_ids[reused_column_ids])].astype(edges.dtype)
+    is_counted_row = np.zeros(row_count, dtype=bool)
+    is_counted_row[counted_row_ids] = True
+
+    # Map the previous provenance onto the rows and columns, dropping rows that are counted again and any removed rows or columns
+    previous_row_positions = np.full(previous_edges.shape[0], -1, dtype=np.int64)
+    previous_row_positions[row_previous_ids[reused_row_ids]] = reused_row_ids
+    previous_column_positions = np.full(previous_edges.shape[1], -1, dtype=np.int64)
+    previous_column_positions[column_previous_ids[reused_column_ids]] = reused_column_ids
+    cell_row_ids, cell_column_ids, cell_citation_numbers = previous_provenance.cell_citations()
+    cell_row_ids, cell_column_ids = previous_row_positions[cell_row_ids], previous_column_positions[cell_column_ids]
+    kept = (cell_row_ids >= 0) & (cell_column_ids >= 0)
+    cell_row_ids, cell_column_ids, cell_citation_numbers = [cell_row_ids[kept]], [cell_column_ids[kept]], [cell_citation_numbers[kept]]
+    row_ids, row_citation_numbers = previous_provenance.row_citations()
+    row_ids = previous_row_positions[row_ids]
+    kept = row_ids >= 0
+    kept[kept] = ~is_counted_row[row_ids[kept]]
+    row_ids, row_citation_numbers = [row_ids[kept]], [row_citation_numbers[kept]]
+    citation_numbers, citation_ids = [previous_provenance.citation_numbers], [np.char.encode(previous_provenance.citation_ids, "utf-8")]
+
+    citation_count = None
+
+    if len(counted_row_ids) and len(counted_column_ids):
+        # Count the new rows or columns in a match plan of their own
+        counted_row_labels = [match_plan.row_labels[row_id] for row_id in counted_row_ids]
+        counted_column_labels = [match_plan.column_labels[column_id] for column_id in counted_column_ids]
+        gene_count = np.count_nonzero(counted_row_ids < len(match_plan.genelist))
+        exposure_count = np.count_nonzero(counted_column_ids < len(match_plan.exposuremesh))
+        counted_plan = MatchPlan(counted_row_labels[:gene_count], match_plan.gene_synonyms,
+                                 counted_column_labels[:exposure_count], counted_column_labels[exposure_count:],
+                                 counted_row_labels[gene_count:], match_plan.mesh_filter)
+        counted_edges = np.zeros(shape=counted_plan.shape, dtype=edges.dtype)
+        counted_papercounter, counted_citation_ids_list, counted_builder, citation_count = _count_edges_for_plan(counted_plan, counted_edges, file_path, file_format, citation_store, progress)
+        edges[np.ix_(counted_row_ids, counted_column_ids)] += counted_edges
+
+        counted_provenance = EdgeProvenance.from_builder(counted_builder, counted_citation_ids_list)
+        counted_cell_row_ids, counted_cell_column_ids, counted_cell_citation_numbers = counted_provenance.cell_citations()
+        cell_row_ids.append(counted_row_ids[counted_cell_row_ids])
+        cell_column_ids.append(counted_column_ids[counted_cell_column_ids])
+        cell_citation_numbers.append(counted_cell_citation_numbers)
+        counted_row_row_ids, counted_row_citation_numbers = counted_provenance.row_citations()
+        row_ids.append(counted_row_ids[counted_row_row_ids])
+        row_citation_numbers.append(counted_row_citation_numbers)
+        citation_numbers.append(counted_provenance.citation_numbers)
+        citation_ids.append(np.array(counted_citation_ids_list, dtype=object))
+
+    # Citations with a gene or mediator matched, in file order, are renumbered as per the combined list of IDs
+    row_ids, row_citation_numbers = np.concatenate(row_ids), np.concatenate(row_citation_numbers)
+    matched_citation_numbers = np.unique(row_citation_numbers)
+    known_citation_numbers, first_positions = np.unique(np.concatenate(citation_numbers), return_index=True)
+    known_citation_ids = np.concatenate([np.asarray(ids, dtype=object) for ids in citation_ids])[first_positions]
+    citation_ids_list = known_citation_ids[np.searchsorted(known_citation_numbers, matched_citation_numbers)].tolist()
+
+    provenance = EdgeProvenanceBuilder(edges.shape)
+    provenance.add_pairs(np.concatenate(cell_row_ids) * column_count + np.concatenate(cell_column_ids),
+                         np.searchsorted(matched_citation_numbers, np.concatenate(cell_citation_numbers)))
+    provenance.add_rows(row_ids, np.searchsorted(matched_citation_numbers, row_citation_numbers))
+    provenance.add_citation_numbers(matched_citation_numbers)
+
+    return len(citation_ids_list), citation_ids_list, provenance, citation_count
+
+
+def _intersection_pairs(row_postings, column_postings, size):
+    """Return the row ids, column ids and ordinals in common for each row and each column array of ordinals less than size.
+
+       Each row's ordinals are marked in a mask, then all of the columns' ordinals are looked up in it at once,
+       rows and columns are swapped when that reads fewer ordinals."""
+    if sum(len(postings) for postings in row_postings) * len(column_postings) < sum(len(postings) for postings in column_postings) * len(row_postings):
+        column_ids, row_ids, ordinals = _intersection_pairs(column_postings, row_postings, size)
+        return row_ids, column_ids, ordinals
+
+    row_ids, column_ids, ordinals = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    if not column_postings:
+        return row_ids[0], column_ids[0], ordinals[0]
+    all_column_postings = np.concatenate(column_postings)
+    all_column_ids = np.repeat(np.arange(len(column_postings)), [len(postings) for postings in column_postings])
+    mask = np.zeros(size, dtype=bool)
+    for row_id, postings in enumerate(row_postings):
+        mask[postings] = True
+        found = mask[all_column_postings]
+        row_ids.append(np.full(np.count_nonzero(found), row_id, dtype=np.int64))
+        column_ids.append(all_column_ids[found])
+        ordinals.append(all_column_postings[found])
+        mask[postings] = False
+    return np.concatenate(row_ids), np.concatenate(column_ids), np.concatenate(ordinals).astype(np.int64)
+
+
+def _count_edges_in_shard(search_arguments):
+    """Count edges for the citations in one byte range of a file, run in a worker process by _count_edges_for_plans_in_shards."""
+    file_path, citation_store_file_path, match_plans, edges_dtype, file_format, batch_size, start, end, progress_arguments = search_arguments
+    edges_list = [np.zeros(shape=match_plan.shape, dtype=edges_dtype) for match_plan in match_plans]
+    citation_store = CitationStore(citation_store_file_path) if citation_store_file_path else None
+    citations = read_citations(file_path, file_format, start, end, citation_store)
+    progresses = [ProgressReporter(arguments[0], start, arguments[1]) if arguments is not None else None for arguments in progress_arguments]
+    counts, citation_count = _count_edges_for_plans_in_citations(citations, match_plans, edges_list, file_format, batch_size, progresses)
+    return [(papercounter, edges, citation_ids_list, provenance.arrays(), stopped_reason)
+            for (papercounter, citation_ids_list, provenance, stopped_reason), edges in zip(counts, edges_list)], citation_count
+
+
+def _count_edges_in_citations(citations, match_plan, edges, file_format=OVID, batch_size=None, progress=None):
+    """Add the edges found in citations to the edges matrix.
+
+       Returns the number of citations matched, the list of their IDs in file order, an EdgeProvenanceBuilder
+       recording which of them, numbered as per the list of IDs, support each edge and the number of citations read.
+       When a ProgressReporter is given the citations read and matched so far are published every so often,
+       and SearchStopped is raised if the search should stop."""
+    counts, citation_count = _count_edges_for_plans_in_citations(citations, [match_plan], [edges], file_format, batch_size, [progress])
+    papercounter, citation_ids_list, provenance, stopped_reason = counts[0]
+    if stopped_reason is not None:
+        raise SearchStopped(stopped_reason)
+    return papercounter, citation_ids_list, provenance, citation_count
+
+
+def _count_edges_for_plans_in_citations(citations, match_plans, edges_list, file_format=OVID, batch_size=None, progresses=None):
+    """Add the edges found in citations for each match plan to its edges matrix, reading each citation once.
+
+       Returns, for each plan, the number of citations matched, the list of their IDs in file order, an EdgeProvenanceBuilder
+       recording which of them, numbered as per the list of IDs, support each edge and the reason counting stopped, or None,
+       along with the number of citations read.
+       When a ProgressReporter is given for a plan the citations read and matched so far are published every so often,
+       and the plan is no longer matched if its search should stop. Reading stops once every plan has stopped."""
+    plan_numbers = range(len(match_plans))
+    papercounters = [0] * len(match_plans)
+    citation_ids_lists = [list() for match_plan in match_plans]
+    stopped_reasons = [None] * len(match_plans)
+    if progresses is None:
+        progresses = [None] * len(match_plans)
+
+    unique_id, mesh_subject_headings, abstract = CITATION_FIELD_NAMES[file_format]
+
+    # Edges are counted in batches of citations as rows.T @ cols rather than one cell at a time
+    if batch_size is None:
+        batch_size = settings.MATCHING_BATCH_SIZE
+    provenances = [EdgeProvenanceBuilder(edges.shape) for edges in edges_list]
+    accumulators = [EdgeAccumulator(edges, batch_size, provenance) for edges, provenance in zip(edges_list, provenances)]
+
+    def update_progress(citation_count, offset=None, force=False):
+        for plan_number in plan_numbers:
+            if progresses[plan_number] is not None and stopped_reasons[plan_number] is None:
+                try:
+                    progresses[plan_number].update(citation_count, len(citation_ids_lists[plan_number]), offset, force)
+                except SearchStopped as e:
+                    stopped_reasons[plan_number] = e.reason
+        return [plan_number for plan_number in plan_numbers if stopped_reasons[plan_number] is None]
+
+    matched_plan_numbers = list(plan_numbers)
+    citation_count = 0
+    for citation_count, citation in enumerate(citations, 1):
+        if citation_count % PROGRESS_CHECK_CITATIONS == 0:
+            matched_plan_numbers = update_progress(citation_count, citation.offset)
+            if not matched_plan_numbers:
+                break
+
+        # Each citation's MeSH headings are parsed once into a set of tokens, so term matching becomes a set look up
+        # with the same results as the regular expressions from ovid_prepare_mesh_term_search_text_function and
+        # pubmed_prepare_mesh_term_search_text_function
+        mesh_tokens = citation.get_mesh_tokens(mesh_subject_headings)
         # Ensure we only test citations with associated mesh headings
-        if mesh_subject_headings in citation.fields:
-            if not mesh_filter or search_for_mesh_term(citation.fields[mesh_subject_headings], compiled_mesh_term_reg_exp_hash[mesh_filter]) is not None:
-                # Only search for genes in citations with an abstract section
-                if abstract in citation.fields:
-                    for gene in genelist:
-                        try:
-                            found_gene_match = False
-                            edge_row_id += 1
-                            edge_column_id = -1
-                            # TODO: TMM-394 Optimise generation of gene_matches and synomym_matches - Move outside of citations for loop, include regular expression compile improvements
-                            if gene in synonymlookup:
-                                gene_matches = synonymlookup[gene]
-                            else:
-                                gene_matches = (gene, )
-                            for gene in gene_matches:
-                                if gene in synonymlisting:
-                                    synomym_matches = synonymlisting[gene]
-                                else:
-                                    synomym_matches = (gene, )
-                                for genesyn in synomym_matches:
-                                    if searchgene(citation.fields[abstract], genesyn) is not None:
-                                        citation_ids_list.append(citation.fields[unique_id].strip())
-                                        found_gene_match = True
-                                        countthis = 1
-                                        for exposure in exposuremesh:
-                                            edge_column_id += 1
-                                            # NB: Removed AND splitting as not possible using the web app interface
-                                            if search_for_mesh_term(citation.fields[mesh_subject_headings], compiled_mesh_term_reg_exp_hash[exposure]) is not None:
-                                                edges[edge_row_id][edge_column_id] += 1
-                                                # identifiers[gene][0][exposure].append(citation.fields[unique_id])
-                                        for outcome in outcomemesh:
-                                            edge_column_id += 1
-                                            # NB: Removed AND splitting as not possible using the web app interface
-                                            if search_for_mesh_term(citation.fields[mesh_subject_headings], compiled_mesh_term_reg_exp_hash[outcome]) is not None:
-                                                edges[edge_row_id][edge_column_id] += 1
-                                                # identifiers[gene][1][outcome].append(citation.fields[unique_id])
-                                        # Stop comparing synonyms once a match is found
-                                        break
-                                # Stop comparing synonyms once a match is found
-                                if found_gene_match:
-                                    break
-                        except:
-                            # Report unexpected errors
-                            logger.warning("Unexpected error handling genes: %s  for gene: %s", (sys.exc_info(), gene, ))
-
-                # Repeat for other mediators
-                for mediator in mediatormesh:
-                    edge_row_id += 1
-                    edge_column_id = -1
-                    try:
-                        if search_for_mesh_term(citation.fields[mesh_subject_headings], compiled_mesh_term_reg_exp_hash[mediator]) is not None:
-                            countthis = 1
-                            citation_ids_list.append(citation.fields[unique_id].strip())
-                            for exposure in exposuremesh:
-                                edge_column_id += 1
-                                # NB: Removed AND splitting as not possible using the web app interface
-                                if search_for_mesh_term(citation.fields[mesh_subject_headings], compiled_mesh_term_reg_exp_hash[exposure]) is not None:
-                                    edges[edge_row_id][edge_column_id] += 1
-                                    # identifiers[mediator][0][exposure].append(citation.fields[unique_id])
-                            for outcome in outcomemesh:
-                                edge_column_id += 1
-                                # NB: Removed AND splitting as not possible using the web app interface
-                                if search_for_mesh_term(citation.fields[mesh_subject_headings], compiled_mesh_term_reg_exp_hash[outcome]) is not None:
-                                    edges[edge_row_id][edge_column_id] += 1
-                                    # identifiers[mediator][1][outcome].append(citation.fields[unique_id])
-                    except KeyError:
-                        # Some citations have no MeSH Terms, so mediator comparisons are not possible
-                        # logger.warning("No mesh terms for citation %d" % int(citation.id))
-                        pass
-                    except:
-                        # Report unexpected errors as warning.
-                        logger.warning("Unexpected error handling mediator: %s for mediator:%s edge_row_id %s edge_column_id %s", (sys.exc_info(), mediator, edge_row_id, edge_column_id))
-
-        if countthis == 1:
-            papercounter += 1
-
-    # Output all citation ids where a gene or mediator MeSH term match is found
+        if mesh_tokens is None:
+            continue
+
+        filtered_plan_numbers = [plan_number for plan_number in matched_plan_numbers if match_plans[plan_number].matches_filter(mesh_tokens)]
+        if not filtered_plan_numbers:
+            continue
+
+        citation_id = citation.fields.get(unique_id)
+        if citation_id is None:
+            # NB: As previously, a citation without an identifier is counted when a mediator matches but does not record edges.
+            for plan_number in filtered_plan_numbers:
+                if match_plans[plan_number].mediator_index.matches(mesh_tokens):
+                    papercounters[plan_number] += 1
+            continue
+
+        # Only search for genes in citations with an abstract section, then repeat for other mediators
+        abstract_text = citation.fields.get(abstract)
+        for plan_number in filtered_plan_numbers:
+            match_plan = match_plans[plan_number]
+            edge_row_ids = match_plan.match_rows(abstract_text, mesh_tokens)
+            if edge_row_ids:
+                citation_ids_lists[plan_number].append(citation_id.strip())
+                # Exposure then outcome columns are the same for every gene and mediator matched in this citation
+                # NB: Removed AND splitting as not possible using the web app interface
+                accumulators[plan_number].add(edge_row_ids, match_plan.match_columns(mesh_tokens), citation_count - 1)
+
+    for plan_number in plan_numbers:
+        accumulators[plan_number].flush()
+        papercounters[plan_number] += accumulators[plan_number].papercounter
+    update_progress(citation_count, force=True)
+
+    return list(zip(papercounters, citation_ids_lists, provenances, stopped_reasons)), citation_count
+
+
+def _write_abstract_ids(citation_ids_list, results_file_path, results_file_name):
+    """Output all citation ids where a gene or mediator MeSH term match is found"""
     if citation_ids_list:
         resultfile = open('%s%s_abstracts.csv' % (results_file_path, results_file_name), 'w', newline='', encoding='utf-8')
         csv_writer = csv.writer(resultfile)
@@ -414,107 +1401,161 @@ def countedges(citations, genelist, synonymlookup, synonymlisting, exposuremesh,
         csv_writer.writerows([(cid.decode("utf-8"), ) for cid in unique_everseen(citation_ids_list)])
         resultfile.close()
 
-    return papercounter, edges, identifiers
+
+def _write_edge_provenance(provenance, citation_ids_list, results_file_path, results_file_name):
+    """Output the citations supporting each edge (*_provenance.npz), when there are matches"""
+    if citation_ids_list:
+        save_edge_provenance(provenance, citation_ids_list, '%s%s%s' % (results_file_path, results_file_name, PROVENANCE_SUFFIX))
 
 
 def printedges(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename):
-    """Write out edge file (*_edge.csv)"""
-    edgefile = open('%s%s_edge.csv' % (results_path, resultfilename), 'w', newline='', encoding='utf-8')
-    csv_writer = csv.writer(edgefile)
-    csv_writer.writerow(("Mediators", "Exposure counts", "Outcome counts", "Scores",))
-    edge_score = 0
-    edge_row_id = -1
-
-    for mediator in _get_genes_and_mediators(genelist, mediatormesh):
-        edge_col_id = -1
-        edge_row_id += 1
-
-        b, d = 0, 0
-        for exposure in exposuremesh:
-            edge_col_id += 1
-            try:
-                b += edges[edge_row_id][edge_col_id]
-            except:
-                b = b
-        for outcome in outcomemesh:
-            edge_col_id += 1
-            try:
-                d += edges[edge_row_id][edge_col_id]
-            except:
-                d = d
-        bf, df = float(b), float(d)
-        if (bf and df) > 0.0:
-            score1 = min(bf, df) / max(bf, df) * (bf + df)
-            csv_writer.writerow((mediator, str(b), str(d), str(score1)))
-            edge_score += 1
-
-    edgefile.close()
-
-    return edge_score
+    """Write out edge file (*_edge.csv)
+
+    Exposure counts (b) and outcome counts (d) are the row sums of the exposure and outcome columns of the edge
+    matrix, rows where both are found are scored min(b, d) / max(b, d) * (b + d)."""
+    mediators = list(_get_genes_and_mediators(genelist, mediatormesh))
+    edges = np.asarray(edges)[:len(mediators)]
+    exposure_count = len(exposuremesh)
+    b = edges[:, :exposure_count].sum(axis=1)
+    d = edges[:, exposure_count:exposure_count + len(outcomemesh)].sum(axis=1)
+    bf, df = b.astype(float), d.astype(float)
+
+    scored_row_ids = np.flatnonzero((bf != 0.0) & (df > 0.0))
+    bf, df = bf[scored_row_ids], df[scored_row_ids]
+    scores = np.minimum(bf, df) / np.maximum(bf, df) * (bf + df)
+
+    with open('%s%s_edge.csv' % (results_path, resultfilename), 'w', newline='', encoding='utf-8') as edgefile:
+        csv_writer = csv.writer(edgefile)
+        csv_writer.writerow(("Mediators", "Exposure counts", "Outcome counts", "Scores",))
+        csv_writer.writerows(zip([mediators[row_id] for row_id in scored_row_ids],
+                                 map(str, b[scored_row_ids].tolist()),
+                                 map(str, d[scored_row_ids].tolist()),
+                                 map(str, scores.tolist())))
+
+    return len(scored_row_ids)
 
 
 def createjson(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename):
     """Create JSON formatted resulted file
-       TODO - (Low priority improvement) can this be transformed from the CSV more efficiently?"""
-    resultfile = open('%s%s.json' % (results_path, resultfilename), 'w', encoding='utf-8')
-    nodes = []
-    mnodes = []
-    edgesout = []
-    nodesout = []
-    edge_row_id = -1
-    # logger.debug("edges")
-    # logger.debug(edges)
-    for mediator in _get_genes_and_mediators(genelist, mediatormesh):
-        edge_col_id = -1
-        edge_row_id += 1
-
-        counter = [0, 0]
-        for exposure in exposuremesh:
-            edge_col_id += 1
-            if edges[edge_row_id][edge_col_id] > 0:
-                counter[0] += 1
-        for outcome in outcomemesh:
-            edge_col_id += 1
-            if edges[edge_row_id][edge_col_id] > 0:
-                counter[1] += 1
-        if counter[0] > 0 and counter[1] > 0:
-            nodes.append(mediator)
-            mnodes.append(mediator)
-    for exposure in exposuremesh:
-        nodes.append(exposure)
-    for outcome in outcomemesh:
-        nodes.append(outcome)
-    for i in range(len(nodes)):
-        thisnode = """{"name":"%s","id":"%d"}""" % (nodes[i], i)
-        nodesout.append(thisnode)
-
-    edge_row_id = -1
-    for mediator in _get_genes_and_mediators(genelist, mediatormesh):
-        edge_col_id = -1
-        edge_row_id += 1
-        if mediator in mnodes:
-            counter = [0, 0]
-            for exposure in exposuremesh:
-                edge_col_id += 1
-                if edges[edge_row_id][edge_col_id] > 0:
-                    thisedge = """{"source":%s,"target":%s,"value":%s}""" % (str(nodes.index(exposure)), str(nodes.index(mediator)), str(edges[edge_row_id][edge_col_id]))
-                    edgesout.append(thisedge)
-                    counter[0] += 1
-            for outcome in outcomemesh:
-                edge_col_id += 1
-                if edges[edge_row_id][edge_col_id] > 0:
-                    thisedge = """{"source":%s,"target":%s,"value":%s}""" % (str(nodes.index(mediator)), str(nodes.index(outcome)), str(edges[edge_row_id][edge_col_id]))
-                    edgesout.append(thisedge)
-                    counter[1] += 1
-            if counter[0] == 0:     # TODO: Does this scenario occur? Has it not been dealt with earlier in line 467
-                for i in range(counter[1]):
-                    edgesout.pop(-1)
-            if counter[1] == 0:     # TODO: Does this scenario occur? Has it not been dealt with earlier in line 467
-                for i in range(counter[0]):
-                    edgesout.pop(-1)
-    output = """{"nodes":[%s],"links":[%s]}""" % (",\n".join(nodesout), ",\n".join(edgesout))
-    resultfile.write(output)
-    resultfile.close()
+
+    Nodes are the genes and mediators found with at least one exposure and at least one outcome, then the exposures
+    and outcomes, links run from exposure to mediator and from mediator to outcome for each non zero edge count.
+    NB: As per the original implementation a link refers to the first node with a given name."""
+    mediators = list(_get_genes_and_mediators(genelist, mediatormesh))
+    exposure_count = len(exposuremesh)
+    edges = np.asarray(edges)[:len(mediators), :exposure_count + len(outcomemesh)]
+    found = edges > 0
+    mediator_row_ids = np.flatnonzero(found[:, :exposure_count].any(axis=1) & found[:, exposure_count:].any(axis=1))
+    document = _sankey_document(edges, mediators, mediator_row_ids, exposuremesh, outcomemesh)
+    with open('%s%s.json' % (results_path, resultfilename), 'w', encoding='utf-8') as resultfile:
+        resultfile.write(json.dumps(document, ensure_ascii=False, separators=(",", ":")))
+
+
+def _sankey_document(edges, mediators, mediator_row_ids, exposuremesh, outcomemesh):
+    """Nodes and links, as written by createjson, for the mediators in rows mediator_row_ids of the edge matrix"""
+    exposure_count = len(exposuremesh)
+    found = edges > 0
+    nodes = [mediators[row_id] for row_id in mediator_row_ids] + list(exposuremesh) + list(outcomemesh)
+    node_ids = dict()
+    for node_id, node in enumerate(nodes):
+        node_ids.setdefault(node, node_id)
+    mediator_node_ids = np.array([node_ids[mediators[row_id]] for row_id in mediator_row_ids], dtype=int)
+    term_node_ids = np.array([node_ids[term] for term in list(exposuremesh) + list(outcomemesh)], dtype=int)
+
+    # Non zero cells of the mediators' rows in row order, i.e. each mediator's exposures then outcomes
+    mediator_edges = edges[mediator_row_ids]
+    rows, columns = np.nonzero(found[mediator_row_ids])
+    is_exposure = columns < exposure_count
+    sources = np.where(is_exposure, term_node_ids[columns], mediator_node_ids[rows])
+    targets = np.where(is_exposure, mediator_node_ids[rows], term_node_ids[columns])
+
+    return {
+        "nodes": [{"name": node, "id": str(node_id)} for node_id, node in enumerate(nodes)],
+        "links": [{"source": source, "target": target, "value": value}
+                  for source, target, value in zip(sources.tolist(), targets.tolist(), mediator_edges[rows, columns].tolist())],
+    }
+
+
+def top_mediators(edges, genelist, mediatormesh, exposuremesh, outcomemesh, offset=0, limit=None, min_count=1):
+    """Page through the scored mediators of an edge matrix, highest score first, without rerunning the matching.
+
+    Mediators are scored as per printedges and only included when both their exposure and outcome counts are at
+    least min_count, ties are listed in edge file order. Returns the nodes and links for the page of mediators,
+    as per createjson, along with the page's mediator counts and scores and the total number of mediators."""
+    mediators = list(_get_genes_and_mediators(genelist, mediatormesh))
+    exposure_count = len(exposuremesh)
+    edges = np.asarray(edges)[:len(mediators), :exposure_count + len(outcomemesh)]
+    b = edges[:, :exposure_count].sum(axis=1)
+    d = edges[:, exposure_count:].sum(axis=1)
+    min_count = max(min_count, 1)
+
+    scored_row_ids = np.flatnonzero((b >= min_count) & (d >= min_count))
+    bf, df = b[scored_row_ids].astype(float), d[scored_row_ids].astype(float)
+    scores = np.minimum(bf, df) / np.maximum(bf, df) * (bf + df)
+    ranking = np.lexsort((scored_row_ids, -scores))
+    end = None if limit is None else offset + limit
+    page = ranking[offset:end]
+    page_row_ids = scored_row_ids[page]
+
+    document = _sankey_document(edges, mediators, page_row_ids, exposuremesh, outcomemesh)
+    document["mediators"] = [{"name": mediators[row_id], "exposure_count": exposures, "outcome_count": outcomes, "score": score}
+                             for row_id, exposures, outcomes, score in zip(page_row_ids.tolist(), b[page_row_ids].tolist(),
+                                                                            d[page_row_ids].tolist(), scores[page].tolist())]
+    document["total"] = len(scored_row_ids)
+    document["offset"] = offset
+    document["limit"] = limit
+    return document
+
+
+def save_edge_matrix(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename, gene_synonyms=None):
+    """Write out the edge matrix with its row and column labels (*_edges.npz), from which the edge and JSON files can be recreated
+
+    The synonyms each gene was searched for, if given, are recorded as JSON so that gene rows are only reused while they are unchanged."""
+    np.savez_compressed('%s%s%s' % (results_path, resultfilename, EDGE_MATRIX_SUFFIX),
+                        edges=np.asarray(edges),
+                        row_labels=np.array(list(genelist) + list(mediatormesh), dtype=str),
+                        column_labels=np.array(list(exposuremesh) + list(outcomemesh), dtype=str),
+                        gene_count=np.int64(len(genelist)),
+                        exposure_count=np.int64(len(exposuremesh)),
+                        gene_synonyms=np.array(json.dumps(gene_synonyms or dict())))
+
+
+def load_edge_matrix(results_path, resultfilename):
+    """Read an edge matrix written by save_edge_matrix.
+
+    Returns edges, genelist, mediatormesh, exposuremesh, outcomemesh as passed to printedges and createjson."""
+    with np.load('%s%s%s' % (results_path, resultfilename, EDGE_MATRIX_SUFFIX)) as edge_matrix:
+        row_labels = edge_matrix["row_labels"].tolist()
+        column_labels = edge_matrix["column_labels"].tolist()
+        gene_count = int(edge_matrix["gene_count"])
+        exposure_count = int(edge_matrix["exposure_count"])
+        return (edge_matrix["edges"], row_labels[:gene_count], row_labels[gene_count:],
+                column_labels[:exposure_count], column_labels[exposure_count:])
+
+
+def load_gene_synonyms(results_path, resultfilename):
+    """Read the synonyms each gene was searched for from an edge matrix written by save_edge_matrix, or None if they were not recorded."""
+    with np.load('%s%s%s' % (results_path, resultfilename, EDGE_MATRIX_SUFFIX)) as edge_matrix:
+        if "gene_synonyms" not in edge_matrix.files:
+            return None
+        return dict((gene, tuple(synonyms)) for gene, synonyms in json.loads(str(edge_matrix["gene_synonyms"])).items())
+
+
+def recreate_results_files(results_path, resultfilename):
+    """Write the edge and JSON files again from a saved edge matrix without rerunning the matching, returns the number of mediator matches"""
+    edges, genelist, mediatormesh, exposuremesh, outcomemesh = load_edge_matrix(results_path, resultfilename)
+    mediator_match_counts = printedges(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename)
+    createjson(edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename)
+    compress_results_files(results_path, resultfilename)
+    return mediator_match_counts
+
+
+def compress_results_files(results_path, resultfilename):
+    """Write gzip compressed copies of the results files, e.g. *_edge.csv.gz, an abstract IDs file is only written when there are matches"""
+    for suffix in RESULTS_FILE_SUFFIXES:
+        file_path = '%s%s%s' % (results_path, resultfilename, suffix)
+        if os.path.exists(file_path):
+            write_gzip_copy(file_path)
 
 
 def record_differences_between_match_runs(search_result_id):
@@ -534,58 +1575,82 @@ def record_differences_between_match_runs(search_result_id):
         logger.debug("Version 4 matching field does not yet exist")
 
 
+EDGE_FILE_COLUMNS = ("Mediators", "Exposure counts", "Outcome counts", "Scores", )
+EDGE_FILE_DTYPES = {"Mediators": str,
+                    "Exposure counts": np.int32,
+                    "Outcome counts": np.int32,
+                    "Scores": float,
+                    }
+
+
+def read_edge_file(result_filepath):
+    """Read an edge CSV file, sorted by mediator, for comparison with another version's edge file.
+
+    NB: Uses pandas' C parser, index_col=False drops the trailing commas found on version 1 edge file lines."""
+    logger.info("Read CSV edge file %s" % result_filepath)
+    df = pd.read_csv(result_filepath,
+                     sep=',',
+                     header=0,
+                     names=EDGE_FILE_COLUMNS,
+                     index_col=False,
+                     dtype=EDGE_FILE_DTYPES,
+                     engine='c')
+    return df.sort_values("Mediators")
+
+
 def record_differences_between_previous_match_runs(search_result, result_dir_a, result_dir_b, previous_match_counts_field, ):
     """Compare edge CSV file for difference.
        Header: Mediators,Exposure counts,Outcome counts,Scores
     """
     logger.info("START comparing results edge file for %d, e.g. results_%d__topresults_edge.csv" % (search_result.id, search_result.id))
     if getattr(search_result, previous_match_counts_field) is not None:
-        result_filepath_a = result_dir_a + search_result.filename_stub + "_edge.csv"
-        try:
-            logger.info("Read previous CSV edge file %s" % result_filepath_a)
-            df_a = pd.read_csv(result_filepath_a,
-                                sep=',',
-                                header=0,
-                                names=("Mediators","Exposure counts","Outcome counts","Scores",),
-                                index_col=False,
-                                dtype={"Mediators": str,
-                                        "Exposure counts": np.int32,
-                                        "Outcome counts": np.int32,
-                                        "Scores": float,
-                                        },
-                                engine='python')
-            df_a = df_a.sort_values("Mediators")
-            result_filepath_b = result_dir_b + search_result.filename_stub + "_edge.csv"
-            try:
-                logger.info("Read current CSV edge file %s" % result_filepath_b)
-                df_b = pd.read_csv(result_filepath_b,
-                                    sep=',',
-                                    header=0,
-                                    names=("Mediators","Exposure counts","Outcome counts","Scores",),
-                                    index_col=False,
-                                    dtype= {"Mediators": str,
-                                            "Exposure counts": np.int32,
-                                            "Outcome counts": np.int32,
-                                            "Scores": float,
-                                            },
-                                    engine='python')
-                df_b = df_b.sort_values("Mediators")
-                is_different = not df_a.equals(df_b)
-                if is_different:
-                    search_result.has_edge_file_changed = True
-                    search_result.save()
-                    logger.warning("%d has CHANGED" % search_result.id)
-            except IOError as e:
-                raise IOError(e)
-
-            except:
-                raise
-
-        except IOError as e:
-            raise IOError(e)
-
-        except:
-            raise
+        df_a = read_edge_file(result_dir_a + search_result.filename_stub + "_edge.csv")
+        df_b = read_edge_file(result_dir_b + search_result.filename_stub + "_edge.csv")
+        is_different = not df_a.equals(df_b)
+        if is_different:
+            search_result.has_edge_file_changed = True
+            search_result.save()
+            logger.warning("%d has CHANGED" % search_result.id)
     else:
         logger.info("No previous match results have been recorded for search result %d" % search_result.id)
     logger.info("END comparing results files")
+
+
+def find_edge_file_differences(search_results, workers=None):
+    """Compare the version 1 and 3, and version 3 and 4, edge files of many search results in parallel, as per
+       record_differences_between_match_runs, without updating the search results.
+
+       search_results is a list of (id, filename_stub, mediator_match_counts, mediator_match_counts_v3) tuples.
+       Returns a list of (id, has_edge_file_changed, error) tuples, error is None unless an edge file could not be read.
+       workers defaults to settings.COMPARE_MATCH_RUNS_WORKERS, or when that is None the number of CPUs."""
+    if workers is None:
+        workers = settings.COMPARE_MATCH_RUNS_WORKERS or os.cpu_count() or 1
+    search_results = list(search_results)
+    if workers <= 1 or len(search_results) <= 1:
+        return [_find_edge_file_differences(search_result) for search_result in search_results]
+    # NB: Worker processes are forked so they share the already configured Django environment
+    with multiprocessing.get_context("fork").Pool(processes=min(workers, len(search_results))) as pool:
+        return pool.map(_find_edge_file_differences, search_results, chunksize=max(1, len(search_results) // (workers * 4)))
+
+
+def _find_edge_file_differences(search_result):
+    """Compare one search result's edge files for find_edge_file_differences, reading each file at most once."""
+    search_result_id, filename_stub, mediator_match_counts, mediator_match_counts_v3 = search_result
+    comparisons = list()
+    if mediator_match_counts is not None:
+        comparisons.append((settings.RESULTS_PATH_V1, settings.RESULTS_PATH_V3))
+    if mediator_match_counts_v3 is not None:
+        comparisons.append((settings.RESULTS_PATH_V3, settings.RESULTS_PATH_V4))
+
+    edge_files = dict()
+    has_edge_file_changed = False
+    try:
+        for result_dir_a, result_dir_b in comparisons:
+            for result_dir in (result_dir_a, result_dir_b):
+                if result_dir not in edge_files:
+                    edge_files[result_dir] = read_edge_file(result_dir + filename_stub + "_edge.csv")
+            if not edge_files[result_dir_a].equals(edge_files[result_dir_b]):
+                has_edge_file_changed = True
+    except (IOError, ValueError, pd.errors.ParserError) as e:
+        return search_result_id, has_edge_file_changed, str(e)
+    return search_result_id, has_edge_file_changed, None
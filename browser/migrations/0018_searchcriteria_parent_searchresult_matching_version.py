@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0017_auto_20240202_1728'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchcriteria',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='browser.searchcriteria'),
+        ),
+        migrations.AddField(
+            model_name='searchresult',
+            name='matching_version',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
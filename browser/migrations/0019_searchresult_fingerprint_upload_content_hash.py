@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0018_searchcriteria_parent_searchresult_matching_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchresult',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0019_searchresult_fingerprint_upload_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchStageTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('stage', models.CharField(max_length=30)),
+                ('wall_time', models.FloatField(help_text='Seconds')),
+                ('cpu_time', models.FloatField(help_text='Seconds, including any matching worker processes')),
+                ('citation_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('citations_per_second', models.FloatField(blank=True, null=True)),
+                ('peak_rss', models.PositiveBigIntegerField(help_text='Bytes, the peak resident set size of the worker by the end of the stage', verbose_name='Peak RSS')),
+                ('search_result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stage_timings', to='browser.searchresult')),
+            ],
+            options={
+                'ordering': ('search_result', 'position'),
+            },
+        ),
+    ]
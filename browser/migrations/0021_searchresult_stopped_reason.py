@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0020_searchstagetiming'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchresult',
+            name='stopped_reason',
+            field=models.CharField(blank=True, choices=[('cancelled', 'Cancelled'), ('time', 'Stopped, exceeded the time limit'), ('memory', 'Stopped, exceeded the memory limit')], max_length=10, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0021_searchresult_stopped_reason'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchresult',
+            name='queue_name',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+    ]
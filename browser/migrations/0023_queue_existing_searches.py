@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def record_queue_of_existing_searches(apps, schema_editor):
+    """Searches not yet completed were sent to the default queue, so must not be queued again by the scheduler."""
+    SearchResult = apps.get_model('browser', 'SearchResult')
+    SearchResult.objects.filter(has_completed=False, queue_name__isnull=True).update(queue_name='default')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0022_searchresult_queue_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(record_queue_of_existing_searches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0023_queue_existing_searches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchstagetiming',
+            name='outcome',
+            field=models.CharField(choices=[('completed', 'Completed'), ('cancelled', 'Cancelled'), ('time', 'Stopped, exceeded the time limit'), ('memory', 'Stopped, exceeded the memory limit'), ('failed', 'Failed, raised an error')], default='completed', max_length=10),
+        ),
+    ]
@@ -18,6 +18,9 @@ from django.conf import settings
 
 from mptt.models import MPTTModel, TreeForeignKey
 
+from browser.citation_store import citation_store_paths
+from browser.compression import hash_file
+
 logger = logging.getLogger(__name__)
 
 def get_user_upload_location(instance, filename):
@@ -131,6 +134,26 @@ ABSTRACT_FORMATS = (
 )
 
 
+# Reasons a search was stopped before it completed
+CANCELLED = 'cancelled'
+OVER_TIME_BUDGET = 'time'
+OVER_MEMORY_BUDGET = 'memory'
+
+# Searches still processing after this many seconds are assumed to have failed
+SEARCH_FAILURE_AGE = 12 * 60 * 60
+
+STOPPED_REASONS = (
+    (CANCELLED, 'Cancelled'),
+    (OVER_TIME_BUDGET, 'Stopped, exceeded the time limit'),
+    (OVER_MEMORY_BUDGET, 'Stopped, exceeded the memory limit'),
+)
+
+# Outcomes of a stage of matching a search, a stage that was stopped records the search's stopped reason
+STAGE_COMPLETED = 'completed'
+STAGE_FAILED = 'failed'
+STAGE_OUTCOMES = ((STAGE_COMPLETED, 'Completed'), ) + STOPPED_REASONS + ((STAGE_FAILED, 'Failed, raised an error'), )
+
+
 class Upload(models.Model):
     """Used to record user uploaded abstract files.
 
@@ -141,11 +164,20 @@ class Upload(models.Model):
                              related_name="uploads", on_delete=models.CASCADE)
     abstracts_upload = models.FileField(upload_to=get_user_upload_location)
     file_format = models.CharField(choices=ABSTRACT_FORMATS, max_length=6, default=OVID)
+    # SHA-256 of the uploaded file, see get_content_hash
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
 
     def __str__(self):
         """Create a string version of the original Upload file name."""
         return self.filename
 
+    def get_content_hash(self):
+        """Helper function to return the hash of the uploaded file, which is calculated and saved the first time it is needed."""
+        if not self.content_hash:
+            self.content_hash = hash_file(self.abstracts_upload.path)
+            Upload.objects.filter(pk=self.pk).update(content_hash=self.content_hash)
+        return self.content_hash
+
     @property
     def filename(self):
         """Helper function to extrapolate only the file name part of an upload."""
@@ -164,6 +196,12 @@ class Upload(models.Model):
                 os.remove(self.abstracts_upload.file.name)
             except:
                 pass
+            # Remove any parsed citation store created when the upload was searched
+            for citation_store_path in citation_store_paths(self.abstracts_upload.path):
+                try:
+                    os.remove(citation_store_path)
+                except:
+                    pass
             super(Upload, self).delete()
 
 
@@ -188,6 +226,8 @@ class SearchCriteria(models.Model):
     genes = models.ManyToManyField(Gene, blank=True,
         related_name='sc_gene', help_text="Enter one or more gene symbol")
     mesh_terms_year_of_release = models.PositiveSmallIntegerField(default=2015)
+    # Search criteria this was copied from when editing an existing search, so that its results can be reused
+    parent = models.ForeignKey('self', related_name='children', blank=True, null=True, on_delete=models.SET_NULL)
 
     def get_form_codes(self, search_type='exposure'):
         """Helper function to return terms in format that suits forms."""
@@ -254,6 +294,14 @@ class SearchResult(models.Model):
     mediator_match_counts_v3 = models.PositiveIntegerField(blank=True, null=True)
     mediator_match_counts_v4 = models.PositiveIntegerField(blank=True, null=True)
     has_edge_file_changed = models.BooleanField(default=False)
+    # Version of the matching code that produced the results, see browser.matching.MATCHING_VERSION
+    matching_version = models.PositiveSmallIntegerField(blank=True, null=True)
+    # Hash of the upload's content, search criteria and matching version, see browser.matching.get_search_fingerprint
+    fingerprint = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    # Set when a search is cancelled or exceeds its time or memory budget, see browser.matching.cancel_search
+    stopped_reason = models.CharField(choices=STOPPED_REASONS, max_length=10, blank=True, null=True)
+    # RQ queue the search was sent to, depending on its size, None while it is held by the scheduler, see browser.queues
+    queue_name = models.CharField(max_length=20, blank=True, null=True)
 
     # TMMA-288 Store a reference to the job that has been queue for processing, NB: This reference may not persist between 
     # redis restarts and should be used only for information when tracking processing.
@@ -262,7 +310,9 @@ class SearchResult(models.Model):
     @property
     def status(self):
         """Property identifying failed jobs"""
-        if self.has_failed:
+        if self.has_stopped:
+            return self.get_stopped_reason_display()
+        elif self.has_failed:
             return "Search failed"
         elif self.has_completed:
             return "Completed"
@@ -279,17 +329,22 @@ class SearchResult(models.Model):
         else:
             return False
 
+    @property
+    def has_stopped(self):
+        """Property identifying cancelled jobs and jobs stopped for exceeding their time or memory budget"""
+        return bool(self.stopped_reason)
+
     @property
     def has_failed(self):
         """Property identifying failed jobs"""
-        if self.has_completed or not self.has_started:
+        if self.has_completed or self.has_stopped or not self.has_started:
             return False
         else:
             # Still processing?
             # Assume all processing longer than 12hrs is broken?
             now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
             timediff = now - self.started_processing
-            if timediff.total_seconds() > (12 * 60 * 60):
+            if timediff.total_seconds() > SEARCH_FAILURE_AGE:
                 return True
             else:
                 return False
@@ -297,10 +352,14 @@ class SearchResult(models.Model):
     @property
     def is_deletable(self):
         status = True
-        if self.has_started and not self.has_completed and not self.has_failed:
+        if self.has_started and not self.has_completed and not self.has_failed and not self.has_stopped:
             status = False
         return status
 
+    @property
+    def is_cancellable(self):
+        return not (self.has_completed or self.has_failed or self.has_stopped)
+
     def delete(self):
         """ Override delete as there are a number of things we need to remove"""
 
@@ -357,6 +416,28 @@ class SearchResult(models.Model):
         info += "abstract: %s \n" % self.criteria.upload.file_format
         return info
 
+
+class SearchStageTiming(models.Model):
+    """Resources used by one stage of matching a search, see browser.pipeline, to show where the time goes on real uploads."""
+
+    search_result = models.ForeignKey(SearchResult, related_name='stage_timings', on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField()
+    stage = models.CharField(max_length=30)
+    wall_time = models.FloatField(help_text="Seconds")
+    cpu_time = models.FloatField(help_text="Seconds, including any matching worker processes")
+    # Only recorded for the stages that read citations
+    citation_count = models.PositiveIntegerField(blank=True, null=True)
+    citations_per_second = models.FloatField(blank=True, null=True)
+    peak_rss = models.PositiveBigIntegerField("Peak RSS", help_text="Bytes, the peak resident set size of the worker by the end of the stage")
+    outcome = models.CharField(choices=STAGE_OUTCOMES, max_length=10, default=STAGE_COMPLETED)
+
+    class Meta:
+        ordering = ('search_result', 'position', )
+
+    def __str__(self):
+        return "%s: %.3fs" % (self.stage, self.wall_time)
+
+
 class MessageManager(models.Manager):
 
     def get_current_messages(self):
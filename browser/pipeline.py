@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Stages of the matching pipeline run by browser.matching.perform_search, and the timing of each stage.
+
+The wall time, CPU time, citations per second and peak resident set size of each stage are saved as
+SearchStageTiming records, so that regressions can be tracked across releases.  Stages that are stopped or fail
+are recorded up to that point, with their outcome.
+"""
+from contextlib import contextmanager
+import os
+import resource
+import time
+
+from browser.models import STAGE_COMPLETED, STAGE_FAILED, SearchStageTiming
+
+LOAD_CRITERIA = "load criteria"
+LOAD_SYNONYMS = "load synonyms"
+PARSE = "parse"
+MATCH = "match"
+AGGREGATE = "aggregate"
+WRITE_CSV = "write CSV"
+WRITE_JSON = "write JSON"
+STAGES = (LOAD_CRITERIA, LOAD_SYNONYMS, PARSE, MATCH, AGGREGATE, WRITE_CSV, WRITE_JSON, )
+
+
+def get_cpu_time():
+    """User and system CPU time of this process and of its finished child processes, e.g. matching workers."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def get_peak_rss():
+    """Largest peak resident set size in bytes of this process and of its finished child processes."""
+    # NB: ru_maxrss is in kilobytes on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+
+class StageTimer:
+    """Time each stage of a search run within the stage context manager.
+
+    NB: Peak RSS can not be reset between stages, so a stage's peak RSS is the highest reached by the end of the stage.
+    """
+
+    def __init__(self):
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block, which may set the yielded timing's citation_count and outcome.
+
+        When the block raises SearchStopped the outcome is the stopped reason, or STAGE_FAILED for any other exception."""
+        # NB: browser.progress imports this module
+        from browser.progress import SearchStopped
+
+        timing = dict(stage=name, citation_count=None)
+        start_wall_time, start_cpu_time = time.perf_counter(), get_cpu_time()
+        try:
+            yield timing
+        except SearchStopped as e:
+            timing["outcome"] = e.reason
+            raise
+        except BaseException:
+            timing["outcome"] = STAGE_FAILED
+            raise
+        finally:
+            timing.setdefault("outcome", STAGE_COMPLETED)
+            timing["wall_time"] = time.perf_counter() - start_wall_time
+            timing["cpu_time"] = get_cpu_time() - start_cpu_time
+            timing["peak_rss"] = get_peak_rss()
+            if timing["citation_count"] is not None and timing["wall_time"] > 0:
+                timing["citations_per_second"] = timing["citation_count"] / timing["wall_time"]
+            self.timings.append(timing)
+
+    def save(self, search_result):
+        """Replace any previously recorded timings for the search result."""
+        SearchStageTiming.objects.filter(search_result=search_result).delete()
+        SearchStageTiming.objects.bulk_create([SearchStageTiming(search_result=search_result, position=position, **timing)
+                                               for position, timing in enumerate(self.timings)])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Live progress of running searches, published to Redis by browser.matching and polled from the results listing.
+
+Publishing progress is also when a search checks whether it has been cancelled, via a flag set in Redis,
+or has exceeded its time or memory budget, settings.SEARCH_TIME_BUDGET and SEARCH_MEMORY_BUDGET.
+
+Each search result's progress is held in a Redis hash, which is updated at most every
+settings.MATCHING_PROGRESS_INTERVAL seconds by each process matching citations:
+    stage               browser.pipeline stage reading citations, i.e. parse or match
+    started             time the stage started, in seconds since the epoch
+    total_bytes         size of the upload, 0 when unknown, i.e. when it is compressed
+    total_citations     number of citations in the upload, 0 until the upload has been parsed
+    bytes               bytes of the upload consumed
+    citations           citations processed
+    matches             citations with a gene or mediator matched
+"""
+import time
+
+from django.conf import settings
+import django_rq
+
+from browser.models import CANCELLED, OVER_MEMORY_BUDGET, OVER_TIME_BUDGET
+from browser.pipeline import get_peak_rss
+
+PROGRESS_KEY = "temmpo:progress:%d"
+CANCEL_KEY = "temmpo:cancel:%d"
+# Progress of jobs that stop without finishing is discarded after a day
+PROGRESS_TIMEOUT = 60 * 60 * 24
+# Number of citations read between checks of whether progress is due to be published
+PROGRESS_CHECK_CITATIONS = 256
+COUNT_NAMES = ("bytes", "citations", "matches", )
+
+
+class SearchStopped(Exception):
+    """Raised to stop a search, with the reason, one of browser.models.STOPPED_REASONS"""
+
+    def __init__(self, reason):
+        super(SearchStopped, self).__init__(reason)
+        self.reason = reason
+
+
+def request_cancellation(search_result_id):
+    """Flag a search to be stopped the next time it publishes its progress."""
+    django_rq.get_connection().set(CANCEL_KEY % search_result_id, 1, ex=PROGRESS_TIMEOUT)
+
+
+def clear_cancellation(search_result_id):
+    django_rq.get_connection().delete(CANCEL_KEY % search_result_id)
+
+
+class ProgressReporter:
+    """Publish the progress of reading citations for a search result.
+
+    Counts are published as increments, so that each worker process matching a shard of the upload can report
+    its own progress, with bytes consumed measured from first_byte, the start of the shard.
+    The time budget is measured from started, the time the search started in seconds since the epoch.
+    """
+
+    def __init__(self, search_result_id, first_byte=0, started=None):
+        self.search_result_id = search_result_id
+        self.key = PROGRESS_KEY % search_result_id
+        self.first_byte = first_byte
+        self.started = time.time() if started is None else started
+        self._connection = None
+        self._published = dict((name, 0) for name in COUNT_NAMES)
+        self._published_at = time.monotonic()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = django_rq.get_connection()
+        return self._connection
+
+    def start_stage(self, stage, total_bytes=None, total_citations=None):
+        """Reset the progress at the start of a stage."""
+        pipeline = self.connection.pipeline()
+        pipeline.delete(self.key)
+        pipeline.hset(self.key, mapping=dict(stage=stage, started=time.time(), total_bytes=total_bytes or 0, total_citations=total_citations or 0,
+                                             **dict((name, 0) for name in COUNT_NAMES)))
+        pipeline.expire(self.key, PROGRESS_TIMEOUT)
+        pipeline.execute()
+        self._published = dict((name, 0) for name in COUNT_NAMES)
+        self._published_at = time.monotonic()
+
+    def update(self, citations, matches=0, offset=None, force=False):
+        """Publish the number of citations processed and matched so far, and the bytes consumed up to offset,
+        unless progress was published less than settings.MATCHING_PROGRESS_INTERVAL seconds ago, then check
+        whether the search should be stopped."""
+        now = time.monotonic()
+        if not force and now - self._published_at < settings.MATCHING_PROGRESS_INTERVAL:
+            return
+        counts = dict(bytes=self._published["bytes"] if offset is None else offset - self.first_byte, citations=citations, matches=matches)
+        pipeline = self.connection.pipeline()
+        for name in COUNT_NAMES:
+            if counts[name] != self._published[name]:
+                pipeline.hincrby(self.key, name, counts[name] - self._published[name])
+        pipeline.expire(self.key, PROGRESS_TIMEOUT)
+        pipeline.execute()
+        self._published = counts
+        self._published_at = now
+        self.check()
+
+    def check(self):
+        """Raise SearchStopped if the search has been cancelled or has exceeded its time or memory budget.
+
+        NB: The memory budget applies to the peak memory use of each process matching citations."""
+        if self.connection.exists(CANCEL_KEY % self.search_result_id):
+            raise SearchStopped(CANCELLED)
+        if settings.SEARCH_TIME_BUDGET and time.time() - self.started > settings.SEARCH_TIME_BUDGET:
+            raise SearchStopped(OVER_TIME_BUDGET)
+        if settings.SEARCH_MEMORY_BUDGET and get_peak_rss() > settings.SEARCH_MEMORY_BUDGET:
+            raise SearchStopped(OVER_MEMORY_BUDGET)
+
+    def track(self, citations):
+        """Yield each of citations, publishing the number read and bytes consumed as they are read."""
+        citation_count = 0
+        for citation_count, citation in enumerate(citations, 1):
+            if citation_count % PROGRESS_CHECK_CITATIONS == 0:
+                self.update(citation_count, offset=citation.offset)
+            yield citation
+        self.update(citation_count, force=True)
+
+    def finish(self):
+        """Remove the progress once the search has finished."""
+        self.connection.delete(self.key)
+
+
+def get_progress(search_result_id):
+    """Return the latest progress of a running search, or None, with its percentage complete and estimated seconds remaining.
+
+    The percentage is of the current stage, by citations when the number in the upload is known, otherwise by bytes."""
+    values = django_rq.get_connection().hgetall(PROGRESS_KEY % search_result_id)
+    if not values:
+        return None
+    values = dict((name.decode(), value.decode()) for name, value in values.items())
+    progress = dict((name, int(values.get(name, 0))) for name in COUNT_NAMES + ("total_bytes", "total_citations", ))
+    progress["stage"] = values.get("stage", "")
+
+    fraction = None
+    if progress["total_citations"]:
+        fraction = min(progress["citations"] / progress["total_citations"], 1.0)
+    elif progress["total_bytes"]:
+        fraction = min(progress["bytes"] / progress["total_bytes"], 1.0)
+    progress["percentage"] = None if fraction is None else round(fraction * 100, 1)
+    elapsed = max(time.time() - float(values.get("started", time.time())), 0.0)
+    progress["eta_seconds"] = int(elapsed * (1 - fraction) / fraction) if fraction else None
+    return progress
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Citations supporting each cell of the edge matrix, i.e. the provenance of the edge counts from browser.matching.
+
+Stored in compressed sparse row style arrays (*_provenance.npz) alongside the other results files:
+    cells       sorted flat indices, row id * column count + column id, of the edge matrix cells with a count
+    indptr      cell i is supported by ordinals[indptr[i]:indptr[i + 1]]
+    ordinals    sorted ordinals of the supporting citations in citation_ids
+    row_indptr, row_ordinals    as per indptr and ordinals, for every row of the edge matrix, the citations each
+                                gene or mediator was found in, whether or not any exposure or outcome was
+    citation_numbers    position of each matched citation in the abstracts file, as per CitationStore ordinals
+    citation_ids    IDs of the citations with matches, in file order, as per *_abstracts.csv before de-duplication
+
+Citation numbers identify the same citations across searches of an upload, so that provenance can be combined.
+"""
+import numpy as np
+
+PROVENANCE_SUFFIX = "_provenance.npz"
+
+
+class EdgeProvenanceBuilder:
+    """Collect (cell, citation ordinal) and (row, citation ordinal) pairs for batches of matched citations and
+    compress them into CSR arrays.
+
+    Ordinals are numbered from 0 in the order matched citations are added, so pairs must be added in that order.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self._cells = []
+        self._ordinals = []
+        self._row_ids = []
+        self._row_ordinals = []
+        self._citation_numbers = []
+
+    def add_batch(self, rows, cols, first_ordinal, citation_numbers):
+        """Record the pairs for a batch of consecutive citations given as row and column indicator matrices,
+        i.e. citation i of the batch has ordinal first_ordinal + i and supports every cell (r, c) where rows[i, r] and cols[i, c]."""
+        row_citations, row_ids = np.nonzero(rows)
+        column_citations, column_ids = np.nonzero(cols)
+        column_counts = np.bincount(column_citations, minlength=len(rows))
+        column_starts = np.cumsum(column_counts) - column_counts
+
+        # Each row found in a citation is paired with each of the same citation's columns
+        repeats = column_counts[row_citations]
+        pair_row_entries = np.repeat(np.arange(len(row_ids)), repeats)
+        pair_citations = row_citations[pair_row_entries]
+        pair_positions = np.arange(len(pair_row_entries)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        pair_column_ids = column_ids[column_starts[pair_citations] + pair_positions]
+        self.add_pairs(row_ids[pair_row_entries] * self.shape[1] + pair_column_ids, pair_citations + first_ordinal)
+        self.add_rows(row_ids, row_citations + first_ordinal)
+        self.add_citation_numbers(citation_numbers)
+
+    def add_pairs(self, cells, ordinals):
+        """Record arrays of flat cell indices and the ordinals of the citations supporting them."""
+        if len(cells):
+            self._cells.append(np.asarray(cells, dtype=np.int64))
+            self._ordinals.append(np.asarray(ordinals, dtype=np.int64))
+
+    def add_rows(self, row_ids, ordinals):
+        """Record arrays of row ids and the ordinals of the citations the rows' genes or mediators were found in."""
+        if len(row_ids):
+            self._row_ids.append(np.asarray(row_ids, dtype=np.int64))
+            self._row_ordinals.append(np.asarray(ordinals, dtype=np.int64))
+
+    def add_citation_numbers(self, citation_numbers):
+        """Record the citation numbers of the next matched citations, in ordinal order."""
+        if len(citation_numbers):
+            # NB: Copied, as EdgeAccumulator reuses its array of citation numbers for each batch
+            self._citation_numbers.append(np.array(citation_numbers, dtype=np.int64))
+
+    @staticmethod
+    def _concatenate(arrays):
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+
+    def arrays(self):
+        """Return all of the pairs and citation numbers recorded so far, e.g. to combine shards with extend."""
+        return (self._concatenate(self._cells), self._concatenate(self._ordinals),
+                self._concatenate(self._row_ids), self._concatenate(self._row_ordinals),
+                self._concatenate(self._citation_numbers))
+
+    def extend(self, arrays, first_ordinal, first_citation_number):
+        """Add the arrays from another builder for the same shape, renumbering its ordinals and citation numbers."""
+        cells, ordinals, row_ids, row_ordinals, citation_numbers = arrays
+        self.add_pairs(cells, ordinals + first_ordinal)
+        self.add_rows(row_ids, row_ordinals + first_ordinal)
+        self.add_citation_numbers(citation_numbers + first_citation_number)
+
+    def build(self):
+        """Return a dictionary of the arrays described above, other than citation_ids, with ordinals sorted within each cell and row."""
+        cells, ordinals, row_ids, row_ordinals, citation_numbers = self.arrays()
+        ordinal_dtype = np.min_scalar_type(max(len(citation_numbers) - 1, 0))
+
+        order = np.lexsort((ordinals, cells))
+        cells, ordinals = cells[order], ordinals[order]
+        unique_cells, starts = np.unique(cells, return_index=True)
+
+        order = np.lexsort((row_ordinals, row_ids))
+        row_indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+        row_indptr[1:] = np.cumsum(np.bincount(row_ids, minlength=self.shape[0]))
+
+        return {
+            "shape": np.array(self.shape, dtype=np.int64),
+            "cells": unique_cells,
+            "indptr": np.append(starts, len(cells)).astype(np.int64),
+            "ordinals": ordinals.astype(ordinal_dtype),
+            "row_indptr": row_indptr,
+            "row_ordinals": row_ordinals[order].astype(ordinal_dtype),
+            "citation_numbers": citation_numbers,
+        }
+
+
+def _citation_id_array(citation_ids):
+    return np.array([citation_id.decode("utf-8") for citation_id in citation_ids], dtype=str)
+
+
+def save_edge_provenance(builder, citation_ids, file_path):
+    """Write the provenance collected by builder, along with the IDs the ordinals refer to, to a compressed .npz file"""
+    np.savez_compressed(file_path, citation_ids=_citation_id_array(citation_ids), **builder.build())
+
+
+class EdgeProvenance:
+    """Provenance read from a *_provenance.npz file, with the supporting citations identified by citation number."""
+
+    def __init__(self, shape, cells, indptr, ordinals, row_indptr, row_ordinals, citation_numbers, citation_ids):
+        self.shape = tuple(shape)
+        self.cells = cells
+        self.indptr = indptr
+        self.ordinals = ordinals
+        self.row_indptr = row_indptr
+        self.row_ordinals = row_ordinals
+        self.citation_numbers = citation_numbers
+        self.citation_ids = citation_ids
+
+    @classmethod
+    def load(cls, file_path):
+        """Read provenance written by save_edge_provenance."""
+        with np.load(file_path) as provenance:
+            return cls(provenance["shape"].tolist(), provenance["cells"], provenance["indptr"], provenance["ordinals"],
+                       provenance["row_indptr"], provenance["row_ordinals"], provenance["citation_numbers"], provenance["citation_ids"])
+
+    @classmethod
+    def from_builder(cls, builder, citation_ids):
+        """Provenance collected by builder, along with the IDs the ordinals refer to, as would be read from the saved file."""
+        return cls(citation_ids=_citation_id_array(citation_ids), **builder.build())
+
+    @classmethod
+    def empty(cls, shape):
+        """Provenance for a search without any matches, for which no file is written."""
+        no_ordinals = np.zeros(0, dtype=np.int64)
+        return cls(shape, no_ordinals, np.zeros(1, dtype=np.int64), no_ordinals, np.zeros(shape[0] + 1, dtype=np.int64),
+                   no_ordinals, no_ordinals, np.zeros(0, dtype=str))
+
+    def cell_citations(self):
+        """Return arrays of the row id, column id and citation number of every (cell, supporting citation) pair."""
+        cells = np.repeat(self.cells, np.diff(self.indptr))
+        return cells // self.shape[1], cells % self.shape[1], self.citation_numbers[self.ordinals]
+
+    def row_citations(self):
+        """Return arrays of the row id and citation number of every (row, citation found in) pair."""
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.row_indptr)), self.citation_numbers[self.row_ordinals]
+
+
+def load_supporting_citation_ids(file_path, row_id, column_id):
+    """Return the IDs of the citations supporting one cell of the edge matrix, in file order."""
+    with np.load(file_path) as provenance:
+        row_count, column_count = provenance["shape"].tolist()
+        if not (0 <= row_id < row_count and 0 <= column_id < column_count):
+            raise IndexError("Edge matrix cell (%d, %d) is out of range" % (row_id, column_id))
+        cells = provenance["cells"]
+        cell = row_id * column_count + column_id
+        position = int(np.searchsorted(cells, cell))
+        if position == len(cells) or cells[position] != cell:
+            return []
+        start, end = provenance["indptr"][position:position + 2].tolist()
+        return provenance["citation_ids"][provenance["ordinals"][start:end]].tolist()
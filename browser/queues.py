@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Schedule searches fairly between users and route them to separate RQ queues by their size.
+
+Searches are held until their user has fewer than settings.MAX_RUNNING_SEARCHES_PER_USER searches queued or
+running, then queued in turn for each user, so that one user's searches can not take up all of the workers.
+
+A search is large when its upload, or its search criteria, i.e. the gene synonyms and MeSH terms to match,
+exceed settings.LARGE_SEARCH_UPLOAD_SIZE or LARGE_SEARCH_CRITERIA_SIZE, so that small searches are not held up
+behind large ones. Each queue, as defined in settings.RQ_QUEUES, has its own workers, see deploy/deploy-rhel.sh
+"""
+from contextlib import contextmanager
+import datetime
+from itertools import zip_longest
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+import django_rq
+from rq.job import Job
+
+from browser.compression import is_compressed
+from browser.matching import perform_batch_search, perform_search
+from browser.models import Gene, SearchResult, SEARCH_FAILURE_AGE
+
+logger = logging.getLogger(__name__)
+
+SMALL_QUEUE = 'small'
+LARGE_QUEUE = 'large'
+INDEX_QUEUE = 'indexes'
+# Searches queued before they were scheduled were all run on the default queue, see migration 0023
+LEGACY_QUEUE = 'default'
+SEARCH_QUEUES = (SMALL_QUEUE, LARGE_QUEUE, LEGACY_QUEUE)
+SEARCH_JOB_ID = "temmpo-search-%d"
+BATCH_SEARCH_JOB_ID = "temmpo-batch-search-%d"
+SCHEDULER_LOCK = "temmpo:scheduler"
+SCHEDULER_LOCK_TIMEOUT = 60
+SCHEDULER_LOCK_WAIT = 0.1
+# Rough ratio of the size of abstracts files to their size once gzip or bzip2 compressed
+COMPRESSION_RATIO_ESTIMATE = 4
+
+
+def get_upload_size(upload):
+    """Estimated size of an upload's abstracts file in bytes once decompressed."""
+    file_path = upload.abstracts_upload.path
+    size = os.path.getsize(file_path)
+    if is_compressed(file_path):
+        size *= COMPRESSION_RATIO_ESTIMATE
+    return size
+
+
+def get_criteria_size(search_criteria):
+    """Number of gene names, gene synonyms and MeSH terms a search matches against each citation."""
+    genes = search_criteria.get_wcrf_input_variables('gene')
+    synonym_count = Gene.objects.filter(synonym_for__name__in=genes).count()
+    term_count = sum(len(search_criteria.get_wcrf_input_variables(codename)) for codename in ('exposure', 'mediator', 'outcome'))
+    return len(genes) + synonym_count + term_count
+
+
+def get_search_queue_name(search_result):
+    """Name of the queue to run a search on, depending on the size of its upload and its search criteria."""
+    if get_upload_size(search_result.criteria.upload) > settings.LARGE_SEARCH_UPLOAD_SIZE:
+        return LARGE_QUEUE
+    if get_criteria_size(search_result.criteria) > settings.LARGE_SEARCH_CRITERIA_SIZE:
+        return LARGE_QUEUE
+    return SMALL_QUEUE
+
+
+def run_search(search_result_id):
+    """Run a search, then queue any held searches now that it has finished."""
+    try:
+        perform_search(search_result_id)
+    finally:
+        dispatch_searches()
+
+
+def enqueue_search(search_result):
+    """Run a search on the queue recorded for it by dispatch_searches."""
+    logger.info("Search result %d queued on %s queue" % (search_result.id, search_result.queue_name))
+    return django_rq.get_queue(search_result.queue_name).enqueue(run_search, search_result.id, job_id=SEARCH_JOB_ID % search_result.id)
+
+
+def run_batch_search(search_result_ids):
+    """Run a batch of searches of the same upload, then queue any held searches now that they have finished."""
+    try:
+        perform_batch_search(search_result_ids)
+    finally:
+        dispatch_searches()
+
+
+def remove_search_job(search_result, queued_search_ids):
+    """Remove a queued search's job from its queue before a worker takes it, returning False if the search is still run
+    by another job, e.g. a worker has taken it or it is part of a batch, as per get_queued_search_ids.
+
+    NB: A search whose job no longer exists, e.g. when Redis has lost it, can also be run another way."""
+    queue = django_rq.get_queue(search_result.queue_name)
+    job_id = SEARCH_JOB_ID % search_result.id
+    if queue.remove(job_id):
+        queue.fetch_job(job_id).delete(remove_from_queue=False)
+        return True
+    return search_result.id not in queued_search_ids
+
+
+def claim_batch_search(search_results):
+    """Mark searches of the same upload as queued to run as a batch, on the large queue if any of them is large, and
+    return the queue name.
+
+    Searches may be held by the scheduler or queued by it but not yet started, when their jobs are removed so that each
+    search is only run once. Raises ValueError if any of them has started or stopped, including when a worker takes
+    a queued search's job first, is already part of a batch, or was queued before searches were scheduled, i.e. on
+    the LEGACY_QUEUE.
+    NB: Must be called while holding the scheduler_lock."""
+    search_result_ids = [search_result.id for search_result in search_results]
+    batch = SearchResult.objects.filter(id__in=search_result_ids)
+    stopped = batch.filter(Q(stopped_reason__isnull=False) | Q(started_processing__isnull=False) | Q(has_completed=True) |
+                           Q(queue_name=LEGACY_QUEUE))
+    stopped_ids = sorted(stopped.values_list('id', flat=True))
+    if stopped_ids:
+        raise ValueError("Search results have already been run or stopped: %s" % stopped_ids)
+
+    removed_ids = []
+    queued_search_ids = get_queued_search_ids()
+    for search_result in batch.filter(queue_name__isnull=False).order_by('id'):
+        if not remove_search_job(search_result, queued_search_ids):
+            # Searches whose jobs have been removed are held again, to be queued by the next dispatch_searches
+            SearchResult.objects.filter(id__in=removed_ids).update(queue_name=None)
+            raise ValueError("Search result %d has already been started by a worker or queued in a batch" % search_result.id)
+        removed_ids.append(search_result.id)
+
+    queue_name = SMALL_QUEUE
+    if any(get_search_queue_name(search_result) == LARGE_QUEUE for search_result in search_results):
+        queue_name = LARGE_QUEUE
+    batch.update(queue_name=queue_name)
+    for search_result in search_results:
+        search_result.queue_name = queue_name
+    return queue_name
+
+
+def enqueue_batch_search(search_results):
+    """Run searches of the same upload as one job, reading the upload once, see claim_batch_search.
+
+    NB: As per dispatch_searches the job is sent to RQ while holding the scheduler lock unless RQ is not asynchronous."""
+    search_result_ids = [search_result.id for search_result in search_results]
+    with scheduler_lock():
+        queue_name = claim_batch_search(search_results)
+        queue = django_rq.get_queue(queue_name)
+        logger.info("Search results %s queued as a batch on %s queue" % (search_result_ids, queue_name))
+        if queue.is_async:
+            return queue.enqueue(run_batch_search, search_result_ids, job_id=BATCH_SEARCH_JOB_ID % min(search_result_ids))
+    return queue.enqueue(run_batch_search, search_result_ids, job_id=BATCH_SEARCH_JOB_ID % min(search_result_ids))
+
+
+def schedule_search(search_result):
+    """Hold a search until it is its user's turn to have a search run."""
+    logger.info("Search result %d scheduled" % search_result.id)
+    dispatch_searches()
+
+
+def get_held_searches():
+    """Return the ID and user ID of the searches that have not yet been queued, in the order they will be queued.
+
+    Users take turns in the order of their oldest held search, each user's searches are queued oldest first."""
+    held_searches = SearchResult.objects.filter(queue_name__isnull=True, has_completed=False, stopped_reason__isnull=True,
+                                                started_processing__isnull=True)
+    searches_by_user = dict()
+    for search_result_id, user_id in held_searches.order_by('id').values_list('id', 'criteria__upload__user'):
+        searches_by_user.setdefault(user_id, []).append((search_result_id, user_id))
+    return [search for searches in zip_longest(*searches_by_user.values()) for search in searches if search is not None]
+
+
+def get_job_search_ids(queue, job_ids):
+    """Return the IDs of the searches run by the RQ jobs with the given IDs, including searches queued by earlier versions."""
+    search_ids = set()
+    for job in Job.fetch_many(job_ids, connection=queue.connection):
+        if job is None:
+            continue
+        if job.func_name in ("%s.%s" % (__name__, run_search.__name__), "%s.%s" % (perform_search.__module__, perform_search.__name__)):
+            search_ids.add(job.args[0])
+        elif job.func_name == "%s.%s" % (__name__, run_batch_search.__name__):
+            search_ids.update(job.args[0])
+    return search_ids
+
+
+def get_queued_search_ids():
+    """Return the IDs of the searches whose RQ jobs are waiting in their queue, deferred, scheduled or running.
+
+    NB: Listing the running jobs moves those whose work-horse was killed to the failed job registry."""
+    queued_search_ids = set()
+    for queue_name in SEARCH_QUEUES:
+        queue = django_rq.get_queue(queue_name)
+        job_ids = (queue.get_job_ids() + queue.started_job_registry.get_job_ids() + queue.deferred_job_registry.get_job_ids() +
+                   queue.scheduled_job_registry.get_job_ids())
+        queued_search_ids.update(get_job_search_ids(queue, job_ids))
+    return queued_search_ids
+
+
+def get_failed_search_ids():
+    """Return the IDs of the searches whose RQ jobs have failed, including those whose work-horse was killed, e.g. by the
+    kernel when out of memory, before the search could record that it stopped."""
+    failed_search_ids = set()
+    for queue_name in SEARCH_QUEUES:
+        queue = django_rq.get_queue(queue_name)
+        failed_search_ids.update(get_job_search_ids(queue, queue.failed_job_registry.get_job_ids()))
+    return failed_search_ids
+
+
+def get_running_counts():
+    """Return a dictionary of user ID => number of the user's searches that are queued or running.
+
+    Searches are not counted when their jobs have failed, or they have not started and their jobs no longer exist,
+    e.g. when Redis has lost them, or they started more than SEARCH_FAILURE_AGE seconds ago.
+    Searches on the LEGACY_QUEUE were queued before searches were scheduled, so are not counted either."""
+    failure_cutoff = timezone.now() - datetime.timedelta(seconds=SEARCH_FAILURE_AGE)
+    running_searches = SearchResult.objects.filter(queue_name__isnull=False, has_completed=False, stopped_reason__isnull=True)
+    running_searches = running_searches.exclude(queue_name=LEGACY_QUEUE)
+    running_searches = running_searches.filter(Q(started_processing__isnull=True, id__in=get_queued_search_ids()) |
+                                               Q(started_processing__gt=failure_cutoff))
+    running_searches = running_searches.exclude(id__in=get_failed_search_ids())
+    return dict(running_searches.values_list('criteria__upload__user').annotate(Count('id')).order_by())
+
+
+@contextmanager
+def scheduler_lock():
+    """Hold a lock in Redis while dispatching searches, waiting while another process holds it.
+
+    The lock expires after SCHEDULER_LOCK_TIMEOUT seconds, in case the process holding it is killed."""
+    connection = django_rq.get_connection()
+    token = uuid.uuid4().hex
+    while not connection.set(SCHEDULER_LOCK, token, nx=True, ex=SCHEDULER_LOCK_TIMEOUT):
+        time.sleep(SCHEDULER_LOCK_WAIT)
+    try:
+        yield
+    finally:
+        # NB: Only release the lock if it has not expired and been taken by another process
+        if connection.get(SCHEDULER_LOCK) == token.encode():
+            connection.delete(SCHEDULER_LOCK)
+
+
+def dispatch_searches():
+    """Queue held searches in turn for each user, while the user has fewer than settings.MAX_RUNNING_SEARCHES_PER_USER
+    searches queued or running.
+
+    Called when searches are scheduled, finish, are cancelled or deleted, and periodically by the dispatch_searches
+    management command, as a search whose work-horse is killed can not queue the searches held behind it.
+
+    NB: Searches are marked as queued while holding a lock, so that they can only be dispatched once, and sent to RQ
+        before it is released, so that their jobs exist when the next dispatch counts them, unless RQ is not asynchronous,
+        when jobs run as they are queued, so are sent after it is released."""
+    dispatched = []
+    with scheduler_lock():
+        running_counts = get_running_counts()
+        for search_result_id, user_id in get_held_searches():
+            if running_counts.get(user_id, 0) >= settings.MAX_RUNNING_SEARCHES_PER_USER:
+                continue
+            running_counts[user_id] = running_counts.get(user_id, 0) + 1
+            search_result = SearchResult.objects.select_related('criteria__upload').get(pk=search_result_id)
+            search_result.queue_name = get_search_queue_name(search_result)
+            search_result.save()
+            if django_rq.get_queue(search_result.queue_name).is_async:
+                enqueue_search(search_result)
+            else:
+                dispatched.append(search_result)
+
+    for search_result in dispatched:
+        enqueue_search(search_result)
+
+
+def get_pending_position(search_result):
+    """Position of a held search in the order searches will be queued, counting from 1, or None if it is not held."""
+    if search_result.queue_name or search_result.has_started or search_result.has_stopped or search_result.has_completed:
+        return None
+    for position, (search_result_id, user_id) in enumerate(get_held_searches(), 1):
+        if search_result_id == search_result.id:
+            return position
+    return None
+
+
+def get_queue_position(search_result):
+    """Position of a search waiting to run in its queue, counting from 1, or None if it is not waiting."""
+    if not search_result.queue_name or search_result.has_started or search_result.has_stopped:
+        return None
+    position = django_rq.get_queue(search_result.queue_name).get_job_position(SEARCH_JOB_ID % search_result.id)
+    return None if position is None else position + 1
@@ -6,6 +6,8 @@ import magic
 
 from django.core.exceptions import ValidationError
 
+from browser.compression import decompressed_file
+
 logger = logging.getLogger(__name__)
 
 OVID_MEDLINE_IDENTIFIER_PATTERN = re.compile(rb"^<\d+>")
@@ -25,7 +27,9 @@ class MimetypeValidator(object):
 
     def __call__(self, value):
         try:
-            mime = magic.from_buffer(value.read(1024), mime=True)
+            # Archives are checked by the type of file they contain
+            mime = magic.from_buffer(decompressed_file(value).read(1024), mime=True)
+            value.seek(0)
             logger.debug("DEBUG: temp file path %s" % value.temporary_file_path())
             logger.debug("DEBUG: mime %s" % mime)
             if mime not in self.mimetypes:
@@ -60,12 +64,13 @@ class OvidMedLineFormatValidator(object):
 
     def __call__(self, value):
         if value:
-            value.seek(0)
-            first_line = value.readline()
-            second_line = value.readline()
+            abstracts = decompressed_file(value)
+            first_line = abstracts.readline()
+            second_line = abstracts.readline()
+            is_valid = has_ovid_medline_file_header(first_line, second_line) and has_ovid_medline_mesh_headings(abstracts)
             value.seek(0)
 
-            if has_ovid_medline_file_header(first_line, second_line) and has_ovid_medline_mesh_headings(value):
+            if is_valid:
                 return value
             else:
                 raise ValidationError('This file %s does not appear to be a Ovid MEDLINE® formatted export of journal '
@@ -84,12 +89,13 @@ class PubMedFormatValidator(object):
 
     def __call__(self, value):
         if value:
-            value.seek(0)
-            first_line = value.readline()
-            second_line = value.readline()
+            abstracts = decompressed_file(value)
+            first_line = abstracts.readline()
+            second_line = abstracts.readline()
+            is_valid = has_pubmed_file_header(first_line, second_line) and has_pubmed_mh(abstracts)
             value.seek(0)
 
-            if has_pubmed_file_header(first_line, second_line) and has_pubmed_mh(value):
+            if is_valid:
                 return value
             else:
                 raise ValidationError('This file %s does not appear to be a PubMed/MEDLINE® formatted export of journal abstracts with MH (MeSH headers).' % value)
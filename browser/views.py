@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from dal import autocomplete
 import logging
+import os
+import re
 import django_rq
 
 from django.conf import settings
@@ -8,19 +10,25 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.urls import reverse, reverse_lazy
-from django.http import Http404, JsonResponse
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import method_decorator
-from django.views.generic import ListView
+from django.utils.http import parse_etags
+from django.views.generic import ListView, View
 from django.views.generic.base import TemplateView, RedirectView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, UpdateView, FormView, DeleteView
 from django.contrib.auth.models import User
 from django.contrib.auth import logout
 
+from browser.compression import GZIP_SUFFIX
 from browser.forms import OvidMedLineFileUploadForm, PubMedFileUploadForm, TermSelectorForm, FilterForm
 from browser.models import SearchCriteria, SearchResult, MeshTerm, Upload, Message
-from browser.matching import perform_search
+from browser.progress import get_progress
+from browser.matching import build_gene_mention_index, cancel_search, load_edge_matrix, reuse_identical_search_result, top_mediators
+from browser.provenance import PROVENANCE_SUFFIX, load_supporting_citation_ids
+from browser.queues import INDEX_QUEUE, dispatch_searches, get_pending_position, get_queue_position, schedule_search
 from browser.utils import delete_user_content
 
 logger = logging.getLogger(__name__)
@@ -127,6 +135,9 @@ class SearchOvidMEDLINE(CreateView):
         self.object = form.save(commit=False)
         self.object.user = self.request.user
         self.object.save()
+        if settings.BUILD_GENE_MENTION_INDEX:
+            # Index gene mentions in the background so that later searches of this upload do not need to search abstracts
+            django_rq.get_queue(INDEX_QUEUE).enqueue(build_gene_mention_index, self.object.id)
         return super(SearchOvidMEDLINE, self).form_valid(form)
 
 
@@ -285,7 +296,7 @@ class SearchExisting(RedirectView):
 
         # NB: Need to deep copy to ensure Many to Many relationships are captured
         current_year = MeshTerm.get_latest_mesh_term_release_year()
-        criteria_copy = SearchCriteria(upload=original_criteria.upload, mesh_terms_year_of_release=current_year)
+        criteria_copy = SearchCriteria(upload=original_criteria.upload, mesh_terms_year_of_release=current_year, parent=original_criteria)
         criteria_copy.save()
         criteria_copy.genes.set(original_criteria.genes.all())
         original_exposures = original_criteria.exposure_terms.all()
@@ -351,8 +362,9 @@ class FilterSelector(UpdateView):
         search_result.mesh_filter = mesh_filter
         search_result.save()
 
-        # Run the search via message queue
-        django_rq.enqueue(perform_search, search_result.id)
+        # Reuse the results files of an identical completed search, otherwise schedule the search to run via message queue
+        if not reuse_identical_search_result(search_result, calculate_content_hash=False):
+            schedule_search(search_result)
 
         return response
 
@@ -387,6 +399,7 @@ class ResultsView(TemplateView):
         context['search_result'] = self.search_result
         context['json_url'] = reverse('json_data', kwargs=kwargs)
         context['score_csv_url'] = reverse('count_data', kwargs=kwargs)
+        context['mediators_json_url'] = reverse('mediators_data', kwargs=kwargs)
         context['abstract_ids_csv_url'] = reverse('abstracts_data', kwargs=kwargs)
         context['json_url_v1'] = reverse('json_data_v1', kwargs=kwargs)
         context['score_csv_url_v1'] = reverse('count_data_v1', kwargs=kwargs)
@@ -446,6 +459,9 @@ class ResultsListingView(ListView):
         context = super(ResultsListingView, self).get_context_data(**kwargs)
         context['active'] = 'results'
         context['unprocessed'] = SearchResult.objects.filter(criteria__upload__user=self.request.user).filter(has_completed=False).order_by("-criteria__created")
+        for result_stub in context['unprocessed']:
+            result_stub.queue_position = get_queue_position(result_stub)
+            result_stub.pending_position = get_pending_position(result_stub)
         context['system_messages'] = Message.objects.get_current_messages()
         return context
 
@@ -506,7 +522,8 @@ class CountDataView(RedirectView):
 
     def get_redirect_url(self, *args, **kwargs):
         search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
-        url = settings.RESULTS_URL + '%s_edge.csv' % search_result.filename_stub
+        # NB: Served by CompressedDataView, which sends the gzip copy to browsers that accept it
+        url = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': 'count'})
         return url
 
 class CountDataViewV1(CountDataView):
@@ -544,7 +561,8 @@ class AbstractDataView(RedirectView):
 
     def get_redirect_url(self, *args, **kwargs):
         search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
-        url = settings.RESULTS_URL + '%s_abstracts.csv' % search_result.filename_stub
+        # NB: Served by CompressedDataView, which sends the gzip copy to browsers that accept it
+        url = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': 'abstracts'})
         return url
 
 
@@ -583,7 +601,8 @@ class JSONDataView(RedirectView):
 
     def get_redirect_url(self, *args, **kwargs):
         search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
-        url = settings.RESULTS_URL + '%s.json' % search_result.filename_stub
+        # NB: Served by CompressedDataView, which sends the gzip copy to browsers that accept it
+        url = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': 'json'})
         return url
 
 
@@ -601,6 +620,196 @@ class JSONDataViewV3(JSONDataView):
         url = settings.RESULTS_URL_V3 + '%s.json' % search_result.filename_stub
         return url
 
+class CompressedDataView(View):
+    """Serve a version 4 results file, sending the precompressed gzip copy to browsers that accept gzip encoding."""
+    RESULTS_FILES = {
+        'count': ('_edge.csv', 'text/csv; charset=utf-8'),
+        'abstracts': ('_abstracts.csv', 'text/csv; charset=utf-8'),
+        'json': ('.json', 'application/json'),
+    }
+    ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b(?!\s*;\s*q=0(\.0*)?\s*(,|$))')
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        """Ensure user logs in before viewing."""
+        # Prevent user viewing data for another user
+        srid = int(kwargs['pk'])
+        if SearchResult.objects.filter(pk=srid).exists():
+            srcheck = SearchResult.objects.get(pk=srid)
+            if not request.user.is_superuser and request.user.id != srcheck.criteria.upload.user.id:
+                raise PermissionDenied
+        else:
+            raise Http404("Not found")
+
+        return super(CompressedDataView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
+        suffix, content_type = self.RESULTS_FILES[kwargs['kind']]
+        if not search_result.filename_stub:
+            raise Http404("Not found")
+        file_path = settings.RESULTS_PATH + search_result.filename_stub + suffix
+
+        # Fall back to the uncompressed file for clients that do not accept gzip and for results from before compressed copies were written
+        content_encoding = None
+        if self.ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')) and os.path.exists(file_path + GZIP_SUFFIX):
+            file_path += GZIP_SUFFIX
+            content_encoding = 'gzip'
+        try:
+            results_file = open(file_path, 'rb')
+        except FileNotFoundError:
+            raise Http404("Not found")
+
+        file_stat = os.fstat(results_file.fileno())
+        etag = '"%x-%x%s"' % (file_stat.st_mtime_ns, file_stat.st_size, '-gzip' if content_encoding else '')
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            results_file.close()
+            response = HttpResponseNotModified()
+        else:
+            # NB: FileResponse sets the Content-Length from the size of the file
+            response = FileResponse(results_file, content_type=content_type)
+            if content_encoding:
+                response['Content-Encoding'] = content_encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+
+class MediatorsJSONView(View):
+    """Return a page of the top scoring mediators and their links from the saved edge matrix of a search result.
+
+    Query parameters are offset, limit (up to MAX_LIMIT) and min_count, the lowest exposure and outcome counts
+    to include, so that charts can load the highest scoring mediators first."""
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 1000
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        """Ensure user logs in before viewing."""
+        # Prevent user viewing data for another user
+        srid = int(kwargs['pk'])
+        if SearchResult.objects.filter(pk=srid).exists():
+            srcheck = SearchResult.objects.get(pk=srid)
+            if not request.user.is_superuser and request.user.id != srcheck.criteria.upload.user.id:
+                raise PermissionDenied
+        else:
+            raise Http404("Not found")
+
+        return super(MediatorsJSONView, self).dispatch(request, *args, **kwargs)
+
+    def _get_int_parameter(self, name, default, minimum, maximum=None):
+        try:
+            value = int(self.request.GET.get(name, default))
+        except ValueError:
+            raise ValueError("%s must be a whole number" % name)
+        if value < minimum:
+            raise ValueError("%s must be at least %d" % (name, minimum))
+        if maximum is not None and value > maximum:
+            raise ValueError("%s must be at most %d" % (name, maximum))
+        return value
+
+    def get(self, request, *args, **kwargs):
+        search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
+        try:
+            offset = self._get_int_parameter('offset', 0, 0)
+            limit = self._get_int_parameter('limit', self.DEFAULT_LIMIT, 1, self.MAX_LIMIT)
+            min_count = self._get_int_parameter('min_count', 1, 1)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if not search_result.has_completed:
+            raise Http404("Search has not completed")
+        try:
+            edge_matrix = load_edge_matrix(settings.RESULTS_PATH, search_result.filename_stub)
+        except FileNotFoundError:
+            # Searches run before edge matrices were saved
+            raise Http404("Not found")
+
+        return JsonResponse(top_mediators(*edge_matrix, offset=offset, limit=limit, min_count=min_count))
+
+
+class EdgeProvenanceJSONView(View):
+    """Return the IDs of the abstracts supporting one edge of a search result, i.e. query parameters mediator and either
+    exposure or outcome, which are the node names used in the results JSON file."""
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        """Ensure user logs in before viewing."""
+        # Prevent user viewing data for another user
+        srid = int(kwargs['pk'])
+        if SearchResult.objects.filter(pk=srid).exists():
+            srcheck = SearchResult.objects.get(pk=srid)
+            if not request.user.is_superuser and request.user.id != srcheck.criteria.upload.user.id:
+                raise PermissionDenied
+        else:
+            raise Http404("Not found")
+
+        return super(EdgeProvenanceJSONView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
+        mediator = request.GET.get('mediator')
+        exposure = request.GET.get('exposure')
+        outcome = request.GET.get('outcome')
+        if not mediator or bool(exposure) == bool(outcome):
+            return JsonResponse({'error': 'A mediator and either an exposure or an outcome are required'}, status=400)
+
+        if not search_result.has_completed:
+            raise Http404("Search has not completed")
+        try:
+            edges, genelist, mediatormesh, exposuremesh, outcomemesh = load_edge_matrix(settings.RESULTS_PATH, search_result.filename_stub)
+        except FileNotFoundError:
+            raise Http404("Not found")
+
+        # NB: As per the results JSON file an edge refers to the first gene or mediator with a given name
+        row_labels = genelist + mediatormesh
+        if mediator not in row_labels or (exposure and exposure not in exposuremesh) or (outcome and outcome not in outcomemesh):
+            raise Http404("Edge not found")
+        row_id = row_labels.index(mediator)
+        column_id = exposuremesh.index(exposure) if exposure else len(exposuremesh) + outcomemesh.index(outcome)
+
+        file_path = settings.RESULTS_PATH + search_result.filename_stub + PROVENANCE_SUFFIX
+        if os.path.exists(file_path):
+            abstract_ids = load_supporting_citation_ids(file_path, row_id, column_id)
+        elif edges[row_id, column_id]:
+            # Searches run before provenance was recorded
+            raise Http404("Not found")
+        else:
+            # No provenance is written when there are no matches
+            abstract_ids = []
+
+        result = {'mediator': mediator, 'abstract_ids': abstract_ids}
+        result['exposure' if exposure else 'outcome'] = exposure or outcome
+        return JsonResponse(result)
+
+
+class SearchProgressJSONView(View):
+    """Return the status of a search and, while it is running, its progress, for polling from the results listing."""
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        """Ensure user logs in before viewing."""
+        # Prevent user viewing data for another user
+        srid = int(kwargs['pk'])
+        if SearchResult.objects.filter(pk=srid).exists():
+            srcheck = SearchResult.objects.get(pk=srid)
+            if not request.user.is_superuser and request.user.id != srcheck.criteria.upload.user.id:
+                raise PermissionDenied
+        else:
+            raise Http404("Not found")
+
+        return super(SearchProgressJSONView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
+        progress = None
+        if search_result.has_started and not search_result.has_completed:
+            progress = get_progress(search_result.id)
+        return JsonResponse({'status': search_result.status, 'has_completed': search_result.has_completed, 'progress': progress,
+                             'queue_name': search_result.queue_name, 'queue_position': get_queue_position(search_result),
+                             'pending_position': get_pending_position(search_result)})
+
+
 class MeshTermsAsJSON(TemplateView):
     """Used with the JSTrees to represent MeshTerms."""
 
@@ -726,6 +935,37 @@ class MeshTermSearchJSON(TemplateView):
 
 
 
+class CancelSearch(RedirectView):
+    """Stop a search that has not completed, for the user that owns it or a superuser."""
+    permanent = False
+    http_method_names = ['post', ]
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        """Ensure user logs in before cancelling."""
+        # Prevent one user cancelling another's search
+        srid = int(kwargs['pk'])
+        if SearchResult.objects.filter(pk=srid).exists():
+            srcheck = SearchResult.objects.get(pk=srid)
+            if not request.user.is_superuser and request.user.id != srcheck.criteria.upload.user.id:
+                raise PermissionDenied
+        else:
+            raise Http404("Not found")
+
+        return super(CancelSearch, self).dispatch(request, *args, **kwargs)
+
+    def get_redirect_url(self, *args, **kwargs):
+        search_result = get_object_or_404(SearchResult, pk=kwargs['pk'])
+        if cancel_search(search_result):
+            messages.add_message(self.request, messages.INFO, "Search cancelled")
+            logger.info('User: %s cancelled search: %s' % (self.request.user.id, search_result.id))
+            # Queue any of the user's searches held while this one was queued or running
+            dispatch_searches()
+        else:
+            messages.add_message(self.request, messages.INFO, "Search has already finished")
+        return reverse('results_listing')
+
+
 class DeleteSearch(DeleteView):
     """ Confirm deletion of search terms and associated records"""
     model = SearchResult
@@ -762,7 +1002,9 @@ class DeleteSearch(DeleteView):
     def form_valid(self, *args, **kwargs):
         messages.add_message(self.request, messages.INFO, "Search results deleted")
         logger.info('User: %s deleted search: %s' % (self.request.user.id, self.get_object().id))
-        return super(DeleteSearch, self).form_valid(*args, **kwargs)
+        response = super(DeleteSearch, self).form_valid(*args, **kwargs)
+        dispatch_searches()
+        return response
 
 
 class UserAccountView(TemplateView):
@@ -142,8 +142,11 @@ redis-cli ping
 
 echo "###   Step up django-rq services"
 # TMMA-382: Review and increase number of workers for matching code
+# Workers 1 and 2 only run small searches, so they are not held up by slow jobs, 3 and 4 run large searches, see
+# browser.queues, then other jobs on the default queue, and build gene mention indexes when nothing else is waiting
 for i in 1 2 3 4
 do
+  if [ $i -le 2 ]; then QUEUES="small"; else QUEUES="large default indexes"; fi
   cat > /etc/systemd/system/rqworker$i.service <<MESSAGE_QUEUE_WORKER
   [Unit]
   Description=TeMMPo Django-RQ Worker $i
@@ -153,7 +156,7 @@ do
   User=apache
   Group=vagrant
   WorkingDirectory=/usr/local/projects/temmpo/lib/dev/src/temmpo
-  ExecStart=/usr/local/projects/temmpo/lib/dev/bin/python /usr/local/projects/temmpo/lib/dev/src/temmpo/manage.py rqworker default --settings=temmpo.settings.dev --name $i
+  ExecStart=/usr/local/projects/temmpo/lib/dev/bin/python /usr/local/projects/temmpo/lib/dev/src/temmpo/manage.py rqworker $QUEUES --settings=temmpo.settings.dev --name $i
 
   [Install]
   WantedBy=multi-user.target
@@ -163,6 +166,33 @@ MESSAGE_QUEUE_WORKER
   systemctl start rqworker$1
 done
 
+# Queue searches held behind searches whose work-horse was killed, see browser.queues.dispatch_searches
+cat > /etc/systemd/system/temmpo-dispatch-searches.service <<DISPATCH_SEARCHES
+[Unit]
+Description=TeMMPo dispatch held searches
+
+[Service]
+Type=oneshot
+User=apache
+Group=vagrant
+WorkingDirectory=/usr/local/projects/temmpo/lib/dev/src/temmpo
+ExecStart=/usr/local/projects/temmpo/lib/dev/bin/python /usr/local/projects/temmpo/lib/dev/src/temmpo/manage.py dispatch_searches --settings=temmpo.settings.dev
+DISPATCH_SEARCHES
+
+cat > /etc/systemd/system/temmpo-dispatch-searches.timer <<DISPATCH_SEARCHES_TIMER
+[Unit]
+Description=Run TeMMPo dispatch held searches every 5 minutes
+
+[Timer]
+OnCalendar=*:0/5
+
+[Install]
+WantedBy=timers.target
+DISPATCH_SEARCHES_TIMER
+
+systemctl enable temmpo-dispatch-searches.timer
+systemctl start temmpo-dispatch-searches.timer
+
 echo "###   Install components for Selenium testing"
 yum -y install Xvfb
 # Install Chrome and chromedriver
@@ -209,6 +209,30 @@ CSRF_COOKIE_HTTPONLY = True
 # Gives 60 days of grace before deletion
 ACCOUNT_CLOSURE_WARNING = 305
 
+# Number of matched citations whose row and column indicator matrices are held in memory before being
+# accumulated into the edge matrix, bounds memory use to roughly batch size x (rows + columns) x 4 bytes
+MATCHING_BATCH_SIZE = 512
+
+# Number of processes used to match citations in parallel, each reading a shard of the uploaded file
+# split at citation boundaries, 1 matches the whole file in the RQ worker process
+MATCHING_WORKERS = 1
+
+# Number of processes used by the compare_match_runs management command to compare search results' edge files,
+# None uses one process per CPU
+COMPARE_MATCH_RUNS_WORKERS = None
+
+# Build an index of the gene symbols and synonyms mentioned in each abstract in the background after each upload
+BUILD_GENE_MENTION_INDEX = True
+
+# Minimum number of seconds between updates of a running search's progress, as shown on the results listing,
+# which is also how often a running search checks whether it has been cancelled or exceeded its budgets
+MATCHING_PROGRESS_INTERVAL = 2
+
+# Searches are stopped when they have run for longer than this many seconds, or their matching processes'
+# peak memory use exceeds this many bytes, None for no limit
+SEARCH_TIME_BUDGET = 12 * 60 * 60
+SEARCH_MEMORY_BUDGET = None
+
 DEFAULT_FROM_EMAIL = 'TeMMPo <it-temmpo-developers@bristol.ac.uk>'
 
 SITE_ID = 1
@@ -225,8 +249,36 @@ RQ_QUEUES = {
         'DB': 0,
         'DEFAULT_TIMEOUT': 360000,
     },
+    # Searches are sent to the small or large queue depending on their size, see browser.queues
+    'small': {
+        'HOST': '127.0.0.1',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 360000,
+    },
+    'large': {
+        'HOST': '127.0.0.1',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 360000,
+    },
+    # Gene mention indexes of uploads are built at low priority, see browser.views.SearchOvidMEDLINE
+    'indexes': {
+        'HOST': '127.0.0.1',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 360000,
+    },
 }
 
+# Searches of uploads larger than this many bytes, once decompressed, or matching more than this many
+# gene names, gene synonyms and MeSH terms, are run on the large queue
+LARGE_SEARCH_UPLOAD_SIZE = 50 * 1024 * 1024
+LARGE_SEARCH_CRITERIA_SIZE = 2000
+
+# Further searches by a user are held until fewer than this many of their searches are queued or running
+MAX_RUNNING_SEARCHES_PER_USER = 2
+
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o775
 FILE_UPLOAD_PERMISSIONS = 0o664
 FILE_UPLOAD_TEMP_DIR = "%s/tmp" % MEDIA_ROOT
@@ -14,7 +14,10 @@ SITE_ID = 1
 
 USING_APACHE = True
 
-RQ_QUEUES['default']['ASYNC'] = False
+for queue in RQ_QUEUES.values():
+    queue['ASYNC'] = False
+# NB: Jobs run synchronously in tests, tests build gene mention indexes explicitly where needed
+BUILD_GENE_MENTION_INDEX = False
 
 #TEST ONLY ref https://docs.hcaptcha.com/#integration-testing-test-keys
 HCAPTCHA_SITEKEY = '10000000-ffff-ffff-ffff-000000000001'
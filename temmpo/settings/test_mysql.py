@@ -12,7 +12,10 @@ if DATABASES:
     if 'sqlite' in DATABASES:
         del DATABASES['sqlite']
 
-RQ_QUEUES['default']['ASYNC'] = False
+for queue in RQ_QUEUES.values():
+    queue['ASYNC'] = False
+# NB: Jobs run synchronously in tests, tests build gene mention indexes explicitly where needed
+BUILD_GENE_MENTION_INDEX = False
 
 LOGGING['handlers']['console']['level'] = 'ERROR'
 
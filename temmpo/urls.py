@@ -20,7 +20,8 @@ from browser.views import (HomeView, CreditsView, HelpView, SearchOvidMEDLINE, R
                            CloseAccount, AccountClosedConfirmation, UsersListingView, DeleteUser,
                            CountDataViewV1, AbstractDataViewV1, JSONDataViewV1,
                            CountDataViewV3, AbstractDataViewV3, JSONDataViewV3,
-                           MeSHTermAutocomplete, PrivacyPolicyView)
+                           CompressedDataView, EdgeProvenanceJSONView, MediatorsJSONView,
+                           SearchProgressJSONView, CancelSearch, MeSHTermAutocomplete, PrivacyPolicyView)
 
 urlpatterns = [
 
@@ -52,10 +53,15 @@ urlpatterns = [
     path('search-criteria/<int:pk>/', CriteriaView.as_view(), name='criteria'),
 
     path('data/delete/<int:pk>/', DeleteSearch.as_view(), name='delete_data'),
+    path('data/progress/<int:pk>/', SearchProgressJSONView.as_view(), name='progress_data'),
+    path('data/cancel/<int:pk>/', CancelSearch.as_view(), name='cancel_search'),
 
     path('data/v4/count/<int:pk>/', CountDataView.as_view(), name='count_data'),
     path('data/v4/abstracts/<int:pk>/', AbstractDataView.as_view(), name='abstracts_data'),
     path('data/v4/json/<int:pk>/', JSONDataView.as_view(), name='json_data'),
+    path('data/v4/mediators/<int:pk>/', MediatorsJSONView.as_view(), name='mediators_data'),
+    path('data/v4/provenance/<int:pk>/', EdgeProvenanceJSONView.as_view(), name='provenance_data'),
+    re_path(r'^data/v4/(?P<kind>(count|abstracts|json))/gzip/(?P<pk>\d+)/$', CompressedDataView.as_view(), name='compressed_data'),
 
     path('data/v3/count/<int:pk>/', CountDataViewV3.as_view(), name='count_data_v3'),
     path('data/v3/abstracts/<int:pk>/', AbstractDataViewV3.as_view(), name='abstracts_data_v3'),
@@ -116,10 +116,10 @@ class UserDeletionTest(BaseTestCase):
         upload_record = Upload.objects.get(pk=upload_id)
 
         self.assertTrue(os.path.exists(upload_record.abstracts_upload.file.name))
-        # Check results files
+        # Check results files, including the saved edge matrix
         base_path = settings.RESULTS_PATH + search_result.filename_stub + '*'
         files_to_delete = glob.glob(base_path)
-        self.assertEqual(len(files_to_delete), 3)
+        self.assertEqual(len(files_to_delete), 8)
 
         # Check account page
         response = self.client.get(reverse('account'))
@@ -233,10 +233,10 @@ class UserDeletionTest(BaseTestCase):
         upload_record = Upload.objects.get(pk=upload_id)
 
         self.assertTrue(os.path.exists(upload_record.abstracts_upload.file.name))
-        # Check results files
+        # Check results files, including the saved edge matrix
         base_path = settings.RESULTS_PATH + search_result.filename_stub + '*'
         files_to_delete = glob.glob(base_path)
-        self.assertEqual(len(files_to_delete), 3)
+        self.assertEqual(len(files_to_delete), 8)
 
         # Check can't access manage users page
         response = self.client.get(reverse('manage_users'))
@@ -576,9 +576,9 @@ class UserCleanUpManagementCommandTest(BaseTestCase):
         shutil.copyfile(settings.RESULTS_PATH + search_result.filename_stub + "_abstracts.csv", previous_results_directory + search_result.filename_stub + "_abstracts.csv")
         shutil.copyfile(settings.RESULTS_PATH + search_result.filename_stub + ".json", previous_results_directory + search_result.filename_stub + ".json")
 
-    def _assert_results_files_created(self, result_base_path):
+    def _assert_results_files_created(self, result_base_path, expected_file_count=3):
         files_to_delete = glob.glob(result_base_path)
-        self.assertEqual(len(files_to_delete), 3)
+        self.assertEqual(len(files_to_delete), expected_file_count)
 
     def _check_results_files_deleted(self, base_path):
         files_to_delete = glob.glob(base_path)
@@ -605,8 +605,8 @@ class UserCleanUpManagementCommandTest(BaseTestCase):
         # Retrieve results object
         search_result = SearchResult.objects.get(id=search_result.id)
 
-        # Check v4 matching results files were all created
-        self._assert_results_files_created(settings.RESULTS_PATH + search_result.filename_stub + '*')
+        # Check v4 matching results files, including the saved edge matrix, provenance and compressed copies, were all created
+        self._assert_results_files_created(settings.RESULTS_PATH + search_result.filename_stub + '*', 8)
 
         # Mock up some v1 results
         search_result.mediator_match_counts = search_result.mediator_match_counts_v4
@@ -647,10 +647,10 @@ class UserCleanUpManagementCommandTest(BaseTestCase):
         # Retrieve results object
         search_result = SearchResult.objects.get(id=search_result.id)
 
-        # Check v4 matching results files are created.
+        # Check v4 matching results files, including the saved edge matrix, are created.
         base_path = settings.RESULTS_PATH + search_result.filename_stub + '*'
         files_to_delete = glob.glob(base_path)
-        self.assertEqual(len(files_to_delete), 3)
+        self.assertEqual(len(files_to_delete), 8)
 
         # Mock up some v1 results files where mediator matches were 0
         search_result.mediator_match_counts = 0
@@ -4,25 +4,43 @@
 # TODO consider removing usage of readlines in favour of looping file instead
 """
 import csv
+import filecmp
+import glob
+import gzip
 import io
+import itertools
 import json
 import logging
+import multiprocessing.pool
 import os
 import shutil
+from unittest import mock
 
 from csvvalidator import *
 import numpy as np
 import pandas as pd
+import django_rq
+from rq.job import Job
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files import File
 from django.core import management
 from django.urls import reverse
+from django.utils import timezone
 from django.test import tag
 
-from browser.matching import Citation, create_edge_matrix, generate_synonyms, read_citations, countedges, printedges, createjson, _get_genes_and_mediators
-from browser.matching import record_differences_between_match_runs, perform_search, ovid_prepare_mesh_term_search_text_function, pubmed_prepare_mesh_term_search_text_function, search_for_mesh_term, searchgene
-from browser.models import SearchCriteria, SearchResult, MeshTerm, Upload, OVID, PUBMED, Gene
+from browser.matching import Citation, MappedFields, create_edge_matrix, generate_synonyms, read_citations, countedges, countedges_from_index, countedges_in_shards, find_citation_boundaries, printedges, createjson, _get_genes_and_mediators
+from browser.matching import record_differences_between_match_runs, perform_search, perform_batch_search, load_edge_matrix, recreate_results_files, top_mediators, countedges_incrementally, get_reusable_search_result, get_search_fingerprint, MATCHING_VERSION, build_gene_mention_index, get_citation_store, get_gene_mention_index, get_match_plan, ovid_prepare_mesh_term_search_text_function, pubmed_prepare_mesh_term_search_text_function, search_for_mesh_term, searchgene
+from browser.matching import _ovid_medline_read_citations, _pubmed_read_citations
+from browser.pipeline import LOAD_CRITERIA, LOAD_SYNONYMS, MATCH, PARSE, STAGES
+from browser.progress import CANCEL_KEY, ProgressReporter, SearchStopped, get_progress, request_cancellation
+from browser.queues import BATCH_SEARCH_JOB_ID, LARGE_QUEUE, LEGACY_QUEUE, SEARCH_JOB_ID, SMALL_QUEUE, dispatch_searches, enqueue_batch_search, get_criteria_size, get_failed_search_ids, get_pending_position, get_queued_search_ids, get_running_counts, get_queue_position, get_search_queue_name, run_batch_search, run_search, schedule_search
+from browser.provenance import EdgeProvenanceBuilder
+from browser.citation_store import CitationStore, GeneMentionIndex, citation_store_paths
+from browser.matchers import GeneMatcher, MatchPlan, expand_gene_synonyms, MeshTermIndex, match_plan_key, mesh_heading_tokens, mesh_term_key
+from browser.utils import delete_user_content
+from browser.models import SearchCriteria, SearchResult, MeshTerm, Upload, OVID, PUBMED, Gene, CANCELLED, OVER_MEMORY_BUDGET, OVER_TIME_BUDGET, STAGE_COMPLETED, STAGE_FAILED
 from tests.base_test_case import BaseTestCase
 
 logger = logging.getLogger(__name__)
@@ -166,6 +184,145 @@ class MatchingTestCase(BaseTestCase):
         return SearchResult.objects.get(id=search_result.id)
 
 
+    def test_edge_matrix_is_saved_with_results(self):
+        """The edge and JSON files should be recreated from the saved edge matrix as originally written."""
+        search_result = self._prepare_search_result()
+        base_path = settings.RESULTS_PATH + search_result.filename_stub
+        self.assertTrue(os.path.exists(base_path + "_edges.npz"))
+        edges, genelist, mediatormesh, exposuremesh, outcomemesh = load_edge_matrix(settings.RESULTS_PATH, search_result.filename_stub)
+        self.assertEqual(edges.shape, (len(genelist) + len(mediatormesh), len(exposuremesh) + len(outcomemesh)))
+        self.assertEqual(mediatormesh, list(search_result.criteria.get_wcrf_input_variables('mediator')))
+        self.assertEqual(exposuremesh, list(search_result.criteria.get_wcrf_input_variables('exposure')))
+
+        original_files = dict()
+        for suffix in ("_edge.csv", ".json", ):
+            with open(base_path + suffix, 'r') as results_file:
+                original_files[suffix] = results_file.read()
+            os.remove(base_path + suffix)
+
+        self.assertEqual(recreate_results_files(settings.RESULTS_PATH, search_result.filename_stub), search_result.mediator_match_counts_v4)
+        for suffix in ("_edge.csv", ".json", ):
+            with open(base_path + suffix, 'r') as results_file:
+                self.assertEqual(results_file.read(), original_files[suffix])
+
+        search_result.delete()
+        self.assertFalse(os.path.exists(base_path + "_edges.npz"))
+
+    def test_edited_search_reuses_previous_edge_matrix(self):
+        """Searches edited from a previous search of the same upload only count their new rows or columns, giving the same results as counting everything."""
+        year = 2018
+        parent_result = self._prepare_search_result()
+        self.assertEqual(parent_result.matching_version, MATCHING_VERSION)
+        parent_criteria = parent_result.criteria
+        mediator_terms = list(parent_criteria.mediator_terms.exclude(term="Genetic Pleiotropy")) + list(MeshTerm.objects.filter(term__in=("Humans", "Metabolomics"), year=year))
+        outcome_terms = list(parent_criteria.outcome_terms.all()) + list(MeshTerm.objects.filter(term__in=("Eryptosis", "Transcriptome"), year=year))
+        for mediators, outcomes in ((mediator_terms, parent_criteria.outcome_terms.all()), (parent_criteria.mediator_terms.all(), outcome_terms)):
+            search_results = list()
+            for parent in (parent_criteria, None):
+                search_criteria = SearchCriteria(upload=parent_criteria.upload, mesh_terms_year_of_release=year, parent=parent)
+                search_criteria.save()
+                search_criteria.exposure_terms.set(parent_criteria.exposure_terms.all())
+                search_criteria.mediator_terms.set(mediators)
+                search_criteria.outcome_terms.set(outcomes)
+                search_result = SearchResult(criteria=search_criteria)
+                search_result.save()
+                search_results.append(search_result)
+            edited_result, full_result = search_results
+            self.assertEqual(get_reusable_search_result(edited_result), parent_result)
+            self.assertIsNone(get_reusable_search_result(full_result))
+
+            criteria = edited_result.criteria
+            match_plan = get_match_plan(criteria.get_wcrf_input_variables('gene'), criteria.get_wcrf_input_variables('exposure'),
+                                        criteria.get_wcrf_input_variables('outcome'), criteria.get_wcrf_input_variables('mediator'), "")
+            upload = parent_criteria.upload
+            citation_store = get_citation_store(upload.abstracts_upload.path, upload.file_format)
+            edges = np.zeros(match_plan.shape, dtype=int)
+            self.assertIsNotNone(countedges_incrementally(parent_result, match_plan, edges, upload.abstracts_upload.path, upload.file_format, citation_store))
+
+            # NB: The full search runs first and forgets its fingerprint, so that the edited search is not completed from its results files
+            perform_search(full_result.id)
+            SearchResult.objects.filter(id=full_result.id).update(fingerprint=None)
+            perform_search(edited_result.id)
+            edited_stub = SearchResult.objects.get(id=edited_result.id).filename_stub
+            full_stub = SearchResult.objects.get(id=full_result.id).filename_stub
+            for suffix in ("_edge.csv", "_abstracts.csv", ".json"):
+                with open(settings.RESULTS_PATH + edited_stub + suffix, 'r') as edited_file, open(settings.RESULTS_PATH + full_stub + suffix, 'r') as full_file:
+                    self.assertEqual(edited_file.read(), full_file.read())
+            with np.load(settings.RESULTS_PATH + edited_stub + "_provenance.npz") as edited_provenance, np.load(settings.RESULTS_PATH + full_stub + "_provenance.npz") as full_provenance:
+                for name in full_provenance.files:
+                    self.assertEqual(edited_provenance[name].tolist(), full_provenance[name].tolist())
+
+    def test_search_stage_timings_are_recorded(self):
+        """Each stage of matching records its resource use."""
+        search_result = self._prepare_search_result()
+        stage_timings = list(search_result.stage_timings.all())
+        self.assertEqual(tuple(stage_timing.stage for stage_timing in stage_timings), STAGES)
+        for stage_timing in stage_timings:
+            self.assertGreaterEqual(stage_timing.wall_time, 0)
+            self.assertGreaterEqual(stage_timing.cpu_time, 0)
+            self.assertGreater(stage_timing.peak_rss, 0)
+        # NB: Searches without genes are counted from the upload's indexes, so no citations are read when matching
+        citation_count = len(get_citation_store(search_result.criteria.upload.abstracts_upload.path, OVID))
+        self.assertEqual([(stage_timing.stage, stage_timing.citation_count) for stage_timing in stage_timings if stage_timing.citation_count is not None],
+                         [(PARSE, citation_count)])
+
+        # Timings are replaced when a search is run again
+        perform_search(search_result.id)
+        self.assertEqual(search_result.stage_timings.count(), len(STAGES))
+
+        # Searches with genes read every citation
+        search_criteria = search_result.criteria
+        search_criteria.genes.add(Gene.objects.get(name="TRPC1"))
+        SearchResult.objects.filter(id=search_result.id).update(fingerprint=None)
+        perform_search(search_result.id)
+        self.assertEqual(search_result.stage_timings.get(stage=MATCH).citation_count, citation_count)
+        self.assertEqual(set(search_result.stage_timings.values_list('outcome', flat=True)), {STAGE_COMPLETED, })
+
+        # Stages that fail or are stopped are recorded up to that point
+        with mock.patch("browser.matching.get_citation_store", side_effect=ValueError("Unreadable upload")):
+            with self.assertRaises(ValueError):
+                perform_search(search_result.id)
+        self.assertEqual(list(search_result.stage_timings.values_list('stage', 'outcome')),
+                         [(LOAD_CRITERIA, STAGE_COMPLETED), (LOAD_SYNONYMS, STAGE_COMPLETED), (PARSE, STAGE_FAILED)])
+        with mock.patch("browser.matching.get_citation_store", side_effect=SearchStopped(OVER_TIME_BUDGET)):
+            perform_search(search_result.id)
+        self.assertEqual(search_result.stage_timings.get(stage=PARSE).outcome, OVER_TIME_BUDGET)
+        self.assertGreaterEqual(search_result.stage_timings.get(stage=PARSE).wall_time, 0)
+
+    def test_identical_search_reuses_results_files(self):
+        """A search identical to a completed search of an upload with the same content is completed with the same results files."""
+        search_result = self._prepare_search_result()
+        self.assertIsNotNone(search_result.fingerprint)
+        identical_result = self._prepare_search_result()
+        self.assertNotEqual(identical_result.criteria.upload_id, search_result.criteria.upload_id)
+        self.assertEqual(identical_result.fingerprint, search_result.fingerprint)
+        self.assertTrue(identical_result.has_completed)
+        self.assertEqual(identical_result.mediator_match_counts_v4, search_result.mediator_match_counts_v4)
+        for suffix in ("_abstracts.csv", "_edge.csv", ".json", ".json.gz", "_edges.npz", "_provenance.npz"):
+            self.assertTrue(filecmp.cmp(settings.RESULTS_PATH + search_result.filename_stub + suffix,
+                                        settings.RESULTS_PATH + identical_result.filename_stub + suffix, shallow=False))
+            # NB: Results files are rewritten in place by recreate_results_files, so must not be shared
+            self.assertFalse(os.path.samefile(settings.RESULTS_PATH + search_result.filename_stub + suffix,
+                                              settings.RESULTS_PATH + identical_result.filename_stub + suffix))
+
+        # Any difference in the search criteria changes the fingerprint
+        identical_result.mesh_filter = "Humans"
+        self.assertNotEqual(get_search_fingerprint(identical_result, identical_result.criteria.upload.content_hash), search_result.fingerprint)
+        identical_result.mesh_filter = None
+        identical_result.criteria.mediator_terms.remove(*identical_result.criteria.mediator_terms.filter(term="Genetic Pleiotropy"))
+        self.assertNotEqual(get_search_fingerprint(identical_result, identical_result.criteria.upload.content_hash), search_result.fingerprint)
+
+        # ... as does any change to the synonyms of the genes searched for
+        identical_result.criteria.genes.add(Gene.objects.get(name="TRPC1"))
+        gene_fingerprint = get_search_fingerprint(identical_result, identical_result.criteria.upload.content_hash)
+        with mock.patch("browser.matching.get_match_plan") as get_match_plan_mock:
+            get_match_plan_mock.return_value.gene_synonyms = {"TRPC1": ("TRPC1", "Example Synonym")}
+            self.assertNotEqual(get_search_fingerprint(identical_result, identical_result.criteria.upload.content_hash), gene_fingerprint)
+
+        # Deleting either search result leaves the other's results files in place
+        search_result.delete()
+        self.assertTrue(os.path.exists(settings.RESULTS_PATH + identical_result.filename_stub + "_edge.csv"))
+
     def test_record_differences_between_match_runs_no_previous_search(self):
         """No version 1 search results"""
         search_result = self._prepare_search_result()
@@ -424,6 +581,39 @@ class MatchingTestCase(BaseTestCase):
             else:
                 self._assert_results_not_changed(search_result)
 
+    def test_compare_match_runs_command(self):
+        """Compare edge files for several search results at once, as per record_differences_between_match_runs."""
+        unchanged_result = self._prepare_search_result()
+        changed_result = self._prepare_search_result()
+        missing_result = self._prepare_search_result()
+        for search_result in (unchanged_result, changed_result, missing_result):
+            search_result.mediator_match_counts = search_result.mediator_match_counts_v3 = search_result.mediator_match_counts_v4
+            search_result.save()
+        self._no_change(settings.RESULTS_PATH_V1, unchanged_result)
+        self._no_change(settings.RESULTS_PATH_V3, unchanged_result)
+        self._no_change(settings.RESULTS_PATH_V1, changed_result)
+        self._change_counts(settings.RESULTS_PATH_V3, changed_result)
+        self._no_change(settings.RESULTS_PATH_V3, missing_result)
+
+        out = io.StringIO()
+        management.call_command('compare_match_runs', '--dry-run', '--workers', '2', stdout=out)
+        self.assertIn("Compared edge files for 3 search results", out.getvalue())
+        self.assertIn("Changed: 1 [%d]" % changed_result.id, out.getvalue())
+        self.assertIn("Errors: 1", out.getvalue())
+        self.assertFalse(SearchResult.objects.get(id=changed_result.id).has_edge_file_changed)
+
+        # Edge files are compared in parallel by default
+        out = io.StringIO()
+        with mock.patch("browser.matching.os.cpu_count", return_value=2), \
+                mock.patch.object(multiprocessing.pool.Pool, "map", autospec=True, side_effect=multiprocessing.pool.Pool.map) as mock_map:
+            management.call_command('compare_match_runs', unchanged_result.id, changed_result.id, stdout=out)
+        mock_map.assert_called_once()
+        self.assertIn("Compared edge files for 2 search results", out.getvalue())
+        self.assertIn("Unchanged: 1", out.getvalue())
+        self.assertIn("Errors: 0", out.getvalue())
+        self.assertFalse(SearchResult.objects.get(id=unchanged_result.id).has_edge_file_changed)
+        self.assertTrue(SearchResult.objects.get(id=changed_result.id).has_edge_file_changed)
+
     def _get_egde_csv_data_validation_issues(self, data):
         field_names = ('Mediators',
                        'Exposure counts',
@@ -445,8 +635,7 @@ class MatchingTestCase(BaseTestCase):
         self._login_user()
         search_result = self._prepare_search_result()
         path = reverse('count_data', kwargs={'pk': search_result.id })
-        file_name_stub = SearchResult.objects.get(id=search_result.id).filename_stub
-        expected_url = "%s%s_edge.csv" % (settings.RESULTS_URL, file_name_stub)
+        expected_url = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': 'count'})
         response = self.client.get(path, follow=True)
         content = response.getvalue()
         self.assertRedirects(response, expected_url, status_code=301, target_status_code=200, msg_prefix='', fetch_redirect_response=True)
@@ -502,8 +691,7 @@ class MatchingTestCase(BaseTestCase):
         self._login_user()
         search_result = self._prepare_search_result()
         path = reverse('json_data', kwargs={'pk': search_result.id })
-        file_name_stub = SearchResult.objects.get(id=search_result.id).filename_stub
-        expected_url = "%s%s.json" % (settings.RESULTS_URL, file_name_stub)
+        expected_url = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': 'json'})
         response = self.client.get(path, follow=True)
         content = response.getvalue()
         self.assertRedirects(response, expected_url, status_code=301, target_status_code=200, msg_prefix='', fetch_redirect_response=True)
@@ -529,6 +717,437 @@ class MatchingTestCase(BaseTestCase):
         # Validate contents is valid JSON
         result_json_data = json.loads(content)
 
+    def test_serving_compressed_results_files(self):
+        self._login_user()
+        search_result = self._prepare_search_result()
+        base_path = settings.RESULTS_PATH + search_result.filename_stub
+        for kind, suffix in (("count", "_edge.csv"), ("abstracts", "_abstracts.csv"), ("json", ".json"), ):
+            with open(base_path + suffix, 'rb') as results_file:
+                expected_content = results_file.read()
+            path = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': kind})
+            response = self.client.get(reverse('%s_data' % kind, kwargs={'pk': search_result.id}), secure=True)
+            self.assertRedirects(response, path, status_code=301, fetch_redirect_response=False)
+
+            response = self.client.get(path, secure=True, HTTP_ACCEPT_ENCODING="gzip, deflate")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(int(response["Content-Length"]), os.path.getsize(base_path + suffix + ".gz"))
+            self.assertIn("Accept-Encoding", response["Vary"])
+            self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), expected_content)
+            etag = response["ETag"]
+
+            response = self.client.get(path, secure=True, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            response = self.client.get(path, secure=True, HTTP_ACCEPT_ENCODING="gzip;q=0, identity")
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(b"".join(response.streaming_content), expected_content)
+
+        self._logout_user()
+        self._login_second_user()
+        self.assertEqual(self.client.get(path, secure=True).status_code, 403)
+
+    def test_serving_search_progress_json(self):
+        """Progress published while a search runs is served with its percentage complete, and removed once it completes."""
+        self._login_user()
+        search_result = self._prepare_search_result()
+        self.assertIsNone(get_progress(search_result.id))
+        path = reverse('progress_data', kwargs={'pk': search_result.id})
+        response = self.client.get(path, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"status": "Completed", "has_completed": True, "progress": None,
+                                                           "queue_name": None, "queue_position": None, "pending_position": None})
+
+        search_result.has_completed = False
+        search_result.save()
+        progress = ProgressReporter(search_result.id)
+        progress.start_stage(MATCH, total_bytes=1000, total_citations=200)
+        with self.settings(MATCHING_PROGRESS_INTERVAL=60):
+            progress.update(50, 10, offset=250)
+            self.assertEqual(get_progress(search_result.id)["citations"], 0)
+            progress.update(50, 10, offset=250, force=True)
+        # Worker processes publish the progress of their shards as increments
+        shard_progress = ProgressReporter(search_result.id, first_byte=500)
+        shard_progress.update(30, 5, offset=600, force=True)
+        result_json_data = json.loads(self.client.get(path, secure=True).content)
+        self.assertTrue(result_json_data["status"].startswith("Processing"))
+        self.assertEqual(dict((name, result_json_data["progress"][name]) for name in ("stage", "bytes", "citations", "matches", "percentage")),
+                         {"stage": MATCH, "bytes": 350, "citations": 80, "matches": 15, "percentage": 40.0})
+        self.assertGreaterEqual(result_json_data["progress"]["eta_seconds"], 0)
+        progress.finish()
+        self.assertIsNone(get_progress(search_result.id))
+
+        self._logout_user()
+        self._login_second_user()
+        self.assertEqual(self.client.get(path, secure=True).status_code, 403)
+
+    def test_cancelling_searches(self):
+        """Searches can be cancelled before or while they run, and are stopped when they exceed their time or memory budget."""
+        self._login_user()
+        search_result = self._prepare_search_result()
+        search_criteria = search_result.criteria
+        # Prevent the completed search's results files being reused
+        SearchResult.objects.filter(id=search_result.id).update(fingerprint=None)
+
+        # Cancelled before the search starts
+        search_result = SearchResult.objects.create(criteria=search_criteria)
+        self.assertTrue(search_result.is_cancellable)
+        response = self.client.post(reverse('cancel_search', kwargs={'pk': search_result.id}), secure=True)
+        self.assertRedirects(response, reverse('results_listing'), fetch_redirect_response=False)
+        search_result = SearchResult.objects.get(id=search_result.id)
+        self.assertEqual(search_result.stopped_reason, CANCELLED)
+        self.assertEqual(search_result.status, "Cancelled")
+        self.assertTrue(search_result.is_deletable)
+        self.assertFalse(search_result.has_failed)
+        perform_search(search_result.id)
+        search_result = SearchResult.objects.get(id=search_result.id)
+        self.assertFalse(search_result.has_started)
+        self.assertFalse(search_result.has_completed)
+
+        # Cancelled once the search is running
+        search_result = SearchResult.objects.create(criteria=search_criteria)
+        request_cancellation(search_result.id)
+        perform_search(search_result.id)
+        search_result = SearchResult.objects.get(id=search_result.id)
+        self.assertEqual(search_result.stopped_reason, CANCELLED)
+        self.assertFalse(search_result.has_completed)
+        self.assertIsNotNone(search_result.ended_processing)
+        self.assertFalse(django_rq.get_connection().exists(CANCEL_KEY % search_result.id))
+
+        for budgets, stopped_reason in (({"SEARCH_TIME_BUDGET": 1e-9}, OVER_TIME_BUDGET), ({"SEARCH_MEMORY_BUDGET": 1}, OVER_MEMORY_BUDGET)):
+            search_result = SearchResult.objects.create(criteria=search_criteria)
+            with self.settings(**budgets):
+                perform_search(search_result.id)
+            search_result = SearchResult.objects.get(id=search_result.id)
+            self.assertEqual(search_result.stopped_reason, stopped_reason)
+            self.assertFalse(search_result.has_completed)
+
+        # Only the owner or a superuser can cancel a search
+        search_result = SearchResult.objects.create(criteria=search_criteria)
+        self._logout_user()
+        self._login_second_user()
+        self.assertEqual(self.client.post(reverse('cancel_search', kwargs={'pk': search_result.id}), secure=True).status_code, 403)
+        self.assertTrue(SearchResult.objects.get(id=search_result.id).is_cancellable)
+
+        # NB: Leave one search result of the criteria to be deleted with the user's content
+        SearchResult.objects.filter(criteria=search_criteria).exclude(stopped_reason__isnull=True).delete()
+        SearchResult.objects.filter(criteria=search_criteria, has_completed=False).delete()
+
+    def test_searches_are_queued_by_size(self):
+        """Searches of large uploads or with many search terms are run on the large queue, and their position in the queue is served."""
+        self._login_user()
+        search_result = self._prepare_search_result()
+        criteria_size = get_criteria_size(search_result.criteria)
+        self.assertEqual(criteria_size, sum(len(search_result.criteria.get_wcrf_input_variables(codename)) for codename in ('exposure', 'mediator', 'outcome')))
+        self.assertEqual(get_search_queue_name(search_result), SMALL_QUEUE)
+        with self.settings(LARGE_SEARCH_UPLOAD_SIZE=100):
+            self.assertEqual(get_search_queue_name(search_result), LARGE_QUEUE)
+        with self.settings(LARGE_SEARCH_CRITERIA_SIZE=criteria_size - 1):
+            self.assertEqual(get_search_queue_name(search_result), LARGE_QUEUE)
+
+        # Searches are queued once the transaction commits, and run as they are queued in tests
+        search_result = SearchResult.objects.create(criteria=search_result.criteria)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_search(search_result)
+        search_result = SearchResult.objects.get(id=search_result.id)
+        self.assertEqual(search_result.queue_name, SMALL_QUEUE)
+        self.assertTrue(search_result.has_completed)
+        self.assertIsNone(get_queue_position(search_result))
+
+        search_result.has_completed = False
+        search_result.started_processing = None
+        search_result.save()
+        job_id = SEARCH_JOB_ID % search_result.id
+        queue = django_rq.get_queue(SMALL_QUEUE)
+        queue.push_job_id(job_id, at_front=True)
+        try:
+            self.assertEqual(get_queue_position(search_result), 1)
+            response = self.client.get(reverse('progress_data', kwargs={'pk': search_result.id}), secure=True)
+            self.assertEqual(json.loads(response.content)["queue_position"], 1)
+            response = self.client.get(reverse('results_listing'), secure=True)
+            self.assertContains(response, "Queued, position 1 for small searches")
+        finally:
+            queue.remove(job_id)
+
+        # NB: Leave one search result of the criteria to be deleted with the user's content
+        SearchResult.objects.filter(id=search_result.id).delete()
+
+    def _queue_search_job(self, search_result):
+        """Add the job dispatch_searches sends to RQ for a search to its queue, as it is only sent once the test's transaction is committed."""
+        queue = django_rq.get_queue(search_result.queue_name)
+        job = Job.create(run_search, args=(search_result.id, ), id=SEARCH_JOB_ID % search_result.id, connection=queue.connection, origin=queue.name)
+        job.save()
+        queue.push_job_id(job.id)
+        self.addCleanup(self._delete_job, job)
+        return job
+
+    def _delete_job(self, job):
+        """Delete a job added by a test unless the code under test has already deleted it."""
+        if Job.exists(job.id, connection=job.connection):
+            job.delete()
+
+    def test_searches_are_scheduled_fairly_between_users(self):
+        """Users' held searches are queued in turn, while each user has fewer than MAX_RUNNING_SEARCHES_PER_USER searches queued or running."""
+        self._login_user()
+        search_criteria = self._prepare_search_result().criteria
+        second_search_criteria = self._prepare_base_search_criteria(2018)
+        second_search_criteria.upload.user = self.second_user
+        second_search_criteria.upload.save()
+        first_search, second_search = [SearchResult.objects.create(criteria=search_criteria) for i in range(2)]
+        second_user_search = SearchResult.objects.create(criteria=second_search_criteria)
+        self.assertEqual([get_pending_position(search_result) for search_result in (first_search, second_search, second_user_search)], [1, 3, 2])
+
+        # NB: Queued jobs are not run, as the test's transaction is not committed
+        queue = django_rq.get_queue(SMALL_QUEUE)
+        with self.settings(MAX_RUNNING_SEARCHES_PER_USER=1):
+            dispatch_searches()
+            first_search, second_search, second_user_search = [SearchResult.objects.get(id=search_result.id) for search_result in (first_search, second_search, second_user_search)]
+            self.assertEqual(first_search.queue_name, SMALL_QUEUE)
+            self.assertEqual(second_user_search.queue_name, SMALL_QUEUE)
+            jobs = [self._queue_search_job(search_result) for search_result in (first_search, second_user_search)]
+            self.assertEqual(get_queued_search_ids(), {first_search.id, second_user_search.id})
+            dispatch_searches()
+            self.assertIsNone(SearchResult.objects.get(id=second_search.id).queue_name)
+            self.assertIsNone(second_search.queue_name)
+            self.assertEqual(get_pending_position(second_search), 1)
+            response = self.client.get(reverse('results_listing'), secure=True)
+            self.assertContains(response, "Waiting to be queued, position 1")
+
+            # Held searches are queued as their user's searches finish
+            first_search.has_completed = True
+            first_search.save()
+            dispatch_searches()
+            second_search = SearchResult.objects.get(id=second_search.id)
+            self.assertEqual(second_search.queue_name, SMALL_QUEUE)
+            self.assertIsNone(get_pending_position(second_search))
+            jobs.append(self._queue_search_job(second_search))
+
+            # ... when their jobs fail, e.g. when the work-horse is killed, as found by the periodic dispatch_searches command
+            third_search = SearchResult.objects.create(criteria=search_criteria)
+            dispatch_searches()
+            self.assertIsNone(SearchResult.objects.get(id=third_search.id).queue_name)
+            queue.remove(jobs[-1])
+            queue.failed_job_registry.add(jobs[-1], ttl=60, exc_string="Work-horse terminated unexpectedly")
+            try:
+                self.assertEqual(get_failed_search_ids(), {second_search.id, })
+                management.call_command('dispatch_searches')
+            finally:
+                queue.failed_job_registry.remove(jobs[-1])
+            third_search = SearchResult.objects.get(id=third_search.id)
+            self.assertEqual(third_search.queue_name, SMALL_QUEUE)
+            SearchResult.objects.filter(id=second_search.id).update(has_completed=True)
+
+            # ... and when their jobs no longer exist, e.g. the third search's job when Redis has lost it, or they were queued before
+            # searches were scheduled
+            legacy_search = SearchResult.objects.create(criteria=search_criteria, queue_name=LEGACY_QUEUE)
+            held_search = SearchResult.objects.create(criteria=search_criteria)
+            self.assertNotIn(third_search.id, get_queued_search_ids())
+            self.assertEqual(get_running_counts().get(self.user.id, 0), 0)
+            dispatch_searches()
+            self.assertEqual(SearchResult.objects.get(id=held_search.id).queue_name, SMALL_QUEUE)
+            SearchResult.objects.filter(id__in=(legacy_search.id, held_search.id)).update(has_completed=True)
+            jobs.append(self._queue_search_job(third_search))
+
+            # ... and when they are cancelled or deleted
+            # NB: Deleting a search deletes its search criteria
+            fourth_search = SearchResult.objects.create(criteria=self._prepare_base_search_criteria(2018))
+            fifth_search = SearchResult.objects.create(criteria=search_criteria)
+            self.client.post(reverse('cancel_search', kwargs={'pk': third_search.id}), secure=True)
+            self.assertEqual(SearchResult.objects.get(id=fourth_search.id).queue_name, SMALL_QUEUE)
+            self.assertIsNone(SearchResult.objects.get(id=fifth_search.id).queue_name)
+            self.client.post(reverse('delete_data', kwargs={'pk': fourth_search.id}), secure=True)
+            self.assertFalse(SearchResult.objects.filter(id=fourth_search.id).exists())
+            self.assertEqual(SearchResult.objects.get(id=fifth_search.id).queue_name, SMALL_QUEUE)
+            django_rq.get_connection().delete(CANCEL_KEY % third_search.id)
+
+        # NB: Leave one search result of the criteria to be deleted with the user's content
+        SearchResult.objects.filter(id__in=(first_search.id, second_search.id, third_search.id, fifth_search.id, legacy_search.id, held_search.id)).delete()
+        delete_user_content(self.second_user.id)
+
+    def test_batch_search_matches_individual_searches(self):
+        """Searches of the same upload run as a batch give the same results files as when run individually."""
+        first_result = self._prepare_search_result()
+        search_criteria = first_result.criteria
+        SearchResult.objects.filter(id=first_result.id).update(fingerprint=None)
+        gene_search_criteria = SearchCriteria.objects.create(upload=search_criteria.upload, mesh_terms_year_of_release=2018)
+        gene_search_criteria.genes.add(Gene.objects.get(name="TRPC1"))
+        gene_search_criteria.exposure_terms.set(search_criteria.exposure_terms.all())
+        gene_search_criteria.mediator_terms.set(search_criteria.mediator_terms.all())
+        gene_search_criteria.outcome_terms.set(search_criteria.outcome_terms.all())
+        searches = ((search_criteria, None), (search_criteria, "Humans"), (gene_search_criteria, None), (gene_search_criteria, "Humans"))
+
+        for workers in (1, 2):
+            with self.settings(MATCHING_WORKERS=workers):
+                individual_results = [SearchResult.objects.create(criteria=criteria, mesh_filter=mesh_filter) for criteria, mesh_filter in searches]
+                for search_result in individual_results:
+                    perform_search(search_result.id)
+                SearchResult.objects.filter(id__in=[search_result.id for search_result in individual_results]).update(fingerprint=None)
+                batch_results = [SearchResult.objects.create(criteria=criteria, mesh_filter=mesh_filter) for criteria, mesh_filter in searches]
+                perform_batch_search([search_result.id for search_result in batch_results])
+
+                for individual_result, batch_result in zip(individual_results, batch_results):
+                    individual_result, batch_result = SearchResult.objects.get(id=individual_result.id), SearchResult.objects.get(id=batch_result.id)
+                    self.assertTrue(batch_result.has_completed)
+                    self.assertEqual(batch_result.mediator_match_counts_v4, individual_result.mediator_match_counts_v4)
+                    self.assertEqual(list(batch_result.stage_timings.values_list('stage', flat=True)), list(STAGES))
+                    for suffix in ("_abstracts.csv", "_edge.csv", ".json", "_provenance.npz"):
+                        individual_file_path = settings.RESULTS_PATH + individual_result.filename_stub + suffix
+                        self.assertEqual(os.path.exists(individual_file_path), os.path.exists(settings.RESULTS_PATH + batch_result.filename_stub + suffix))
+                        if os.path.exists(individual_file_path):
+                            self.assertTrue(filecmp.cmp(individual_file_path, settings.RESULTS_PATH + batch_result.filename_stub + suffix, shallow=False))
+                SearchResult.objects.filter(id__in=[search_result.id for search_result in individual_results + batch_results]).update(fingerprint=None)
+
+        # Cancelled searches in a batch are stopped while the others complete
+        batch_results = [SearchResult.objects.create(criteria=criteria, mesh_filter=mesh_filter) for criteria, mesh_filter in searches[2:]]
+        request_cancellation(batch_results[0].id)
+        perform_batch_search([search_result.id for search_result in batch_results])
+        self.assertEqual(SearchResult.objects.get(id=batch_results[0].id).stopped_reason, CANCELLED)
+        self.assertTrue(SearchResult.objects.get(id=batch_results[1].id).has_completed)
+
+        other_upload_result = SearchResult.objects.create(criteria=self._prepare_base_search_criteria(2018))
+        with self.assertRaises(ValueError):
+            perform_batch_search([batch_results[0].id, other_upload_result.id])
+        out = io.StringIO()
+        with self.assertRaises(management.CommandError):
+            management.call_command('batch_search', batch_results[0].id, other_upload_result.id, stdout=out)
+
+        # Searches that have been held or queued but not started are run as a batch, removing their queued jobs
+        queued_result = SearchResult.objects.create(criteria=search_criteria, queue_name=SMALL_QUEUE)
+        self._queue_search_job(queued_result)
+        held_result = SearchResult.objects.create(criteria=search_criteria)
+        management.call_command('batch_search', queued_result.id, held_result.id, stdout=out)
+        self.assertIn("Queued 2 searches", out.getvalue())
+        self.assertIsNone(django_rq.get_queue(SMALL_QUEUE).fetch_job(SEARCH_JOB_ID % queued_result.id))
+        self.assertEqual(SearchResult.objects.get(id=held_result.id).queue_name, SMALL_QUEUE)
+
+        # ... but not searches that have started or stopped
+        started_result = SearchResult.objects.create(criteria=search_criteria, queue_name=SMALL_QUEUE, started_processing=timezone.now())
+        held_result = SearchResult.objects.create(criteria=search_criteria)
+        with self.assertRaises(management.CommandError):
+            management.call_command('batch_search', started_result.id, held_result.id, stdout=out)
+        with self.assertRaises(management.CommandError):
+            management.call_command('batch_search', batch_results[0].id, stdout=out)
+        with self.assertRaises(ValueError):
+            enqueue_batch_search([started_result, held_result])
+        self.assertIsNone(SearchResult.objects.get(id=held_result.id).queue_name)
+
+        # ... or are already part of a batch, when any searches whose jobs were removed are held again
+        queued_result = SearchResult.objects.create(criteria=search_criteria, queue_name=SMALL_QUEUE)
+        self._queue_search_job(queued_result)
+        batched_result = SearchResult.objects.create(criteria=search_criteria, queue_name=SMALL_QUEUE)
+        queue = django_rq.get_queue(SMALL_QUEUE)
+        batch_job = Job.create(run_batch_search, args=([batched_result.id], ), id=BATCH_SEARCH_JOB_ID % batched_result.id, connection=queue.connection, origin=queue.name)
+        batch_job.save()
+        queue.push_job_id(batch_job.id)
+        self.addCleanup(self._delete_job, batch_job)
+        with self.assertRaises(management.CommandError):
+            management.call_command('batch_search', queued_result.id, batched_result.id, held_result.id, stdout=out)
+        self.assertIsNone(SearchResult.objects.get(id=queued_result.id).queue_name)
+        self.assertIsNone(SearchResult.objects.get(id=held_result.id).queue_name)
+        management.call_command('batch_search', '--now', queued_result.id, held_result.id, stdout=out)
+        self.assertIn("Ran 2 searches", out.getvalue())
+        self.assertTrue(SearchResult.objects.get(id=queued_result.id).has_completed)
+        self.assertTrue(SearchResult.objects.get(id=held_result.id).has_completed)
+
+        # NB: Leave one search result of the criteria to be deleted with the user's content
+        SearchResult.objects.filter(criteria__in=(search_criteria, gene_search_criteria)).exclude(id=first_result.id).delete()
+
+    def test_serving_top_mediators_json(self):
+        self._login_user()
+        search_result = self._prepare_search_result()
+        path = reverse('mediators_data', kwargs={'pk': search_result.id})
+        # The bubble chart loads the top scoring mediators
+        self.assertContains(self.client.get(reverse('results_bubble', kwargs={'pk': search_result.id}), secure=True), path)
+        response = self.client.get(path, secure=True)
+        self.assertEqual(response.status_code, 200)
+        result_json_data = json.loads(response.content)
+        self.assertEqual(result_json_data["total"], 3)
+        self.assertEqual([mediator["name"] for mediator in result_json_data["mediators"]], ["Genetic Markers", "Genetic Pleiotropy", "Serogroup"])
+        self.assertEqual(result_json_data["mediators"][0], {"name": "Genetic Markers", "exposure_count": 1, "outcome_count": 1, "score": 2.0})
+        with open(settings.RESULTS_PATH + search_result.filename_stub + ".json", "r") as json_file:
+            self.assertEqual(result_json_data["links"], json.load(json_file)["links"])
+
+        response = self.client.get(path, secure=True, data={"offset": 1, "limit": 1})
+        result_json_data = json.loads(response.content)
+        self.assertEqual(result_json_data["total"], 3)
+        self.assertEqual([mediator["name"] for mediator in result_json_data["mediators"]], ["Genetic Pleiotropy"])
+        self.assertEqual(result_json_data["nodes"][0]["name"], "Genetic Pleiotropy")
+        self.assertEqual(len(result_json_data["links"]), 2)
+
+        response = self.client.get(path, secure=True, data={"min_count": 2})
+        self.assertEqual(json.loads(response.content)["total"], 0)
+
+        for bad_parameters in ({"limit": 0}, {"limit": 1001}, {"offset": "first"}, {"min_count": -1}):
+            self.assertEqual(self.client.get(path, bad_parameters, secure=True).status_code, 400)
+
+        os.remove(settings.RESULTS_PATH + search_result.filename_stub + "_edges.npz")
+        self.assertEqual(self.client.get(path, secure=True).status_code, 404)
+
+        self._logout_user()
+        self._login_second_user()
+        self.assertEqual(self.client.get(path, secure=True).status_code, 403)
+
+    def test_serving_edge_provenance_json(self):
+        self._login_user()
+        search_result = self._prepare_search_result()
+        path = reverse('provenance_data', kwargs={'pk': search_result.id})
+        with open(settings.RESULTS_PATH + search_result.filename_stub + ".json", "r") as json_file:
+            results_json_data = json.load(json_file)
+        with open(settings.RESULTS_PATH + search_result.filename_stub + "_abstracts.csv", "r") as abstracts_file:
+            abstract_ids = set(line.strip() for line in abstracts_file.readlines()[1:])
+        names = [node["name"] for node in results_json_data["nodes"]]
+        exposure_link, outcome_link = results_json_data["links"][0], results_json_data["links"][1]
+
+        response = self.client.get(path, {"mediator": names[exposure_link["target"]], "exposure": names[exposure_link["source"]]}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        exposure_abstract_ids = json.loads(response.content)["abstract_ids"]
+        self.assertEqual(len(exposure_abstract_ids), exposure_link["value"])
+        self.assertTrue(set(exposure_abstract_ids) <= abstract_ids)
+
+        response = self.client.get(path, {"mediator": names[outcome_link["source"]], "outcome": names[outcome_link["target"]]}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)["abstract_ids"]), outcome_link["value"])
+
+        self.assertEqual(self.client.get(path, {"mediator": names[outcome_link["source"]]}, secure=True).status_code, 400)
+        self.assertEqual(self.client.get(path, {"mediator": "Not a mediator", "outcome": names[outcome_link["target"]]}, secure=True).status_code, 404)
+
+        self._logout_user()
+        self._login_second_user()
+        self.assertEqual(self.client.get(path, {"mediator": names[outcome_link["source"]], "outcome": names[outcome_link["target"]]}, secure=True).status_code, 403)
+
+    def test_edge_provenance_builder(self):
+        """Each cell records the ordinals of the citations with both its row and its column."""
+        builder = EdgeProvenanceBuilder((3, 2))
+        builder.add_batch(np.array([[1, 0, 1], [0, 0, 0], [1, 1, 0]]), np.array([[1, 1], [1, 0], [0, 1]]), 0, np.array([10, 11, 12]))
+        builder.add_batch(np.array([[0, 0, 1]]), np.array([[1, 0]]), 3, np.array([15]))
+        provenance = builder.build()
+        cells, indptr, ordinals = provenance["cells"], provenance["indptr"], provenance["ordinals"]
+        self.assertEqual(cells.tolist(), [0, 1, 3, 4, 5])
+        self.assertEqual([ordinals[start:end].tolist() for start, end in zip(indptr[:-1], indptr[1:])], [[0], [0, 2], [2], [0, 3], [0]])
+        row_indptr, row_ordinals = provenance["row_indptr"], provenance["row_ordinals"]
+        self.assertEqual([row_ordinals[start:end].tolist() for start, end in zip(row_indptr[:-1], row_indptr[1:])], [[0, 2], [2], [0, 3]])
+        self.assertEqual(provenance["citation_numbers"].tolist(), [10, 11, 12, 15])
+
+    def test_top_mediators(self):
+        """Mediators are ranked by score and filtered by their exposure and outcome counts."""
+        edges = np.array([[1, 0, 1],
+                          [3, 1, 4],
+                          [0, 0, 5],
+                          [2, 0, 2],
+                          [4, 0, 1]])
+        document = top_mediators(edges, ["GENE1"], ["Mediator 1", "Mediator 2", "Mediator 3", "Mediator 4"], ["Exposure 1", "Exposure 2"], ["Outcome 1"], limit=2)
+        self.assertEqual(document["total"], 4)
+        self.assertEqual([(mediator["name"], mediator["score"]) for mediator in document["mediators"]], [("Mediator 1", 8.0), ("Mediator 3", 4.0)])
+        self.assertEqual([node["name"] for node in document["nodes"]], ["Mediator 1", "Mediator 3", "Exposure 1", "Exposure 2", "Outcome 1"])
+        self.assertEqual(document["links"], [{"source": 2, "target": 0, "value": 3}, {"source": 3, "target": 0, "value": 1}, {"source": 0, "target": 4, "value": 4},
+                                             {"source": 2, "target": 1, "value": 2}, {"source": 1, "target": 4, "value": 2}])
+
+        document = top_mediators(edges, ["GENE1"], ["Mediator 1", "Mediator 2", "Mediator 3", "Mediator 4"], ["Exposure 1", "Exposure 2"], ["Outcome 1"], offset=2)
+        self.assertEqual([mediator["name"] for mediator in document["mediators"]], ["GENE1", "Mediator 4"])
+        self.assertEqual(top_mediators(edges, ["GENE1"], ["Mediator 1", "Mediator 2", "Mediator 3", "Mediator 4"], ["Exposure 1", "Exposure 2"], ["Outcome 1"], min_count=2)["total"], 2)
+
     def _get_abstract_csv_data_validation_issues(self, data):
         field_names = ('Abstract IDs',)
         validator = CSVValidator(field_names)
@@ -540,8 +1159,7 @@ class MatchingTestCase(BaseTestCase):
         self._login_user()
         search_result = self._prepare_search_result()
         path = reverse('abstracts_data', kwargs={'pk': search_result.id })
-        file_name_stub = SearchResult.objects.get(id=search_result.id).filename_stub
-        expected_url = "%s%s_abstracts.csv" % (settings.RESULTS_URL, file_name_stub)
+        expected_url = reverse('compressed_data', kwargs={'pk': search_result.id, 'kind': 'abstracts'})
         response = self.client.get(path, follow=True)
         content = response.getvalue()
         self.assertRedirects(response, expected_url, status_code=301, target_status_code=200, msg_prefix='', fetch_redirect_response=True)
@@ -945,6 +1563,23 @@ class MatchingTestCase(BaseTestCase):
         mesh_term = pubmed_prepare_mesh_term_search_text_function("Physiopathology")
         self.assertTrue(search_for_mesh_term(search_text, mesh_term) is not None)
 
+    def test_mesh_heading_tokens_agree_with_mesh_term_search(self):
+        ovid_search_text = b";Cells;;H(+)-K(+)-Exchanging ATPase;;Colorectal Neoplasms/ge [Genetics];;Fictional MeSH Term AA;;*Adenosine/ad [Administration & Dosage];;*Transcriptome;"
+        pubmed_search_text = b";Adolescent;;Fetal Growth Retardation/complications/*physiopathology;;*DNA Copy Number Variations;;Intellectual Disability/*genetics;"
+        mesh_terms = ("Fictional MeSH Term A", "Fictional MeSH Term AA", "Transcriptome", "Genetics", "Colorectal Neoplasms",
+                      "H(+)-K(+)-Exchanging ATPase", "Adenosine", "Administration & Dosage", "Dosage", "Cells",
+                      "Adolescent", "Complications", "Physiopathology", "DNA Copy Number Variations", "Intellectual Disability", "Disability")
+
+        for search_text, prepare_mesh_term in ((ovid_search_text, ovid_prepare_mesh_term_search_text_function),
+                                               (pubmed_search_text, pubmed_prepare_mesh_term_search_text_function), ):
+            tokens = mesh_heading_tokens(search_text)
+            for mesh_term in mesh_terms:
+                expected = search_for_mesh_term(search_text, prepare_mesh_term(mesh_term)) is not None
+                self.assertEqual(mesh_term_key(mesh_term) in tokens, expected, mesh_term)
+
+        mesh_term_index = MeshTermIndex(mesh_terms)
+        self.assertEqual(mesh_term_index.matches(mesh_heading_tokens(pubmed_search_text)), [3, 10, 11, 12, 13, 14])
+
     def test_search_gene(self):
         search_text = b"""A number of preclinical studies have shown that the activation of the vitamin D
       receptor (VDR) reduces prostate cancer (PCa) cell and tumor growth. The majority 
@@ -1044,6 +1679,22 @@ class MatchingTestCase(BaseTestCase):
                 self.assertEqual(expected_results[i][j], df.iat[i, j])
         self.assertEqual(csv_data.line_num, 6)
 
+    def test_printedges_only_scores_rows_with_exposures_and_outcomes(self):
+        """Rows need both exposure and outcome counts to be scored, and edge matrix rows without a gene or mediator are ignored."""
+        edges = np.array([
+            [2, 0, 1, 9],
+            [0, 3, 0, 9],
+            [0, 0, 1, 9],
+            [1, 1, 0, 9]])
+        resultfilename = "test_printedges_only_scores_rows_with_exposures_and_outcomes"
+        edge_score = printedges(edges, ["Gene A", ], ["Mediator B", "Mediator C", ], ["Exposure A", "Exposure B", ], ["Outcome A", ],
+                                settings.RESULTS_PATH, resultfilename)
+
+        self.assertEqual(edge_score, 1)
+        with open(settings.RESULTS_PATH + resultfilename + "_edge.csv", 'r', newline='') as csvfile:
+            self.assertEqual(list(csv.reader(csvfile)), [["Mediators", "Exposure counts", "Outcome counts", "Scores"],
+                                                          ["Gene A", "2", "1", "1.5"]])
+
     def test_createjson(self):
         """edges, genelist, mediatormesh, exposuremesh, outcomemesh, results_path, resultfilename
 
@@ -1154,6 +1805,25 @@ class MatchingTestCase(BaseTestCase):
             sorted_links = sorted(links, key=lambda item: (item['source'], item['target']))
             self.assertEqual(sorted_expected_links, sorted_links)
 
+    def test_createjson_escapes_names(self):
+        """Names containing quotes should still give a valid JSON document, with links to the first node of a given name."""
+        edges = np.array([
+            [1, 2],
+            [3, 0],
+            [1, 1]])
+        results_file_name = "test_createjson_escapes_names"
+        createjson(edges, ['Gene "A"', ], ["Mediator B", "Exposure \\ C", ], ["Exposure \\ C", ], ["Outcome D", ], settings.RESULTS_PATH, results_file_name)
+        with open(settings.RESULTS_PATH + results_file_name + ".json", 'r') as json_file:
+            json_data = json.loads(json_file.read())
+        self.assertEqual(json_data["nodes"], [{"name": 'Gene "A"', "id": "0"},
+                                              {"name": "Exposure \\ C", "id": "1"},
+                                              {"name": "Exposure \\ C", "id": "2"},
+                                              {"name": "Outcome D", "id": "3"}])
+        self.assertEqual(json_data["links"], [{"source": 1, "target": 0, "value": 1},
+                                              {"source": 0, "target": 3, "value": 2},
+                                              {"source": 1, "target": 1, "value": 1},
+                                              {"source": 1, "target": 3, "value": 1}])
+
     def _prepare_gene_matches_only_search_result(self):
         """Generates a search result object and associated edge file
 
@@ -1428,6 +2098,342 @@ class MatchingTestCase(BaseTestCase):
         searchstring = "RP11-153M24.1"
         self.assertFalse(searchgene(texttosearch, searchstring) == None)
 
+    def test_gene_matcher_agrees_with_searchgene(self):
+        """TMM-394 The Aho-Corasick gene matcher should find the same genes as searching for each synonym in turn."""
+        synonymlookup = self._get_synonym_lookup()
+        synonymlisting = self._get_synonym_listing()
+        synonymlookup["RP11-153M24.1"] = ["RP11-153M24.1", "Example Gene A", ]
+        synonymlisting["RP11-153M24.1"] = ["RP11-153M24.1", ]
+        genelist = self._get_genes_list() + ["RP11-153M24.1", "Example Gene X", "Unknown Gene", ]
+        gene_matcher = GeneMatcher(genelist, expand_gene_synonyms(genelist, synonymlookup, synonymlisting))
+        texts = (b"Example Gene B at the start and EXAMPLE GENE SYM C in the middle. ",
+                 b" Example Gene B2, overlapping Example Gene B and example gene b2. ",
+                 b" Example Gene B2_ is not a match and nor is #Example Gene A. ",
+                 b" rp11-153m24.1 matched the start of example gene a ",
+                 b" Unknown Gene",
+                 b"Unknown Gene ",
+                 b" Unknown Gene. ",
+                 b"", )
+        for text in texts:
+            expected = set()
+            for gene in genelist:
+                for matched_gene in synonymlookup.get(gene, (gene, )):
+                    if any(searchgene(text, synonym) is not None for synonym in synonymlisting.get(matched_gene, (matched_gene, ))):
+                        expected.add(gene)
+            self.assertEqual(gene_matcher.matching_genes(text), expected, msg=text)
+
+        self.assertEqual(gene_matcher.matching_genes(texts[0]), {"Example Gene C", })
+        self.assertEqual(gene_matcher.matching_genes(texts[1]), {"Example Gene B", "Example Gene B2", })
+        self.assertEqual(gene_matcher.matching_genes(texts[3]), {"RP11-153M24.1", "Example Gene A", })
+
+    def test_count_edges_mediators_in_citations_without_abstracts(self):
+        """Mediator matches in a citation without an abstract section should not be recorded against gene rows."""
+        citation = Citation(1)
+        citation.addfield(b"Unique Identifier")
+        citation.addfieldcontent(b"999991")
+        citation.addfield(b"MeSH Subject Headings")
+        citation.addfieldcontent(b";Cells;;Fictional MeSH Term B;;Serogroup;")
+        edges = np.zeros(shape=(6, 6), dtype=np.dtype(int))
+        papercounter, edges, identifiers = countedges([citation, ], self._get_genes_list(),
+                self._get_synonym_lookup(), self._get_synonym_listing(), self._get_exposure_list(),
+                dict(), edges, self._get_outcome_list(), self._get_mediator_list(), None,
+                settings.RESULTS_PATH, "test_count_edges_without_abstracts", file_format=OVID)
+        self.assertEqual(papercounter, 1)
+        expected_edges = np.zeros(shape=(6, 6), dtype=np.dtype(int))
+        expected_edges[5] = [1, 0, 0, 0, 0, 1]
+        self.assertTrue(np.array_equal(edges, expected_edges))
+        os.remove(settings.RESULTS_PATH + "test_count_edges_without_abstracts_abstracts.csv")
+
+    def test_count_edges_batch_sizes(self):
+        """Edge counts, paper counts and abstract IDs should not depend on the number of citations accumulated per batch."""
+        results = []
+        for batch_size in (1, 2, settings.MATCHING_BATCH_SIZE):
+            edges = np.zeros(shape=(6, 6), dtype=np.dtype(int))
+            papercounter, edges, identifiers = countedges(self._get_ovid_citation_generator(), self._get_genes_list(),
+                    self._get_synonym_lookup(), self._get_synonym_listing(), self._get_exposure_list(),
+                    dict(), edges, self._get_outcome_list(), self._get_mediator_list(), None,
+                    settings.RESULTS_PATH, "test_count_edges_batch_sizes", file_format=OVID, batch_size=batch_size)
+            with open(settings.RESULTS_PATH + "test_count_edges_batch_sizes_abstracts.csv", newline='') as csv_file:
+                results.append((papercounter, edges.tolist(), csv_file.read()))
+            os.remove(settings.RESULTS_PATH + "test_count_edges_batch_sizes_abstracts.csv")
+
+        self.assertEqual(results[0][0], 2)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+
+    def test_find_citation_boundaries(self):
+        """Shards should start at citation boundaries and together contain every citation exactly once."""
+        for file_name, file_format in (("ovid_result_100.txt", OVID), ("pubmed_result_100.txt", PUBMED), ):
+            file_path = os.path.join(BASE_DIR, file_name)
+            expected_citations = [citation.fields for citation in read_citations(file_path, file_format)]
+            for shard_count in (1, 2, 7, 500):
+                shards = find_citation_boundaries(file_path, file_format, shard_count)
+                self.assertTrue(len(shards) <= shard_count)
+                self.assertEqual(shards[0][0], 0)
+                self.assertEqual(shards[-1][1], os.path.getsize(file_path))
+                citations = [citation.fields for start, end in shards for citation in read_citations(file_path, file_format, start, end)]
+                self.assertEqual(citations, expected_citations)
+
+    def test_read_citations_memory_mapped(self):
+        """Citations read from a memory mapped file should match the line by line readers, only materialising fields when looked up."""
+        for file_name, file_format, line_reader in (("ovid_result_100.txt", OVID, _ovid_medline_read_citations),
+                                                    ("pubmed_result_100.txt", PUBMED, _pubmed_read_citations),
+                                                    ("test-abstract.txt", OVID, _ovid_medline_read_citations),
+                                                    ("test-abstract-pubmed-1.txt", PUBMED, _pubmed_read_citations), ):
+            file_path = os.path.join(BASE_DIR, file_name)
+            expected_citations = [(citation.id, citation.offset, citation.fields) for citation in line_reader(file_path)]
+            citations = list(read_citations(file_path, file_format))
+            self.assertTrue(citations)
+            for citation in citations:
+                self.assertIsInstance(citation.fields, MappedFields)
+                self.assertEqual(citation.fields._values, {})
+            self.assertEqual([(citation.id, citation.offset, dict(citation.fields)) for citation in citations], expected_citations)
+
+        citation = next(read_citations(os.path.join(BASE_DIR, "ovid_result_100.txt"), OVID))
+        self.assertTrue(citation.fields[b"Abstract"].startswith(b"  BACKGROUND/AIM: 1alpha,25(OH)2D has been shown"))
+        self.assertEqual(list(citation.fields._values), [b"Abstract"])
+        with self.assertRaises(AttributeError):
+            citation.unused_attribute = True
+
+        # Empty files cannot be memory mapped so are read by the line by line readers
+        for file_format, line_reader in ((OVID, _ovid_medline_read_citations), (PUBMED, _pubmed_read_citations), ):
+            upload = Upload(user=self.user, abstracts_upload=File(io.BytesIO(b""), "empty.txt"), file_format=file_format)
+            upload.save()
+            with mock.patch("browser.matching.%s" % line_reader.__name__, wraps=line_reader) as mock_line_reader:
+                self.assertEqual(list(read_citations(upload.abstracts_upload.path, file_format)), [])
+            mock_line_reader.assert_called_once_with(upload.abstracts_upload.path, 0, None)
+            upload.delete()
+
+    def test_read_citations_compressed(self):
+        """Citations read from gzip and bzip2 compressed uploads should match those read from the uncompressed file."""
+        for file_name, file_format in (("ovid_result_100.txt", OVID), ("pubmed_result_100.txt", PUBMED), ):
+            file_path = os.path.join(BASE_DIR, file_name)
+            expected_citations = [(citation.id, dict(citation.fields)) for citation in read_citations(file_path, file_format)]
+            for extension in (".gz", ".bz2", ):
+                compressed_file_path = file_path + extension
+                self.assertEqual(find_citation_boundaries(compressed_file_path, file_format, 3), [(0, None), ])
+                self.assertEqual([(citation.id, citation.fields) for citation in read_citations(compressed_file_path, file_format)], expected_citations)
+
+                with open(compressed_file_path, 'rb') as test_file:
+                    upload = Upload(user=self.user, abstracts_upload=File(test_file, file_name + extension), file_format=file_format)
+                    upload.save()
+                citation_store = get_citation_store(upload.abstracts_upload.path, file_format)
+                self.assertEqual(len(citation_store), 100)
+                self.assertEqual([citation.id for start, end in citation_store.find_citation_boundaries(3)
+                                  for citation in read_citations(upload.abstracts_upload.path, file_format, start, end, citation_store)],
+                                 [citation_id for citation_id, fields in expected_citations])
+                upload.delete()
+
+    def test_count_edges_in_shards(self):
+        """Matching shards of a file in parallel should give the same results as countedges."""
+        genelist = self._get_genes_list()
+        exposuremesh = ["Humans", "Animals", ]
+        outcomemesh = ["Male", "Female", ]
+        mediatormesh = ["Adult", "Aged", "Middle Aged", "Adolescent", "Young Adult", ]
+        for file_name, file_format in (("ovid_result_100.txt", OVID), ("pubmed_result_100.txt", PUBMED), ):
+            file_path = os.path.join(BASE_DIR, file_name)
+            results = []
+            for workers in (None, 3, ):
+                edges, identifiers = create_edge_matrix(len(genelist), len(mediatormesh), len(exposuremesh), len(outcomemesh))
+                if workers:
+                    papercounter, edges, identifiers = countedges_in_shards(file_path, genelist,
+                            self._get_synonym_lookup(), self._get_synonym_listing(), exposuremesh, identifiers, edges,
+                            outcomemesh, mediatormesh, None, settings.RESULTS_PATH, "test_count_edges_in_shards",
+                            file_format=file_format, workers=workers)
+                else:
+                    papercounter, edges, identifiers = countedges(read_citations(file_path, file_format), genelist,
+                            self._get_synonym_lookup(), self._get_synonym_listing(), exposuremesh, identifiers, edges,
+                            outcomemesh, mediatormesh, None, settings.RESULTS_PATH, "test_count_edges_in_shards",
+                            file_format=file_format)
+                with open(settings.RESULTS_PATH + "test_count_edges_in_shards_abstracts.csv", newline='') as csv_file:
+                    results.append((papercounter, edges.tolist(), csv_file.read()))
+                os.remove(settings.RESULTS_PATH + "test_count_edges_in_shards_abstracts.csv")
+
+            self.assertTrue(results[0][0] > 0)
+            self.assertEqual(results[0], results[1])
+
+    def test_match_plan(self):
+        """A MatchPlan should hold the row and column labels and expanded synonyms, and give the same counts as countedges."""
+        match_plan = MatchPlan(self._get_genes_list(), expand_gene_synonyms(self._get_genes_list(), self._get_synonym_lookup(), self._get_synonym_listing()),
+                               self._get_exposure_list(), self._get_outcome_list(), self._get_mediator_list(), None)
+        self.assertEqual(match_plan.shape, (6, 6))
+        self.assertEqual(match_plan.row_labels, tuple(self._get_genes_list()) + tuple(self._get_mediator_list()))
+        self.assertEqual(match_plan.column_labels, tuple(self._get_exposure_list()) + tuple(self._get_outcome_list()))
+        self.assertEqual(match_plan.row_ids["Fictional MeSH Term B"], 5)
+        self.assertEqual(match_plan.first_mediator_row_id, 4)
+        for gene in self._get_genes_list():
+            self.assertTrue(gene in match_plan.gene_synonyms)
+
+        edges = np.zeros(shape=match_plan.shape, dtype=np.dtype(int))
+        papercounter, edges, identifiers = countedges(self._get_ovid_citation_generator(), None, None, None, None, dict(), edges,
+                None, None, None, settings.RESULTS_PATH, "test_match_plan", file_format=OVID, match_plan=match_plan)
+        expected_edges = np.zeros(shape=(6, 6), dtype=np.dtype(int))
+        papercounter_without_plan, expected_edges, identifiers = countedges(self._get_ovid_citation_generator(), self._get_genes_list(),
+                self._get_synonym_lookup(), self._get_synonym_listing(), self._get_exposure_list(), dict(), expected_edges,
+                self._get_outcome_list(), self._get_mediator_list(), None, settings.RESULTS_PATH, "test_match_plan", file_format=OVID)
+        self.assertEqual(papercounter, papercounter_without_plan)
+        self.assertTrue(np.array_equal(edges, expected_edges))
+        os.remove(settings.RESULTS_PATH + "test_match_plan_abstracts.csv")
+
+    def test_get_match_plan(self):
+        """Match plans should be memoised in the cache by a hash of the search criteria."""
+        criteria = (["TP53", "BRCA1", ], ["Humans", ], ["Male", ], ["Adult", ], "Humans")
+        self.assertEqual(match_plan_key(*criteria), match_plan_key(*criteria))
+        self.assertNotEqual(match_plan_key(*criteria), match_plan_key(["TP53", ], ["Humans", ], ["Male", ], ["Adult", ], "Humans"))
+        self.assertNotEqual(match_plan_key(*criteria), match_plan_key(["TP53", "BRCA1", ], ["Humans", ], ["Male", ], ["Adult", ], ""))
+
+        cache_key = "temmpo:match_plan:%s" % match_plan_key(*criteria)
+        cache.delete(cache_key)
+        match_plan = get_match_plan(*criteria)
+        self.assertEqual(match_plan.key, match_plan_key(*criteria))
+        self.assertEqual(match_plan.row_labels, ("TP53", "BRCA1", "Adult", ))
+        self.assertEqual(cache.get(cache_key).key, match_plan.key)
+        cached_match_plan = get_match_plan(*criteria)
+        self.assertEqual(cached_match_plan.key, match_plan.key)
+        self.assertEqual(cached_match_plan.gene_synonyms, match_plan.gene_synonyms)
+        cache.delete(cache_key)
+
+    def test_citation_store(self):
+        """Citations streamed from an upload's store should match the fields and MeSH tokens read from the file."""
+        for file_name, file_format, field_names in (("ovid_result_100.txt", OVID, (b"Unique Identifier", b"MeSH Subject Headings", b"Abstract")),
+                                                    ("pubmed_result_100.txt", PUBMED, (b"PMID", b"MH", b"AB")), ):
+            upload = self._prepare_base_search_criteria(2018, file_name, file_format).upload
+            file_path = upload.abstracts_upload.path
+            store_path, abstracts_path, gene_mention_index_path = citation_store_paths(file_path)
+            self.assertFalse(os.path.exists(store_path))
+
+            # A search stopped while its upload's store is written leaves no partly written files
+            def stopped_citations():
+                yield from itertools.islice(read_citations(file_path, file_format), 10)
+                raise SearchStopped(CANCELLED)
+            with self.assertRaises(SearchStopped):
+                CitationStore.create(file_path, stopped_citations(), *field_names)
+            self.assertEqual(glob.glob(store_path + "*") + glob.glob(abstracts_path + "*"), [])
+
+            citation_store = get_citation_store(file_path, file_format)
+            self.assertTrue(os.path.exists(store_path))
+            self.assertTrue(os.path.exists(abstracts_path))
+            self.assertEqual(len(citation_store), 100)
+
+            unique_id, mesh_subject_headings, abstract = field_names
+            stored_citations = list(read_citations(file_path, file_format, citation_store=citation_store))
+            for citation, stored_citation in zip(read_citations(file_path, file_format), stored_citations):
+                self.assertEqual(stored_citation.id, citation.id)
+                self.assertEqual(stored_citation.fields.get(unique_id), citation.fields.get(unique_id))
+                self.assertEqual(stored_citation.fields.get(abstract), citation.fields.get(abstract))
+                self.assertEqual(stored_citation.get_mesh_tokens(mesh_subject_headings), citation.get_mesh_tokens(mesh_subject_headings))
+            self.assertEqual(len(stored_citations), 100)
+
+            # Shards of the store cover every citation once
+            shards = citation_store.find_citation_boundaries(7)
+            self.assertEqual(len(shards), 7)
+            self.assertEqual([citation.id for start, end in shards for citation in read_citations(file_path, file_format, start, end, citation_store)],
+                             [citation.id for citation in stored_citations])
+
+            # Abstracts are stored compressed, and read the same from blocks smaller than an abstract
+            self.assertLess(os.path.getsize(abstracts_path), sum(len(citation.fields[abstract]) for citation in stored_citations if abstract in citation.fields))
+            expected_abstracts = list(citation_store.abstracts())
+            expected_shard = [(citation.id, citation.fields) for citation in citation_store.citations(*shards[3])]
+            with mock.patch("browser.citation_store.ABSTRACT_BLOCK_SIZE", 1):
+                citation_store = CitationStore.create(file_path, read_citations(file_path, file_format), *field_names)
+            self.assertEqual(len(citation_store._load("abstract_block_starts")), len(expected_abstracts) + 1)
+            self.assertEqual([(citation.id, citation.fields) for citation in citation_store.citations(*shards[3])], expected_shard)
+            self.assertEqual(list(citation_store.abstracts()), expected_abstracts)
+
+            # The store is reused by later searches and removed with the upload
+            store_modified = os.path.getmtime(store_path)
+            self.assertEqual(len(get_citation_store(file_path, file_format)), 100)
+            self.assertEqual(os.path.getmtime(store_path), store_modified)
+
+            # but not when the upload is replaced by a file of the same size
+            with open(file_path, 'r+b') as abstracts_file:
+                replaced_contents = abstracts_file.read()[::-1]
+                abstracts_file.seek(0)
+                abstracts_file.write(replaced_contents)
+            os.utime(file_path, ns=(citation_store.source_mtime + 1, citation_store.source_mtime + 1))
+            self.assertFalse(citation_store.is_current())
+            upload.delete()
+            self.assertFalse(os.path.exists(store_path))
+            self.assertFalse(os.path.exists(abstracts_path))
+
+    def test_count_edges_from_index(self):
+        """Counting a search without genes from an upload's inverted MeSH heading index should give the same results as countedges."""
+        exposuremesh = ["Humans", "Animals", ]
+        outcomemesh = ["Male", "Female", "Genetics", ]
+        mediatormesh = ["Adult", "Aged", "Middle Aged", "Adolescent", "Young Adult", "Fictional MeSH Term A", ]
+        for file_name, file_format in (("ovid_result_100.txt", OVID), ("pubmed_result_100.txt", PUBMED), ):
+            upload = self._prepare_base_search_criteria(2018, file_name, file_format).upload
+            file_path = upload.abstracts_upload.path
+            citation_store = get_citation_store(file_path, file_format)
+            for mesh_filter in (None, "Humans", "Fictional MeSH Term A", ):
+                match_plan = MatchPlan([], dict(), exposuremesh, outcomemesh, mediatormesh, mesh_filter)
+                results = []
+                for use_index in (False, True, ):
+                    edges, identifiers = create_edge_matrix(0, len(mediatormesh), len(exposuremesh), len(outcomemesh))
+                    if use_index:
+                        papercounter, edges = countedges_from_index(citation_store, match_plan, edges, settings.RESULTS_PATH, "test_count_edges_from_index")
+                    else:
+                        papercounter, edges, identifiers = countedges(read_citations(file_path, file_format), [], dict(), dict(), exposuremesh, identifiers, edges,
+                                outcomemesh, mediatormesh, mesh_filter, settings.RESULTS_PATH, "test_count_edges_from_index", file_format=file_format)
+                    abstracts_file_path = settings.RESULTS_PATH + "test_count_edges_from_index_abstracts.csv"
+                    abstract_ids = None
+                    if os.path.exists(abstracts_file_path):
+                        with open(abstracts_file_path, newline='') as csv_file:
+                            abstract_ids = csv_file.read()
+                        os.remove(abstracts_file_path)
+                    results.append((papercounter, edges.tolist(), abstract_ids))
+
+                self.assertEqual(results[0], results[1])
+                if mesh_filter == "Fictional MeSH Term A":
+                    self.assertEqual(results[1][0], 0)
+                else:
+                    self.assertTrue(results[1][0] > 0)
+            upload.delete()
+
+    def test_count_edges_from_gene_mention_index(self):
+        """Counting a search with genes from an upload's gene mention index should give the same results as countedges."""
+        genelist = ["VDR", "CYP24A1", "TMPRSS2", "ETS", "Example Gene A", ]
+        synonymlookup = {"VDR": ["VDR", ], "CYP24": ["CYP24A1", ], "CYP24A1": ["CYP24A1", ], "TMPRSS2": ["TMPRSS2", ], "ETS": ["ETS", ], }
+        synonymlisting = {"VDR": ["NR1I1", "VDR", ], "CYP24A1": ["CYP24", "P450-CC24", "CYP24A1", ], "TMPRSS2": ["PRSS10", "TMPRSS2", ], "ETS": ["ETS", ], }
+        exposuremesh = ["Humans", "Calcitriol", ]
+        outcomemesh = ["Prostatic Neoplasms", "Male", ]
+        mediatormesh = ["Receptors, Calcitriol", "Vitamin D", ]
+
+        upload = self._prepare_base_search_criteria(2018, "ovid_result_100.txt", OVID).upload
+        file_path = upload.abstracts_upload.path
+        citation_store = get_citation_store(file_path, OVID)
+        self.assertEqual(get_gene_mention_index(citation_store), None)
+        synonyms = set(synonym for synonyms in synonymlisting.values() for synonym in synonyms)
+        gene_mention_index = GeneMentionIndex.create(citation_store, synonyms)
+        self.assertTrue(get_gene_mention_index(citation_store).is_current())
+
+        match_plan = MatchPlan(genelist, expand_gene_synonyms(genelist, synonymlookup, synonymlisting), exposuremesh, outcomemesh, mediatormesh, None)
+        # Example Gene A is not a known synonym so is not covered by the index
+        self.assertFalse(gene_mention_index.covers(match_plan.gene_synonyms["Example Gene A"]))
+        self.assertTrue(gene_mention_index.covers(match_plan.gene_synonyms["CYP24A1"]))
+
+        results = []
+        for use_index in (False, True, ):
+            edges, identifiers = create_edge_matrix(len(genelist), len(mediatormesh), len(exposuremesh), len(outcomemesh))
+            if use_index:
+                papercounter, edges = countedges_from_index(citation_store, match_plan, edges, settings.RESULTS_PATH, "test_count_edges_from_gene_mention_index", gene_mention_index)
+            else:
+                papercounter, edges, identifiers = countedges(read_citations(file_path, OVID), genelist, synonymlookup, synonymlisting, exposuremesh, identifiers, edges,
+                        outcomemesh, mediatormesh, None, settings.RESULTS_PATH, "test_count_edges_from_gene_mention_index", file_format=OVID)
+            with open(settings.RESULTS_PATH + "test_count_edges_from_gene_mention_index_abstracts.csv", newline='') as csv_file:
+                results.append((papercounter, edges.tolist(), csv_file.read()))
+            os.remove(settings.RESULTS_PATH + "test_count_edges_from_gene_mention_index_abstracts.csv")
+
+        self.assertEqual(results[0], results[1])
+        self.assertTrue(results[1][1][0][0] > 0)
+
+        # Background job indexes all known gene synonyms, and the index is removed with the upload
+        os.remove(citation_store.gene_mention_index_path)
+        build_gene_mention_index(upload.id)
+        self.assertTrue(get_gene_mention_index(citation_store).is_current())
+        upload.delete()
+        self.assertFalse(os.path.exists(citation_store.gene_mention_index_path))
+
     def test_missing_matches_in_256_simple_terms(self):
         """
         NB: Appears to work when Adenosine and other terms are mocked.  However, when fixture is used, mulitple terms exist and it doesn't work.  Corerction: - Code working as expected.  Outcomes only includes a partial match for Male.
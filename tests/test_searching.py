@@ -552,7 +552,7 @@ class SearchingTestCase(BaseTestCase):
         path = reverse('filter_selector', kwargs={'pk': search_criteria.id})
         response = self.client.post(path, follow=True) # Need to investigate filter not working
         search_result = SearchResult.objects.get(criteria=search_criteria)
-        self._find_expected_content(reverse("results_bubble", kwargs={'pk': search_result.id}), msg_list=["d3", "www.gstatic.com/charts/loader.js", "jquery", reverse('count_data', kwargs={'pk': search_result.id})])
+        self._find_expected_content(reverse("results_bubble", kwargs={'pk': search_result.id}), msg_list=["d3", "www.gstatic.com/charts/loader.js", "jquery", reverse('count_data', kwargs={'pk': search_result.id}), reverse('mediators_data', kwargs={'pk': search_result.id})])
 
     def test_sankey_inclusions(self):
         search_criteria = self._set_up_test_search_criteria()
@@ -774,10 +774,10 @@ class SearchingTestCase(BaseTestCase):
         # Check files...
         # Check abstract
         self.assertTrue(os.path.exists(upload_record.abstracts_upload.file.name))
-        # Check results and terms files
+        # Check results and terms files, including the saved edge matrix
         base_path = settings.RESULTS_PATH + search_result.filename_stub + '*'
         files_to_delete = glob.glob(base_path)
-        self.assertEqual(len(files_to_delete), 3)
+        self.assertEqual(len(files_to_delete), 8)
 
         # Do deletion
         response = self.client.post(reverse('delete_data', kwargs={'pk': search_result.id}), follow=True)
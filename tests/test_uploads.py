@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 import logging
 import os
+from unittest import mock
 
 import magic
 
 from django.urls import reverse
 from django.test import tag
 
+from browser.compression import DecompressedFileTooLarge, check_decompresses, is_compressed, open_abstracts_file
+from browser.forms import PubMedFileUploadForm
+from browser.matching import build_gene_mention_index
 from browser.models import Upload, OVID, PUBMED
+from browser.queues import INDEX_QUEUE
 
 from tests.base_test_case import BaseTestCase
 
@@ -113,7 +118,10 @@ class UploadTestCase(BaseTestCase):
         self.assertNotContains(response, "is not a plain text file")
         self.assertEqual(Upload.objects.all().count(), previous_upload_count + 1)
         upload = Upload.objects.all().order_by("id").last().abstracts_upload
-        mime_type = magic.from_buffer(upload.file.read(1024), mime=True)
+        # Archives are stored as uploaded and decompressed as they are read
+        self.assertEqual(is_compressed(upload.path), test_archive_file.endswith((".gz", ".bz2")))
+        with open_abstracts_file(upload.path) as abstracts:
+            mime_type = magic.from_buffer(abstracts.read(1024), mime=True)
         self.assertEqual(mime_type, "text/plain")
 
     def test_bz2_pub_med_upload_is_allowable(self):
@@ -136,6 +144,41 @@ class UploadTestCase(BaseTestCase):
     def test_gzip_ovid_upload_is_allowable(self):
         self._assert_file_is_uploaded_and_extracted_where_required(TEST_GZIP_OVID_ARCHIVE, reverse('search_ovid_medline'))
 
+    def test_check_decompresses_limits_decompressed_size(self):
+        with open(TEST_GZIP_PUB_MED_SMALL_ARCHIVE, 'rb') as archive:
+            size = check_decompresses(archive)
+            self.assertGreater(size, os.path.getsize(TEST_GZIP_PUB_MED_SMALL_ARCHIVE))
+            self.assertEqual(check_decompresses(archive, max_size=size), size)
+            self.assertRaises(DecompressedFileTooLarge, check_decompresses, archive, max_size=size - 1)
+            self.assertEqual(archive.tell(), 0)
+
+    def test_archive_too_large_once_extracted_is_rejected(self):
+        previous_upload_count = Upload.objects.all().count()
+        # NB: Maximum size in MB, less than the archive's size once extracted
+        self._login_user()
+        with mock.patch.object(PubMedFileUploadForm.base_fields['abstracts_upload'], 'max_decompressed_size', 0.01):
+            with open(TEST_BZ_PUB_MED_SMALL_ARCHIVE, 'rb') as upload:
+                response = self.client.post(reverse('search_pubmed'),
+                                            {'abstracts_upload': upload,
+                                             'file_format': PUBMED},
+                                            format='multipart',
+                                            secure=True)
+        self.assertEqual(Upload.objects.all().count(), previous_upload_count)
+        self.assertContains(response, "is too large once extracted")
+
+    def test_gene_mention_index_is_built_on_index_queue(self):
+        self._login_user()
+        with self.settings(BUILD_GENE_MENTION_INDEX=True), mock.patch('browser.views.django_rq.get_queue') as get_queue:
+            with open(TEST_BZ_PUB_MED_SMALL_ARCHIVE, 'rb') as upload:
+                self.client.post(reverse('search_pubmed'),
+                                 {'abstracts_upload': upload,
+                                  'file_format': PUBMED},
+                                 format='multipart',
+                                 secure=True)
+        upload = Upload.objects.all().order_by("id").last()
+        get_queue.assert_called_once_with(INDEX_QUEUE)
+        get_queue.return_value.enqueue.assert_called_once_with(build_gene_mention_index, upload.id)
+
     def _assert_invalid_pub_med_archive_fail(self, test_archive_file):
         previous_upload_count = Upload.objects.all().count()
         response = self._setup_file_upload_response(test_archive_file, reverse('search_pubmed'))